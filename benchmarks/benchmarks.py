@@ -0,0 +1,273 @@
+"""Benchmarks for each stage of `unpack` and the analysis helpers.
+
+Run with asv (`asv run`, `asv continuous master HEAD`) to track regressions across commits. Every benchmark runs on a synthetic file written by `prickle.generate`; set the PRICKLE_BENCH_RATE environment variable (messages per second, default 2000) to change the size of the file.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+import prickle as pk
+
+
+VERSION = 4.1
+DATE = '010113'
+NLEVELS = 10
+NAMES = ['SYN000', 'SYN001', 'SYN002']
+RATE = int(os.environ.get('PRICKLE_BENCH_RATE', 2000))
+DURATION = 60
+
+
+def _generate():
+    """Write a synthetic data file and unpack it to CSV and HDF5."""
+    root = tempfile.mkdtemp(prefix='prickle-bench-')
+    fin = os.path.join(root, 'S{}-v41.bin'.format(DATE))
+    pk.generate(fin, ver=VERSION, ntickers=10, rate=RATE, duration=DURATION, seed=0)
+    pk.unpack(fin, VERSION, DATE, NLEVELS, NAMES, method='hdf5', fout=os.path.join(root, 'itch.hdf5'))
+    pk.unpack(fin, VERSION, DATE, NLEVELS, NAMES, method='csv', fout=os.path.join(root, 'csv'))
+    return root
+
+
+def _read(fin):
+    """Return the raw (message_type, message_bytes) pairs of a data file."""
+    raw = []
+    with open(fin, 'rb') as data:
+        while True:
+            header = data.read(3)
+            if len(header) < 3:
+                break
+            size = (header[0] << 8) | header[1]
+            raw.append((chr(header[2]), data.read(size - 1)))
+    return raw
+
+
+def _reconstruct(messages, names, nlevels):
+    """Apply decoded messages to an Orderlist and Booklist (as `unpack` does)."""
+    orderlist = pk.Orderlist()
+    booklist = pk.Booklist(DATE, names, nlevels, 'hdf5')
+    for message_type, message in messages:
+        if message_type == 'U':
+            message, del_message, add_message = message.split()
+            orderlist.complete_message(message)
+            orderlist.complete_message(del_message)
+            orderlist.complete_message(add_message)
+            if message.name in names:
+                orderlist.update(del_message)
+                booklist.update(del_message)
+                orderlist.add(add_message)
+                booklist.update(add_message)
+        elif message_type in ('E', 'C', 'X', 'D'):
+            orderlist.complete_message(message)
+            if message.name in names:
+                orderlist.update(message)
+                booklist.update(message)
+        elif message_type in ('A', 'F'):
+            if message.name in names:
+                orderlist.add(message)
+                booklist.update(message)
+    return booklist
+
+
+class Base():
+
+    timeout = 600
+
+    def setup_cache(self):
+        return _generate()
+
+    def fin(self, root):
+        return os.path.join(root, 'S{}-v41.bin'.format(DATE))
+
+
+class Decode(Base):
+    """Decoding binary messages (`get_message`/`protocol` and the readers)."""
+
+    def setup(self, root):
+        self.raw = _read(self.fin(root))
+
+    def time_get_message(self, root):
+        for message_type, message_bytes in self.raw:
+            pk.get_message(message_bytes, message_type, DATE, 0, VERSION)
+
+    def time_reader(self, root):
+        for _ in pk.Reader(self.fin(root), VERSION, DATE):
+            pass
+
+    def time_parallel_reader(self, root):
+        orders = {}
+        for _ in pk.ParallelReader(self.fin(root), VERSION, DATE, NAMES, orders, 2, 2 ** 20):
+            pass
+
+    def track_messages_per_second(self, root):
+        reader = pk.Reader(self.fin(root), VERSION, DATE)
+        start = time.perf_counter()
+        for _ in reader:
+            pass
+        return reader.reads / (time.perf_counter() - start)
+    track_messages_per_second.unit = 'messages/s'
+
+
+class Reconstruct(Base):
+    """Order book reconstruction (`Orderlist` and `Book.update`)."""
+
+    number = 1
+    repeat = 5
+
+    def setup(self, root):
+        # messages are modified during reconstruction, so decode them for every run
+        self.messages = list(pk.Reader(self.fin(root), VERSION, DATE))
+
+    def time_reconstruct(self, root):
+        _reconstruct(self.messages, NAMES, NLEVELS)
+
+
+class Snapshot(Base):
+    """Order book snapshots (`Book.to_values`, `Book.to_array` and `Book.to_txt`)."""
+
+    def setup(self, root):
+        messages = list(pk.Reader(self.fin(root), VERSION, DATE))
+        booklist = _reconstruct(messages, NAMES, NLEVELS)
+        self.book = booklist.books[NAMES[0]]['cur']
+
+    def time_to_values(self, root):
+        for _ in range(10 ** 4):
+            self.book.to_values()
+
+    def time_to_array(self, root):
+        for _ in range(10 ** 4):
+            self.book.to_array()
+
+    def time_to_txt(self, root):
+        for _ in range(10 ** 4):
+            self.book.to_txt()
+
+
+class Flush():
+    """Writing buffers to a database (`Messagelist` and `Booklist`)."""
+
+    params = ['hdf5', 'csv']
+    param_names = ['method']
+    number = 1
+    repeat = 5
+    timeout = 600
+
+    def setup_cache(self):
+        return _generate()
+
+    def setup(self, root, method):
+        fin = os.path.join(root, 'S{}-v41.bin'.format(DATE))
+        messages = list(pk.Reader(fin, VERSION, DATE))
+        self.booklist = pk.Booklist(DATE, NAMES, NLEVELS, method)
+        for name, book in _reconstruct(messages, NAMES, NLEVELS).books.items():
+            self.booklist.books[name]['hist'] = [book['cur'].to_values()] * 10 ** 4
+        self.messagelist = pk.Messagelist(DATE, NAMES)
+        for _, message in pk.Reader(fin, VERSION, DATE):
+            if message.type in ('A', 'F') and message.name in NAMES:
+                if len(self.messagelist.messages[message.name]) < 10 ** 4:
+                    self.messagelist.add(message)
+        self.tmp = tempfile.mkdtemp(prefix='prickle-flush-')
+        if method == 'hdf5':
+            self.db = pk.Database(os.path.join(self.tmp, 'itch.hdf5'), NAMES, NLEVELS, method)
+        else:
+            self.db = pk.Database(os.path.join(self.tmp, 'csv'), NAMES, NLEVELS, method)
+
+    def teardown(self, root, method):
+        self.db.close()
+        shutil.rmtree(self.tmp)
+
+    def time_messages(self, root, method):
+        for name in NAMES:
+            if method == 'hdf5':
+                self.messagelist.to_hdf5(name, self.db, 'messages')
+            else:
+                self.messagelist.to_txt(name, self.db, 'messages')
+
+    def time_books(self, root, method):
+        for name in NAMES:
+            if method == 'hdf5':
+                self.booklist.to_hdf5(name, self.db)
+            else:
+                self.booklist.to_txt(name, self.db)
+
+
+class Kernels(Base):
+    """Numeric kernels (`reconstruct` and `aggregate_trades`)."""
+
+    def setup(self, root):
+        self.messages = pk.load_hdf5(os.path.join(root, 'itch.hdf5'), NAMES[0], 'messages').values
+        self.executions = pd.read_csv(os.path.join(root, 'csv', 'messages', 'messages_{}.txt'.format(NAMES[0])))
+        self.executions['time'] = self.executions['sec'] + self.executions['nano'] / 10 ** 9
+        self.executions = self.executions[self.executions.type == 'E']
+        pk.reconstruct(self.messages[:10], NLEVELS)  # compile
+
+    def time_reconstruct(self, root):
+        pk.reconstruct(self.messages, NLEVELS)
+
+    def time_aggregate_trades(self, root):
+        pk.aggregate_trades(self.executions['time'].values,
+                            (self.executions['side'] == 'B').values.astype('int64'),
+                            self.executions['shares'].values,
+                            self.executions['price'].values,
+                            10 ** -6)
+
+
+class Load(Base):
+    """Loading and analysing output (`load_hdf5`, `find_trades`, `interpolate`, `resample` and `merge`)."""
+
+    def setup(self, root):
+        self.db = os.path.join(root, 'itch.hdf5')
+        self.messages = pd.read_csv(os.path.join(root, 'csv', 'messages', 'messages_{}.txt'.format(NAMES[0])))
+        self.messages['time'] = self.messages['sec'] + self.messages['nano'] / 10 ** 9
+        prices, _ = pk.load_hdf5(self.db, NAMES[0], 'books')
+        self.books = prices
+        prices.index = prices['ns'] / 10 ** 9
+        self.prices = prices.drop(['sec', 'nano', 'ns'], axis=1)
+
+    def time_load_messages(self, root):
+        pk.load_hdf5(self.db, NAMES[0], 'messages')
+
+    def time_load_books(self, root):
+        pk.load_hdf5(self.db, NAMES[0], 'books')
+
+    def time_find_trades(self, root):
+        pk.find_trades(self.messages)
+
+    def time_interpolate(self, root):
+        pk.interpolate(self.prices, 1)
+
+    def time_resample(self, root):
+        pk.resample(self.books, 10 ** 9)
+
+    def time_merge(self, root):
+        for chunk in pk.merge({name: pk.iter_hdf5(self.db, name, 'messages') for name in NAMES}, label='name'):
+            pass
+
+
+class Unpack():
+    """Complete `unpack` runs."""
+
+    params = ['hdf5', 'csv']
+    param_names = ['method']
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup_cache(self):
+        root = tempfile.mkdtemp(prefix='prickle-bench-')
+        fin = os.path.join(root, 'S{}-v41.bin'.format(DATE))
+        pk.generate(fin, ver=VERSION, ntickers=10, rate=RATE, duration=DURATION, seed=0)
+        return fin
+
+    def setup(self, fin, method):
+        self.tmp = tempfile.mkdtemp(prefix='prickle-unpack-')
+
+    def teardown(self, fin, method):
+        shutil.rmtree(self.tmp)
+
+    def time_unpack(self, fin, method):
+        if method == 'hdf5':
+            pk.unpack(fin, VERSION, DATE, NLEVELS, NAMES, method='hdf5', fout=os.path.join(self.tmp, 'itch.hdf5'))
+        else:
+            pk.unpack(fin, VERSION, DATE, NLEVELS, NAMES, method='csv', fout=os.path.join(self.tmp, 'csv'))
@@ -1 +1,52 @@
 from .core import *
+from .synthetic import *
+
+# The analysis helpers (pandas, h5py), kernels (numba) and plotting functions
+# (matplotlib) are only imported on first use, so decoding doesn't pay for them.
+_LAZY = {'load_hdf5': 'analysis',
+         'load_sqlite': 'analysis',
+         'interpolate': 'analysis',
+         'reorder': 'analysis',
+         'find_trades': 'analysis',
+         'nodups': 'analysis',
+         'combine': 'analysis',
+         'nanoseconds': 'analysis',
+         'between': 'analysis',
+         'asof': 'analysis',
+         'resample': 'analysis',
+         'iter_hdf5': 'analysis',
+         'iter_csv': 'analysis',
+         'merge': 'analysis',
+         'Statistics': 'statistics',
+         'daily_statistics': 'statistics',
+         'compute_statistics': 'statistics',
+         'BookReader': 'books',
+         'LoadCache': 'cache',
+         'set_cache': 'cache',
+         'get_cache': 'cache',
+         'compact': 'storage',
+         'mmap_hdf5': 'storage',
+         'reconstruct': 'kernels',
+         'aggregate_trades': 'kernels',
+         'replay': 'kernels',
+         'ReplayServer': 'server',
+         'serve_replay': 'server',
+         'subscribe': 'server',
+         'itch_events': 'server',
+         'hdf5_events': 'server',
+         'imshow': 'plotting',
+         'plot_trades': 'plotting'}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        module = importlib.import_module('.' + _LAZY[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
@@ -0,0 +1,471 @@
+import numpy as np
+import pandas as pd
+import h5py
+import sqlite3
+import heapq
+from .kernels import aggregate_trades, EXECUTE, BID, ASK
+from .books import BookReader
+from .storage import as_array
+from .core import ORDER_COLUMNS
+from .cache import LoadCache, get_cache
+
+
+# columns of each group of an HDF5 database
+HDF5_COLUMNS = {'messages': ['sec', 'nano', 'type', 'side', 'price', 'shares', 'refno', 'newrefno'],
+                'trades': ['sec', 'nano', 'side', 'price', 'shares'],
+                'noii': ['sec', 'nano', 'type', 'cross', 'side', 'price', 'shares', 'matchno', 'paired', 'imb', 'dir', 'far', 'near', 'current'],
+                'bars': ['sec', 'nano', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count', 'spread', 'biddepth', 'askdepth'],
+                'orders': ORDER_COLUMNS}
+
+
+def _read(db, grp, name, mmap=False, cache=False):
+    """Return the data of a dataset (or every order book, if `grp` is 'books') as an np.array."""
+
+    def load():
+        with h5py.File(db, 'r') as f:
+            if grp != 'books':
+                return as_array(f['/{}/{}'.format(grp, name)], mmap)
+            if 'deltas' in f and name in f['deltas']:
+                return BookReader(f, name).to_array().astype('i')
+            return as_array(f['/orderbooks/' + name], mmap)
+
+    if mmap or cache is False or cache is None:
+        return load()
+    if cache is True:
+        cache = get_cache()
+    return cache.get(LoadCache.key(db, grp, name), load)
+
+
+def nanoseconds(sec, nano=0):
+    """Return times as int64 nanoseconds since midnight."""
+    return np.asarray(sec, dtype=np.int64) * 10 ** 9 + np.asarray(nano, dtype=np.int64)
+
+
+def _with_ns(df):
+    """Add an 'ns' column (nanoseconds since midnight) to a DataFrame with 'sec' and 'nano' columns."""
+    if 'ns' not in df.columns:
+        df['ns'] = nanoseconds(df['sec'].values, df['nano'].values)
+    return df
+
+
+def _sorted_ns(df):
+    """Return the times of a DataFrame in nanoseconds (from 'ns', or 'sec' and 'nano'), checking that they are sorted."""
+    if 'ns' in df.columns:
+        ns = df['ns'].values
+    else:
+        ns = nanoseconds(df['sec'].values, df['nano'].values)
+    if np.any(ns[1:] < ns[:-1]):
+        raise ValueError('Rows are not sorted by time')
+    return ns
+
+
+def between(df, start=None, stop=None):
+    """Return the rows of a DataFrame from `start` (inclusive) to `stop` (exclusive), in nanoseconds since midnight.
+
+    Rows are found by binary search on the 'ns' column (or on 'sec' and 'nano'), so `df` must be sorted by time (a ValueError is raised if it isn't).
+
+    """
+    ns = _sorted_ns(df)
+    lo = 0 if start is None else np.searchsorted(ns, start, side='left')
+    hi = len(ns) if stop is None else np.searchsorted(ns, stop, side='left')
+    return df.iloc[lo:hi]
+
+
+def asof(df, times):
+    """Return the last row of a DataFrame at or before each time (in nanoseconds since midnight).
+
+    If `times` is a number, returns that row as a pd.Series (or None if there is no row before the time). Otherwise, returns a pd.DataFrame indexed by `times`, with NaN rows for times before the first row. `df` must be sorted by time.
+
+    """
+    ns = _sorted_ns(df)
+    idx = np.searchsorted(ns, times, side='right') - 1
+    if np.ndim(times) == 0:
+        return df.iloc[idx] if idx >= 0 else None
+    rows = df.reset_index(drop=True).reindex(idx)
+    rows.index = pd.Index(np.asarray(times), name='ns')
+    return rows
+
+
+def resample(df, interval, start=None, stop=None):
+    """Sample a DataFrame every `interval` nanoseconds, using the last row at or before each sample time.
+
+    Samples are taken at the multiples of `interval` from `start` (inclusive) to `stop` (exclusive), which default to the times of the first and last rows. `df` must be sorted by time.
+
+    """
+    ns = _sorted_ns(df)
+    if len(ns) == 0:
+        return asof(df, np.zeros(0, dtype=np.int64))
+    if start is None:
+        start = ns[0]
+    if stop is None:
+        stop = ns[-1] + 1
+    start = -(-start // interval) * interval
+    return asof(df, np.arange(start, stop, interval, dtype=np.int64))
+
+
+def load_hdf5(db, name, grp, mmap=False, cache=False):
+    """Read data from database and return pd.DataFrames.
+
+    If `mmap` is True, the data of a compacted database (see `compact`) is memory-mapped rather than read into memory, and the DataFrames are read-only views of the file (for books, only the prices DataFrame is a view).
+
+    Every DataFrame has an 'ns' column of int64 nanoseconds since midnight (`sec * 10 ** 9 + nano`), which can be used to slice the rows with `between`, `asof` and `resample`.
+
+    If `cache` is True, the data is kept in the shared `LoadCache` (see `set_cache`), or in `cache` if it is a `LoadCache`, so loading the same dataset again doesn't read the file. The DataFrames are read-only views of the cached data (for books, they are copies), so use `df.copy()` before modifying them.
+
+    """
+
+    if grp == 'messages':
+        try:
+            data = _read(db, 'messages', name, mmap, cache)
+            T, N = data.shape
+            columns = HDF5_COLUMNS['messages']
+            df = pd.DataFrame(data, index=np.arange(0, T), columns=columns, copy=False)
+            return _with_ns(df)
+        except KeyError as e:
+            print('Could not find name {} in messages'.format(name))
+        except OSError as e:
+            print('Could not find file {}'.format(db))
+
+    if grp == 'books':
+        try:
+            data = _read(db, 'books', name, mmap, cache)
+            nlevels = int((data.shape[1] - 2) / 4)
+            pidx = list(range(2, 2 + nlevels))
+            pidx.extend(list(range(2 + nlevels, 2 + 2 * nlevels)))
+            vidx = list(range(2 + 2 * nlevels, 2 + 3 * nlevels))
+            vidx.extend(list(range(2 + 3 * nlevels, 2 + 4 * nlevels)))
+            timestamps = data[:, 0:2]
+            prices = data[:, pidx]
+            volume = data[:, vidx]
+            base_columns = [str(i) for i in list(range(1, nlevels + 1))]
+            price_columns = ['bidprc.' + i for i in base_columns]
+            volume_columns = ['bidvol.' + i for i in base_columns]
+            price_columns.extend(['askprc.' + i for i in base_columns])
+            volume_columns.extend(['askvol.' + i for i in base_columns])
+            df_time = pd.DataFrame(timestamps, columns=['sec', 'nano'])
+            df_volume = pd.DataFrame(volume, columns=volume_columns)
+            df_volume = pd.concat([df_time, df_volume], axis=1)
+            if mmap:
+                # timestamps and prices are adjacent columns, so they don't need to be copied
+                df_price = pd.DataFrame(data[:, 0:2 + 2 * nlevels], columns=['sec', 'nano'] + price_columns, copy=False)
+            else:
+                df_price = pd.DataFrame(prices, columns=price_columns)
+                df_price = pd.concat([df_time, df_price], axis=1)
+            return _with_ns(df_price), _with_ns(df_volume)
+        except KeyError as e:
+            print('Could not find name {} in orderbooks'.format(name))
+        except OSError as e:
+            print('Could not find file {}'.format(db))
+
+    if grp == 'trades':
+        try:
+            data = _read(db, 'trades', name, mmap, cache)
+            T, N = data.shape
+            columns = HDF5_COLUMNS['trades']
+            df = pd.DataFrame(data, index=np.arange(0, T), columns=columns, copy=False)
+            return _with_ns(df)
+        except KeyError as e:
+            print('Could not find name {} in messages'.format(name))
+        except OSError as e:
+            print('Could not find file {}'.format(db))
+
+    if grp == 'noii':
+        try:
+            data = _read(db, 'noii', name, mmap, cache)
+            T, N = data.shape
+            columns = HDF5_COLUMNS['noii']
+            df = pd.DataFrame(data, index=np.arange(0, T), columns=columns, copy=False)
+            return _with_ns(df)
+        except KeyError as e:
+            print('Could not find name {} in messages'.format(name))
+        except OSError as e:
+            print('Could not find file {}'.format(db))
+
+    if grp == 'bars':
+        try:
+            data = _read(db, 'bars', name, mmap, cache)
+            T, N = data.shape
+            columns = HDF5_COLUMNS['bars']
+            df = pd.DataFrame(data, index=np.arange(0, T), columns=columns, copy=False)
+            return _with_ns(df)
+        except KeyError as e:
+            print('Could not find name {} in bars'.format(name))
+        except OSError as e:
+            print('Could not find file {}'.format(db))
+
+    if grp == 'orders':
+        try:
+            data = _read(db, 'orders', name, mmap, cache)
+            T, N = data.shape
+            df = pd.DataFrame(data, index=np.arange(0, T), columns=HDF5_COLUMNS['orders'], copy=False)
+            return _with_ns(df)
+        except KeyError as e:
+            print('Could not find name {} in orders'.format(name))
+        except OSError as e:
+            print('Could not find file {}'.format(db))
+
+
+def load_sqlite(db, name, grp, date=None, start=None, stop=None):
+    """Read data from a SQLite database and return pd.DataFrames.
+
+    Returns the same DataFrames as `load_hdf5` (for books, a DataFrame of prices and a DataFrame of volumes). Rows are selected by name, date (all dates if `date` is None) and, optionally, a range of times from `start` (inclusive) to `stop` (exclusive) in seconds, using the (name, date, time) index of each table. The 'ns' column holds the stored time (which is only in order if `date` is given).
+
+    """
+    if grp in ('books', 'orderbooks'):
+        grp = 'books'
+    with sqlite3.connect(db) as conn:
+        columns = [row[1] for row in conn.execute('PRAGMA table_info({})'.format(grp))][3:]
+        if len(columns) == 0:
+            print('Could not find table {}'.format(grp))
+            return None
+        query = 'SELECT time, {} FROM {} WHERE name = ?'.format(', '.join(columns), grp)
+        args = [name]
+        if date is not None:
+            query += ' AND date = ?'
+            args.append(date)
+        if start is not None:
+            query += ' AND time >= ?'
+            args.append(int(start * 10 ** 9))
+        if stop is not None:
+            query += ' AND time < ?'
+            args.append(int(stop * 10 ** 9))
+        query += ' ORDER BY date, time, rowid'
+        rows = conn.execute(query, args).fetchall()
+    dtype = float if grp == 'bars' else np.int64
+    data = np.array(rows, dtype=dtype).reshape(-1, len(columns) + 1)
+    ns = data[:, 0].astype(np.int64)
+    data = data[:, 1:]
+    if grp != 'books':
+        df = pd.DataFrame(data, columns=columns, copy=False)
+        df['ns'] = ns
+        return df
+    nlevels = (len(columns) - 2) // 4
+    base_columns = [str(i) for i in range(1, nlevels + 1)]
+    price_columns = ['bidprc.' + i for i in base_columns] + ['askprc.' + i for i in base_columns]
+    volume_columns = ['bidvol.' + i for i in base_columns] + ['askvol.' + i for i in base_columns]
+    df_price = pd.DataFrame(data[:, 0:2 + 2 * nlevels], columns=['sec', 'nano'] + price_columns)
+    df_volume = pd.DataFrame(np.hstack([data[:, 0:2], data[:, 2 + 2 * nlevels:]]),
+                             columns=['sec', 'nano'] + volume_columns)
+    df_price['ns'] = ns
+    df_volume['ns'] = ns
+    return df_price, df_volume
+
+
+def interpolate(data, tstep):
+    """Interpolate limit order data.
+
+    Uses left-hand interpolation, and assumes that the data is indexed by timestamp.
+
+    """
+    T, N = data.shape
+    timestamps = data.index
+    t0 = timestamps[0] - (timestamps[0] % tstep)  # 34200
+    tN = timestamps[-1] - (timestamps[-1] % tstep) + tstep  # 57600
+    timestamps_new = np.arange(t0 + tstep, tN + tstep, tstep)  # [34200, ..., 57600]
+    X = np.zeros((len(timestamps_new), N))  # np.array
+    X[-1, :] = data.values[-1, :]
+    t = timestamps_new[0]  # keeps track of time in NEW sampling frequency
+    for i in np.arange(0, T):  # observations in data...
+        if timestamps[i] > t:
+            s = timestamps[i] - (timestamps[i] % tstep)
+            tidx = int((t - t0) / tstep - 1)
+            sidx = int((s - t0) / tstep)  # plus one for python indexing (below)
+            X[tidx:sidx, :] = data.values[i - 1, :]
+            t = s + tstep
+        else:
+            pass
+    return pd.DataFrame(X,
+                        index=timestamps_new,
+                        columns=data.columns)
+
+
+def reorder(data, columns):
+    """Reorder the columns of order data.
+
+    The resulting columns will be asks (high-to-low) followed by bids (low-to-high).
+
+    """
+    levels = int((data.shape[1] - 2) / 2)
+    if columns == 'volume' or type == 'v':
+        idx = ['askvol.' + str(i) for i in range(levels, 0, -1)]
+        idx.extend(['bidvol.' + str(i) for i in range(1, levels + 1, 1)])
+    elif columns == 'price' or type == 'p':
+        idx = ['askprc.' + str(i) for i in range(levels, 0, -1)]
+        idx.extend(['bidprc.' + str(i) for i in range(1, levels + 1, 1)])
+    return data.ix[:, idx]
+
+
+def find_trades(messages, eps=10 ** -6):
+    """Combine executions into trades.
+
+    Consecutive executions on the same side no more than `eps` seconds after the first execution of a trade are treated as a single trade at the volume-weighted average price (see `aggregate_trades`). Executions are aggregated on their times in integer nanoseconds (from the 'ns' column, 'sec' and 'nano', or 'time'), so `eps` is rounded to the nearest nanosecond. Trades have the time of their first execution in nanoseconds ('ns') and in seconds ('time'), and the side of the orders they executed against ('B' or 'S', also for the integer codes of the HDF5 'messages' group). `messages` is not modified.
+
+    """
+    if 'type' in messages.columns:
+        messages = messages[messages.type == (EXECUTE if messages.type.dtype.kind in 'iu' else 'E')]
+    times = _chunk_ns(messages)
+    side = messages['side']
+    if side.dtype.kind in 'iu':  # 'messages' group codes (see `Message.to_array`)
+        side = side.map({BID: 'B', ASK: 'S'})
+    codes, sides = pd.factorize(side)
+    ns, side, shares, vwap, hit = aggregate_trades(times,
+                                                   codes.astype(np.int64),
+                                                   messages['shares'].values,
+                                                   messages['price'].values,
+                                                   int(round(eps * 10 ** 9)))
+    if hit.sum() == 0 and messages['price'].dtype.kind in 'iu':
+        vwap = vwap.astype(messages['price'].dtype)
+    if 'time' in messages.columns:
+        time = messages['time'].values[np.searchsorted(times, ns)]  # the caller's times, unchanged
+    else:
+        time = ns / 10 ** 9
+    trades = pd.DataFrame({'time': time,
+                           'side': np.asarray(sides.take(side)),
+                           'shares': shares,
+                           'vwap': vwap,
+                           'hit': hit,
+                           'ns': ns})
+    return trades
+
+
+def nodups(books, messages):
+    """Return messages and books with rows remove for orders that didn't change book."""
+    assert books.shape[0] == messages.shape[0], "books and messages do not have the same number of rows"
+    subset = books.columns.drop(['sec', 'nano', 'name', 'ns'], errors='ignore')
+    dups = books.duplicated(subset=subset)
+    return books[~dups].reset_index(), messages[~dups].reset_index()
+
+
+def combine(messages, hidden, chunk_size=10 ** 5):
+    """Combine hidden executions with message data.
+
+    Rows of both are given an int64 'ns' column (see `find_trades`) and merged in time order on it, `chunk_size` rows at a time (see `merge`), with messages before hidden executions at the same time. Neither input is modified.
+
+    """
+    messages = messages.assign(ns=_chunk_ns(messages))
+    messages = messages.drop(['index', 'sec', 'nano', 'name', 'refno', 'mpid'], axis=1)
+    hidden = hidden.assign(type='H', ns=_chunk_ns(hidden))
+    hidden = hidden.drop(['hit'], axis=1)
+    hidden = hidden.rename(columns={'vwap': 'price'})
+    chunks = list(merge([[messages], [hidden]], chunk_size=chunk_size))
+    return pd.concat(chunks) if len(chunks) > 0 else pd.concat([messages, hidden])
+
+
+def _chunk_ns(df):
+    """Return the times of the rows of a DataFrame in nanoseconds (from 'ns', 'sec' and 'nano', or 'time' in seconds)."""
+    if 'ns' in df.columns:
+        return df['ns'].values.astype(np.int64)
+    if 'sec' in df.columns:
+        return nanoseconds(df['sec'].values, df['nano'].values)
+    return np.round(df['time'].values * 10 ** 9).astype(np.int64)
+
+
+def iter_hdf5(db, name, grp, chunk_size=10 ** 5):
+    """Read a group of an HDF5 database `chunk_size` rows at a time.
+
+    Yields DataFrames with the same columns as `load_hdf5` (for books, one DataFrame with the columns of both the prices and the volumes), without reading the whole dataset.
+
+    """
+    with h5py.File(db, 'r') as f:
+        if grp == 'books':
+            if 'deltas' in f and name in f['deltas']:
+                reader = BookReader(f, name)
+                size, read = len(reader), lambda i, j: reader.to_array(i, j)
+            else:
+                dataset = f['/orderbooks/' + name]
+                size, read = dataset.shape[0], lambda i, j: dataset[i:j, :]
+        else:
+            dataset = f['/{}/{}'.format(grp, name)]
+            size, read = dataset.shape[0], lambda i, j: dataset[i:j, :]
+            columns = HDF5_COLUMNS[grp]
+        for i in range(0, size, chunk_size):
+            data = read(i, min(i + chunk_size, size))
+            if grp == 'books':
+                nlevels = (data.shape[1] - 2) // 4
+                base_columns = [str(k) for k in range(1, nlevels + 1)]
+                columns = ['sec', 'nano']
+                for prefix in ('bidprc.', 'askprc.', 'bidvol.', 'askvol.'):
+                    columns.extend([prefix + k for k in base_columns])
+            df = pd.DataFrame(data, index=np.arange(i, i + data.shape[0]), columns=columns, copy=False)
+            yield _with_ns(df)
+
+
+def iter_csv(path, chunk_size=10 ** 5, **kwargs):
+    """Read a CSV file written by `unpack` `chunk_size` rows at a time (other arguments are passed to pd.read_csv)."""
+    for df in pd.read_csv(path, chunksize=chunk_size, **kwargs):
+        yield _with_ns(df) if 'sec' in df.columns else df
+
+
+def merge(sources, chunk_size=10 ** 5, label=None):
+    """Merge time-ordered sources into a single time-ordered stream.
+
+    Each source is an iterable of DataFrames in time order (e.g., `iter_hdf5` or `iter_csv`, or a list holding one DataFrame), with times given by an 'ns' column, 'sec' and 'nano' columns, or a 'time' column in seconds. Yields DataFrames of (at most) `chunk_size` rows in time order, keeping the index of each row. Rows from the same source keep their order, but rows from different sources with equal times are only grouped in the order of the sources when each source is a single DataFrame (otherwise they may be interleaved).
+
+    The merge holds one chunk of each source and the rows waiting to be yielded, so memory depends on the size of the chunks and the number of sources rather than on the size of the data. A heap of the last time of each source's current chunk gives the source that runs out first: every row up to that time can be yielded, and then that source is read again.
+
+    Parameters
+    ----------
+    sources : list or dict
+        Iterables of DataFrames
+    chunk_size : int
+        Number of rows of each DataFrame yielded
+    label : string
+        If `sources` is a dict, the name of a column added to each row holding the key of its source (e.g., 'name' for a dict of tickers)
+
+    Examples
+    --------
+    >> streams = {name: pk.iter_hdf5('itch.hdf5', name, 'messages') for name in ['AAPL', 'GOOG', 'MSFT']}
+    >> for chunk in pk.merge(streams, label='name'):
+    >>     ...
+
+    """
+    if isinstance(sources, dict):
+        keys = list(sources.keys())
+        sources = list(sources.values())
+    else:
+        keys = None
+    iterators = [iter(source) for source in sources]
+    buffers = [None] * len(iterators)  # (DataFrame, times) of the rows of each source not yet merged
+    heap = []
+
+    def read(k):
+        for df in iterators[k]:
+            if len(df) == 0:
+                continue
+            times = _chunk_ns(df)
+            if np.any(times[1:] < times[:-1]) or (buffers[k] is not None and times[0] < buffers[k][2]):
+                raise ValueError('Source {} is not sorted by time'.format(k if keys is None else keys[k]))
+            if label is not None:
+                df = df.assign(**{label: keys[k]})
+            buffers[k] = (df, times, times[-1])
+            heapq.heappush(heap, (times[-1], k))
+            return
+
+    for k in range(len(iterators)):
+        read(k)
+    pending = []
+    npending = 0
+    while len(heap) > 0:
+        bound, k = heapq.heappop(heap)
+        frames = []
+        times = []
+        for j, buffer in enumerate(buffers):
+            if buffer is None or len(buffer[0]) == 0:
+                continue
+            df, ns, last = buffer
+            n = np.searchsorted(ns, bound, side='right')
+            if n > 0:
+                frames.append(df.iloc[:n])
+                times.append(ns[:n])
+                buffers[j] = (df.iloc[n:], ns[n:], last)
+        if len(frames) > 0:
+            order = np.argsort(np.concatenate(times), kind='stable')
+            merged = pd.concat(frames).iloc[order] if len(frames) > 1 else frames[0]
+            pending.append(merged)
+            npending += len(merged)
+        read(k)
+        while npending >= chunk_size or (len(heap) == 0 and npending > 0):
+            merged = pd.concat(pending) if len(pending) > 1 else pending[0]
+            yield merged.iloc[:chunk_size]
+            pending = [merged.iloc[chunk_size:]] if len(merged) > chunk_size else []
+            npending = max(len(merged) - chunk_size, 0)
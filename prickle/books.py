@@ -0,0 +1,101 @@
+import numpy as np
+import h5py
+from .kernels import replay
+
+
+class BookReader():
+    """Random access to order books stored as keyframes and deltas.
+
+    `unpack(..., keyframes=n)` stores one delta per book update (the new depth of the price level that changed) along with every level of the book after every `n` updates. A book is reconstructed by applying deltas to the nearest preceding keyframe, so no more than `n` deltas are read to find any book.
+
+    Rows are numbered like the rows of the 'orderbooks' group that `unpack` writes by default: row `i` is the book after the `i`-th update.
+
+    Parameters
+    ----------
+    db : string or h5py.File
+        Location of the HDF5 file (or the open file)
+    name : string
+        Stock ticker
+    nlevels : int
+        Number of levels of the order book to return from `to_array` (defaults to the number used by `unpack`)
+
+    Examples
+    --------
+    >> reader = pk.BookReader('itch.hdf5', 'AAPL', nlevels=10)
+    >> books = reader.to_array(10 ** 6, 10 ** 6 + 1000)  # like f['orderbooks/AAPL'][10 ** 6:10 ** 6 + 1000]
+    >> bids, asks = reader.book(reader.row_at(36000))  # every level at 10:00:00
+
+    """
+
+    def __init__(self, db, name, nlevels=None):
+        if isinstance(db, h5py.File):
+            self.file = db
+            self.owner = False
+        else:
+            self.file = h5py.File(db, 'r')
+            self.owner = True
+        self.name = name
+        self.deltas = self.file['deltas'][name]
+        self.keyframes = self.file['keyframes'][name]
+        self.keyindex = self.file['keyindex'][name][:, :]  # [row, start, count]
+        self.nlevels = nlevels if nlevels is not None else int(self.deltas.attrs.get('nlevels', 10))
+        self.times = None
+
+    def __len__(self):
+        return self.deltas.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.owner:
+            self.file.close()
+
+    def _keyframe(self, row):
+        """Return the last keyframe at or before `row` as (row, levels)."""
+        k = np.searchsorted(self.keyindex[:, 0], row, side='right') - 1
+        if k < 0:
+            return 0, np.zeros((0, 3), dtype=int)
+        key_row, start, count = self.keyindex[k]
+        return key_row, self.keyframes[start:start + count, :]
+
+    def to_array(self, start=0, stop=None, nlevels=None):
+        """Return order book snapshots (as `Book.to_array` rows) for rows `start` to `stop`."""
+        if stop is None or stop > len(self):
+            stop = len(self)
+        if nlevels is None:
+            nlevels = self.nlevels
+        if start >= stop:
+            return np.zeros((0, 2 + 4 * nlevels), dtype=int)
+        key_row, levels = self._keyframe(start)
+        return replay(levels, self.deltas[key_row:stop, :], nlevels, skip=start - key_row)
+
+    def book(self, row):
+        """Return every level of the book after `row` as dictionaries of bids and asks (price: shares)."""
+        key_row, levels = self._keyframe(row + 1)
+        bids = {}
+        asks = {}
+        for side, price, shares in levels:
+            if side == 1:
+                bids[price] = shares
+            elif side == -1:
+                asks[price] = shares
+        for sec, nano, side, price, shares in self.deltas[key_row:row + 1, :]:
+            if side == 0:
+                continue
+            levels = bids if side == 1 else asks
+            if shares == 0:
+                levels.pop(price, None)
+            else:
+                levels[price] = shares
+        return bids, asks
+
+    def row_at(self, sec, nano=0):
+        """Return the last row at or before a time (or -1 if there is none)."""
+        if self.times is None:
+            times = self.deltas[:, 0:2].astype(np.int64)
+            self.times = times[:, 0] * 10 ** 9 + times[:, 1]
+        return np.searchsorted(self.times, int(sec) * 10 ** 9 + int(nano), side='right') - 1
@@ -0,0 +1,208 @@
+"""A least-recently-used cache of arrays read from HDF5 databases (see `load_hdf5(..., cache=True)`)."""
+
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import util
+import hashlib
+import os
+import sys
+
+
+def _unlink_segments(segments, pid):
+    """Remove the shared arrays that process `pid` stored (run when it exits)."""
+    for segment, owner in list(segments.values()):
+        if owner == pid:
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _open_segment(name):
+    """Attach to an existing shared memory segment without tracking it.
+
+    Before Python 3.13, attaching registers the segment with the resource tracker of this process as if it had been created here, so the tracker could unlink it when this process exits (while its owner still uses it), or warn about it if the owner unlinked it first. Only the process that created a segment removes it (see `_unlink_segments`).
+
+    """
+    from multiprocessing import resource_tracker, shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class LoadCache():
+    """Keep recently loaded datasets in memory, up to a budget of bytes.
+
+    Entries are keyed by the location, modification time and size of the file along with the group and name of the dataset, so rewriting a database invalidates its entries. When adding an entry would exceed `max_bytes`, the least recently used entries are evicted. Cached arrays are read-only.
+
+    If `shared` is True, arrays are also stored in shared memory (`multiprocessing.shared_memory`) under a name derived from their key, so that processes on the same machine (e.g., the workers of a pool) read a dataset from disk once and then attach to the same copy. Each process still counts the arrays it uses against its own budget. A shared copy is removed when the process that stored it evicts it or exits normally, including the workers of a pool that is closed and joined (terminating a pool, as its context manager does, leaves their copies to the resource tracker, which warns about them).
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum number of bytes of cached arrays
+    shared : bool
+        Share cached arrays between processes
+
+    Attributes
+    ----------
+    nbytes : int
+        Number of bytes of cached arrays
+    hits : int
+        Number of lookups found in the cache (including shared memory)
+    misses : int
+        Number of lookups that read the file
+
+    Examples
+    --------
+    >> pk.set_cache(max_bytes=4 * 2 ** 30, shared=True)
+    >> df = pk.load_hdf5('itch.hdf5', 'AAPL', 'messages', cache=True)  # reads the file
+    >> df = pk.load_hdf5('itch.hdf5', 'AAPL', 'messages', cache=True)  # doesn't
+
+    """
+
+    HEADER = 64  # bytes before the data of a shared array: ready, ndim, shape (2), dtype
+
+    def __init__(self, max_bytes=2 ** 30, shared=False):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.segments = {}
+        self.finalizer = None  # pid of the process that registered _unlink_segments
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return 'LoadCache(entries={}, nbytes={}, max_bytes={}, hits={}, misses={})'.format(len(self.entries), self.nbytes, self.max_bytes, self.hits, self.misses)
+
+    def __repr__(self):
+        return str(self)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(db, grp, name):
+        """Return the cache key of a dataset."""
+        info = os.stat(db)
+        return (os.path.abspath(db), info.st_mtime_ns, info.st_size, grp, name)
+
+    def get(self, key, load):
+        """Return the cached array for `key`, calling `load()` to read it on a miss."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        data = self._attach(key) if self.shared else None
+        if data is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            data = load()
+            if self.shared:
+                data = self._share(key, data)
+        data.flags.writeable = False
+        self._insert(key, data)
+        return data
+
+    def clear(self):
+        """Evict every entry."""
+        while len(self.entries) > 0:
+            self._evict(next(iter(self.entries)))
+
+    def _insert(self, key, data):
+        path, mtime, size, grp, name = key
+        for old in [k for k in self.entries if k[0] == path and k[3:] == (grp, name)]:
+            self._evict(old)  # the file has changed
+        if data.nbytes > self.max_bytes:
+            self._release(key)
+            return
+        while self.nbytes + data.nbytes > self.max_bytes:
+            self._evict(next(iter(self.entries)))
+        self.entries[key] = data
+        self.nbytes += data.nbytes
+
+    def _evict(self, key):
+        data = self.entries.pop(key)
+        self.nbytes -= data.nbytes
+        self._release(key)
+
+    def _release(self, key):
+        segment, owner = self.segments.pop(key, (None, None))
+        if segment is None:
+            return
+        if owner == os.getpid():  # not in a forked child of the owner
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            segment.close()
+        except BufferError:  # arrays returned earlier still use it
+            pass
+
+    @staticmethod
+    def _segment_name(key):
+        return 'prickle_' + hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+
+    def _attach(self, key):
+        """Return an array stored in shared memory by another process (or None)."""
+        try:
+            segment = _open_segment(self._segment_name(key))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        header = np.ndarray(4, dtype=np.int64, buffer=segment.buf)
+        if header[0] != 1:  # still being written
+            segment.close()
+            return None
+        ndim = int(header[1])
+        shape = tuple(int(n) for n in header[2:2 + ndim])
+        dtype = np.dtype(bytes(segment.buf[32:48]).rstrip(b'\x00').decode())
+        del header
+        self.segments[key] = (segment, None)
+        return np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=self.HEADER)
+
+    def _share(self, key, data):
+        """Copy an array into shared memory and return the shared copy (or `data` if it can't be shared)."""
+        from multiprocessing import shared_memory
+        if data.ndim > 2:
+            return data
+        try:
+            segment = shared_memory.SharedMemory(name=self._segment_name(key), create=True, size=self.HEADER + max(data.nbytes, 1))
+        except (FileExistsError, OSError):
+            return data
+        header = np.ndarray(4, dtype=np.int64, buffer=segment.buf)
+        header[1] = data.ndim
+        header[2:2 + data.ndim] = data.shape
+        segment.buf[32:48] = data.dtype.str.encode().ljust(16, b'\x00')
+        shared = np.ndarray(data.shape, dtype=data.dtype, buffer=segment.buf, offset=self.HEADER)
+        shared[...] = data
+        header[0] = 1
+        del header
+        if self.finalizer != os.getpid():  # first segment stored by this process
+            util.Finalize(self, _unlink_segments, args=(self.segments, os.getpid()), exitpriority=0)
+            self.finalizer = os.getpid()
+        self.segments[key] = (segment, os.getpid())
+        return shared
+
+
+CACHE = LoadCache()
+
+
+def set_cache(max_bytes=2 ** 30, shared=False):
+    """Replace the cache used by `load_hdf5(..., cache=True)` and return it."""
+    global CACHE
+    CACHE.clear()
+    CACHE = LoadCache(max_bytes, shared)
+    return CACHE
+
+
+def get_cache():
+    """Return the cache used by `load_hdf5(..., cache=True)`."""
+    return CACHE
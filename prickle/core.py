@@ -1,10 +1,58 @@
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import threading
+import queue
 import struct
-import h5py
+import pickle
+import json
+import array
+import hashlib
+import sqlite3
+import cProfile
+import pstats
+import tracemalloc
 import time
+import gzip
+import bz2
+import lzma
+import io
 import os
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Columns of each SQLite table (after name, date and time), matching the columns of the HDF5 datasets
+SQLITE_COLUMNS = {'messages': ['sec', 'nano', 'type', 'side', 'price', 'shares', 'refno', 'newrefno'],
+                  'trades': ['sec', 'nano', 'side', 'price', 'shares'],
+                  'noii': ['sec', 'nano', 'type', 'cross', 'side', 'price', 'shares', 'matchno', 'paired', 'imb',
+                           'dir', 'far', 'near', 'current'],
+                  'bars': ['sec', 'nano', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count', 'spread',
+                           'biddepth', 'askdepth']}
+
+# Columns of order lifecycle rows (see `Orderlist`)
+ORDER_COLUMNS = ['sec', 'nano', 'refno', 'origin', 'prevrefno', 'side', 'price', 'shares', 'addsec', 'addnano',
+                 'firstsec', 'firstnano', 'lastsec', 'lastnano', 'filled', 'cancelled', 'status', 'distance']
+SQLITE_COLUMNS['orders'] = ORDER_COLUMNS
+
+# Order statuses
+OPEN, FILLED, DELETED, REPLACED = range(4)
+
+
+def sqlite_columns(grp, nlevels):
+    """Return the columns of a SQLite table (after name, date and time)."""
+    if grp == 'books':
+        columns = ['sec', 'nano']
+        for prefix in ('bidprc', 'askprc', 'bidvol', 'askvol'):
+            columns.extend(['{}{}'.format(prefix, i) for i in range(1, nlevels + 1)])
+        return columns
+    return SQLITE_COLUMNS[grp]
 
 
 class Database():
@@ -18,31 +66,64 @@ class Database():
         Contains the stock tickers to include in the database
     nlevels : int
         Specifies the number of levels to include in the order book data
+    method : string
+        Specifies the type of database to create ('hdf5', 'csv' or 'sqlite')
+    resume : bool
+        Open an existing database without deleting any data (otherwise, any existing data for `names` is replaced, and data for other names is kept)
+    bars : bool
+        Include a group for bars (see `Barlist`)
+    deltas : bool
+        Store order books as keyframes and deltas instead of snapshots (HDF5 only, see `Booklist`)
+    orders : bool
+        Include a group for order lifecycles (see `Orderlist`)
+    date : string
+        Date of the data (SQLite only). Rows of every table are identified by name, date and time (nanoseconds), and any existing rows for the same names and date are replaced.
 
     """
 
-    def __init__(self, path, names, nlevels, method):
+    def __init__(self, path, names, nlevels, method, resume=False, bars=False, deltas=False, orders=False,
+                 date=None):
         self.method = method
+        self.has_bars = bars
+        self.has_orders = orders
+        self.has_deltas = deltas
+        self.names = names
+        self.date = date
         if self.method == 'hdf5':
-            try:
-                self.file = h5py.File(path, 'r+')  # read/write, file must exist
-                print('Appending existing HDF5 file.')
-                for name in names:
-                    if name in self.file['messages'].keys():
-                        print('Overwriting message data for {}'.format(name))
-                        del self.file['messages'][name]
-                    if name in self.file['orderbooks'].keys():
-                        print('Overwriting orderbook data for {}'.format(name))
-                        del self.file['orderbooks'][name]
-                    if name in self.file['trades'].keys():
-                        print('Overwriting trades data for {}'.format(name))
-                        del self.file['trades'][name]
-                    if name in self.file['noii'].keys():
-                        print('Overwriting noii data for {}'.format(name))
-                        del self.file['noii'][name]
-            except OSError as e:
-                print('HDF5 file does not exist. Creating a new one.')
-                self.file = h5py.File(path, 'x')  # create file, fail if exists
+            import h5py
+            if resume:
+                self.file = h5py.File(path, 'r+')
+            else:
+                try:
+                    self.file = h5py.File(path, 'r+')  # read/write, file must exist
+                    print('Appending existing HDF5 file.')
+                    self.file.attrs.pop('compact', None)  # new datasets are chunked (see `compact`)
+                    for name in names:
+                        if name in self.file['messages'].keys():
+                            print('Overwriting message data for {}'.format(name))
+                            del self.file['messages'][name]
+                        if name in self.file['orderbooks'].keys():
+                            print('Overwriting orderbook data for {}'.format(name))
+                            del self.file['orderbooks'][name]
+                        if name in self.file['trades'].keys():
+                            print('Overwriting trades data for {}'.format(name))
+                            del self.file['trades'][name]
+                        if name in self.file['noii'].keys():
+                            print('Overwriting noii data for {}'.format(name))
+                            del self.file['noii'][name]
+                        if 'bars' in self.file and name in self.file['bars'].keys():
+                            print('Overwriting bars data for {}'.format(name))
+                            del self.file['bars'][name]
+                        if 'orders' in self.file and name in self.file['orders'].keys():
+                            print('Overwriting orders data for {}'.format(name))
+                            del self.file['orders'][name]
+                        for grp in ('deltas', 'keyframes', 'keyindex'):
+                            if grp in self.file and name in self.file[grp].keys():
+                                print('Overwriting {} data for {}'.format(grp, name))
+                                del self.file[grp][name]
+                except OSError as e:
+                    print('HDF5 file does not exist. Creating a new one.')
+                    self.file = h5py.File(path, 'x')  # create file, fail if exists
             self.messages = self.file.require_group('messages')
             self.orderbooks = self.file.require_group('orderbooks')
             self.trades = self.file.require_group('trades')
@@ -52,10 +133,11 @@ class Database():
                                               shape=(0, 8),
                                               maxshape=(None, None),
                                               dtype='i')
-                self.orderbooks.require_dataset(name,
-                                                shape=(0, 4 * nlevels + 2),
-                                                maxshape=(None, None),
-                                                dtype='i')
+                if not deltas:
+                    self.orderbooks.require_dataset(name,
+                                                    shape=(0, 4 * nlevels + 2),
+                                                    maxshape=(None, None),
+                                                    dtype='i')
                 self.trades.require_dataset(name,
                                             shape=(0, 5),
                                             maxshape=(None, None),
@@ -64,46 +146,78 @@ class Database():
                                           shape=(0, 14),
                                           maxshape=(None, None),
                                           dtype='i')
+            if deltas:
+                self.deltas = self.file.require_group('deltas')
+                self.keyframes = self.file.require_group('keyframes')
+                self.keyindex = self.file.require_group('keyindex')
+                for name in names:
+                    self.deltas.require_dataset(name,
+                                                shape=(0, 5),
+                                                maxshape=(None, None),
+                                                dtype='i')
+                    self.deltas[name].attrs['nlevels'] = nlevels
+                    self.keyframes.require_dataset(name,
+                                                   shape=(0, 3),
+                                                   maxshape=(None, None),
+                                                   dtype='i')
+                    self.keyindex.require_dataset(name,
+                                                  shape=(0, 3),
+                                                  maxshape=(None, None),
+                                                  dtype='i')
+            if bars:
+                self.bars = self.file.require_group('bars')
+                for name in names:
+                    self.bars.require_dataset(name,
+                                              shape=(0, 12),
+                                              maxshape=(None, None),
+                                              dtype='f8')
+            if orders:
+                self.orders = self.file.require_group('orders')
+                for name in names:
+                    self.orders.require_dataset(name,
+                                                shape=(0, len(ORDER_COLUMNS)),
+                                                maxshape=(None, None),
+                                                dtype='i8')
+        elif self.method == 'sqlite':
+            self.conn = sqlite3.connect(path)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.tables = ['messages', 'books', 'trades', 'noii']
+            if bars:
+                self.tables.append('bars')
+            if orders:
+                self.tables.append('orders')
+            self.inserts = {}
+            for grp in self.tables:
+                columns = sqlite_columns(grp, nlevels)
+                kind = 'REAL' if grp == 'bars' else 'INTEGER'
+                self.conn.execute('CREATE TABLE IF NOT EXISTS {} (name TEXT, date TEXT, time INTEGER, {})'.format(
+                    grp, ', '.join('{} {}'.format(column, kind) for column in columns)))
+                self.inserts[grp] = 'INSERT INTO {} VALUES ({})'.format(grp, ', '.join(['?'] * (len(columns) + 3)))
+                if not resume:
+                    for name in names:
+                        self.conn.execute('DELETE FROM {} WHERE name = ? AND date = ?'.format(grp), (name, date))
+            self.conn.commit()
         elif self.method == 'csv':
-            if os.path.exists('{}'.format(path)):
-                response = input('A database with that path already exists. Are you sure you want to proceed? [Y/N] ')
-                if response == 'Y':
-                    proceed = True
-                    for item in os.listdir('{}/messages/'.format(path)):
-                        os.remove('{}/messages/{}'.format(path, item))
-                    for item in os.listdir('{}/books/'.format(path)):
-                        os.remove('{}/books/{}'.format(path, item))
-                    for item in os.listdir('{}/trades/'.format(path)):
-                        os.remove('{}/trades/{}'.format(path, item))
-                    for item in os.listdir('{}/noii/'.format(path)):
-                        os.remove('{}/noii/{}'.format(path, item))
-                    os.rmdir('{}/messages/'.format(path))
-                    os.rmdir('{}/books/'.format(path))
-                    os.rmdir('{}/trades/'.format(path))
-                    os.rmdir('{}/noii/'.format(path))
-                    for item in os.listdir('{}'.format(path)):
-                        os.remove('{}/{}'.format(path, item))
-                    os.rmdir('{}'.format(path))
+            self.messages_path = '{}/messages/'.format(path)
+            self.books_path = '{}/books/'.format(path)
+            self.trades_path = '{}/trades/'.format(path)
+            self.noii_path = '{}/noii/'.format(path)
+            self.bars_path = '{}/bars/'.format(path)
+            self.orders_path = '{}/orders/'.format(path)
+            if not resume:
+                if os.path.exists('{}'.format(path)):
+                    print('Writing to existing directory: {}/'.format(path))
                 else:
-                    # TODO: Need to exit the program
-                    proceed = False
-                    print('Process cancelled.')
-            else:
-                proceed = True
-
-            if proceed:
-                print('Creating a new database in directory: {}/'.format(path))
-
-                self.messages_path = '{}/messages/'.format(path)
-                self.books_path = '{}/books/'.format(path)
-                self.trades_path = '{}/trades/'.format(path)
-                self.noii_path = '{}/noii/'.format(path)
-
-                os.makedirs(path)
-                os.makedirs(self.messages_path)
-                os.makedirs(self.books_path)
-                os.makedirs(self.trades_path)
-                os.makedirs(self.noii_path)
+                    print('Creating a new database in directory: {}/'.format(path))
+                os.makedirs(self.messages_path, exist_ok=True)
+                os.makedirs(self.books_path, exist_ok=True)
+                os.makedirs(self.trades_path, exist_ok=True)
+                os.makedirs(self.noii_path, exist_ok=True)
+                if bars:
+                    os.makedirs(self.bars_path, exist_ok=True)
+                if orders:
+                    os.makedirs(self.orders_path, exist_ok=True)
 
                 columns = ['sec', 'nano', 'name']
                 columns.extend(['bidprc{}'.format(i) for i in range(nlevels)])
@@ -119,13 +233,159 @@ class Database():
                         trades_file.write('sec,nano,name,side,shares,price\n')
                     with open(self.noii_path + 'noii_{}.txt'.format(name), 'w') as noii_file:
                         noii_file.write('sec,nano,name,type,cross,shares,price,paired,imb,dir,far,near,curr\n')
+                    if bars:
+                        with open(self.bars_path + 'bars_{}.txt'.format(name), 'w') as bars_file:
+                            bars_file.write('sec,nano,name,open,high,low,close,vwap,volume,count,spread,biddepth,askdepth\n')
+                    if orders:
+                        with open(self.orders_path + 'orders_{}.txt'.format(name), 'w') as orders_file:
+                            orders_file.write(','.join(ORDER_COLUMNS[:2] + ['name'] + ORDER_COLUMNS[2:]) + '\n')
 
     def close(self):
         if self.method == 'hdf5':
             self.file.close()
+        elif self.method == 'sqlite':
+            self.conn.commit()
+            print('Building indexes...')
+            for grp in self.tables:
+                self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_name_date_time ON {0} (name, date, time)'.format(grp))
+            self.conn.execute('PRAGMA optimize')
+            self.conn.commit()
+            self.conn.close()
+        else:
+            pass
+
+    def abort(self):
+        """Close the database without committing or indexing, e.g. when a job is interrupted."""
+        if self.method == 'hdf5':
+            self.file.close()
+        elif self.method == 'sqlite':
+            self.conn.close()
+        else:
+            pass
+
+    def flush(self):
+        if self.method == 'hdf5':
+            self.file.flush()
+        elif self.method == 'sqlite':
+            self.conn.commit()
         else:
             pass
 
+    def insert(self, grp, name, array):
+        """Insert rows of (sec, nano, ...) into a SQLite table."""
+        rows = [[name, self.date, row[0] * 10 ** 9 + row[1]] + row for row in array.tolist()]
+        self.conn.executemany(self.inserts[grp], rows)
+
+    def sizes(self, names):
+        """Return the size of each dataset (rows for HDF5, last rowid of each table for SQLite, bytes for CSV)."""
+        sizes = {}
+        for name in names:
+            if self.method == 'hdf5':
+                sizes[('messages', name)] = self.messages[name].shape[0]
+                if self.has_deltas:
+                    sizes[('books', name)] = self.deltas[name].shape[0]
+                    sizes[('keyframes', name)] = self.keyframes[name].shape[0]
+                    sizes[('keyindex', name)] = self.keyindex[name].shape[0]
+                else:
+                    sizes[('books', name)] = self.orderbooks[name].shape[0]
+                sizes[('trades', name)] = self.trades[name].shape[0]
+                sizes[('noii', name)] = self.noii[name].shape[0]
+                if self.has_bars:
+                    sizes[('bars', name)] = self.bars[name].shape[0]
+                if self.has_orders:
+                    sizes[('orders', name)] = self.orders[name].shape[0]
+            elif self.method == 'sqlite':
+                for grp in self.tables:
+                    query = 'SELECT COALESCE(MAX(rowid), 0) FROM {}'.format(grp)
+                    sizes[(grp, name)] = self.conn.execute(query).fetchone()[0]
+            elif self.method == 'csv':
+                sizes[('messages', name)] = os.path.getsize(self.messages_path + 'messages_{}.txt'.format(name))
+                sizes[('books', name)] = os.path.getsize(self.books_path + 'books_{}.txt'.format(name))
+                sizes[('trades', name)] = os.path.getsize(self.trades_path + 'trades_{}.txt'.format(name))
+                sizes[('noii', name)] = os.path.getsize(self.noii_path + 'noii_{}.txt'.format(name))
+                if self.has_bars:
+                    sizes[('bars', name)] = os.path.getsize(self.bars_path + 'bars_{}.txt'.format(name))
+                if self.has_orders:
+                    sizes[('orders', name)] = os.path.getsize(self.orders_path + 'orders_{}.txt'.format(name))
+        return sizes
+
+    def rows(self, names):
+        """Return the number of rows written to each group by name."""
+        rows = {}
+        if self.method == 'sqlite':
+            self.conn.commit()
+            for grp in self.tables:
+                query = 'SELECT name, COUNT(*) FROM {} WHERE date = ? GROUP BY name'.format(grp)
+                counts = dict(self.conn.execute(query, (self.date,)).fetchall())
+                for name in names:
+                    rows[(grp, name)] = counts.get(name, 0)
+            return rows
+        for name in names:
+            if self.method == 'hdf5':
+                rows[('messages', name)] = self.messages[name].shape[0]
+                if self.has_deltas:
+                    rows[('books', name)] = self.deltas[name].shape[0]
+                else:
+                    rows[('books', name)] = self.orderbooks[name].shape[0]
+                rows[('trades', name)] = self.trades[name].shape[0]
+                rows[('noii', name)] = self.noii[name].shape[0]
+                if self.has_bars:
+                    rows[('bars', name)] = self.bars[name].shape[0]
+                if self.has_orders:
+                    rows[('orders', name)] = self.orders[name].shape[0]
+            elif self.method == 'csv':
+                rows[('messages', name)] = count_lines(self.messages_path + 'messages_{}.txt'.format(name)) - 1
+                rows[('books', name)] = count_lines(self.books_path + 'books_{}.txt'.format(name)) - 1
+                rows[('trades', name)] = count_lines(self.trades_path + 'trades_{}.txt'.format(name)) - 1
+                rows[('noii', name)] = count_lines(self.noii_path + 'noii_{}.txt'.format(name)) - 1
+                if self.has_bars:
+                    rows[('bars', name)] = count_lines(self.bars_path + 'bars_{}.txt'.format(name)) - 1
+                if self.has_orders:
+                    rows[('orders', name)] = count_lines(self.orders_path + 'orders_{}.txt'.format(name)) - 1
+        return rows
+
+    def truncate(self, sizes):
+        """Discard data written after `sizes` was recorded."""
+        for (grp, name), size in sizes.items():
+            if self.method == 'hdf5':
+                if grp == 'messages':
+                    dataset = self.messages[name]
+                elif grp == 'books' and self.has_deltas:
+                    dataset = self.deltas[name]
+                elif grp == 'books':
+                    dataset = self.orderbooks[name]
+                elif grp == 'keyframes':
+                    dataset = self.keyframes[name]
+                elif grp == 'keyindex':
+                    dataset = self.keyindex[name]
+                elif grp == 'trades':
+                    dataset = self.trades[name]
+                elif grp == 'noii':
+                    dataset = self.noii[name]
+                elif grp == 'bars':
+                    dataset = self.bars[name]
+                elif grp == 'orders':
+                    dataset = self.orders[name]
+                dataset.resize((size, dataset.shape[1]))
+            elif self.method == 'sqlite':
+                query = 'DELETE FROM {} WHERE rowid > ? AND name = ? AND date = ?'.format(grp)
+                self.conn.execute(query, (size, name, self.date))
+                self.conn.commit()
+            elif self.method == 'csv':
+                if grp == 'messages':
+                    path = self.messages_path + 'messages_{}.txt'.format(name)
+                elif grp == 'books':
+                    path = self.books_path + 'books_{}.txt'.format(name)
+                elif grp == 'trades':
+                    path = self.trades_path + 'trades_{}.txt'.format(name)
+                elif grp == 'noii':
+                    path = self.noii_path + 'noii_{}.txt'.format(name)
+                elif grp == 'bars':
+                    path = self.bars_path + 'bars_{}.txt'.format(name)
+                elif grp == 'orders':
+                    path = self.orders_path + 'orders_{}.txt'.format(name)
+                os.truncate(path, size)
+
 
 class Message():
     """A class representing out-going messages from the NASDAQ system.
@@ -156,6 +416,9 @@ class Message():
         MPID attribution
     """
 
+    __slots__ = ('date', 'name', 'sec', 'nano', 'type', 'event', 'buysell',
+                 'price', 'shares', 'refno', 'newrefno', 'mpid')
+
     def __init__(self, date='.', sec=-1, nano=-1, type='.', event='.', name='.',
                  buysell='.', price=-1, shares=0, refno=-1, newrefno=-1, mpid='.'):
         self.date = date
@@ -202,17 +465,13 @@ class Message():
         return 'Message(' + sep.join(line) + ')'
 
     def split(self):
-        """Converts a replace message to an add and a delete."""
+        """Converts a replace message to an add and a delete.
+
+        Returns the replace message itself along with the delete and add messages.
+
+        """
         assert self.type == 'U', "ASSERT-ERROR: split method called on non-replacement message."
         if self.type == 'U':
-            new_message = Message(date=self.date,
-                                  sec=self.sec,
-                                  nano=self.nano,
-                                  type='U',
-                                  price=self.price,
-                                  shares=self.shares,
-                                  refno=self.refno,
-                                  newrefno=self.newrefno)
             del_message = Message(date=self.date,
                                   sec=self.sec,
                                   nano=self.nano,
@@ -227,7 +486,7 @@ class Message():
                                   shares=self.shares,
                                   refno=self.refno,
                                   newrefno=self.newrefno)
-            return (new_message, del_message, add_message)
+            return (self, del_message, add_message)
 
     def to_list(self):
         """Returns message as a list."""
@@ -363,6 +622,10 @@ class NOIIMessage():
 
     """
 
+    __slots__ = ('date', 'sec', 'nano', 'name', 'type', 'cross', 'buysell',
+                 'price', 'shares', 'matchno', 'paired', 'imbalance',
+                 'direction', 'far', 'near', 'current')
+
     def __init__(self, date='.', sec=-1, nano=-1, name='.', type='.', cross='.',
                  buysell='.', price=-1, shares=0, matchno=-1, paired=-1,
                  imbalance=-1, direction='.', far=-1, near=-1, current=-1):
@@ -556,6 +819,8 @@ class Trade():
         Shares
     """
 
+    __slots__ = ('date', 'name', 'sec', 'nano', 'side', 'price', 'shares')
+
     def __init__(self, date='.', sec=-1, nano=-1, name='.', side='.', price=-1, shares=0):
         self.date = date
         self.name = name
@@ -622,10 +887,98 @@ class Trade():
                 fout.write(sep.join(line) + '\n')
 
 
+# message types written by `Message.to_txt` with the same columns
+ORDER_TYPES = ('A', 'F', 'E', 'C', 'X', 'D', 'U')
+
+
+def format_prices(prices, missing=None):
+    """Format an array of integer prices as `str(price / 10 ** 4)`.
+
+    Each distinct price is formatted once, which is much faster than formatting every element for columns of prices (or depths) that repeat. Prices equal to `missing` are formatted as integers (like the -1 of empty book levels). Returns an np.array of strings (with dtype object).
+
+    """
+    prices = np.asarray(prices, dtype=np.int64)
+    unique, index = np.unique(prices, return_inverse=True)
+    text = [str(price) if price == missing else str(price / 10 ** 4) for price in unique.tolist()]
+    return np.array(text, dtype=object)[index.reshape(prices.shape)]
+
+
+def format_integers(values):
+    """Format an array of integers as `str(value)`, formatting each distinct value once."""
+    values = np.asarray(values, dtype=np.int64)
+    unique, index = np.unique(values, return_inverse=True)
+    return np.array([str(value) for value in unique.tolist()], dtype=object)[index.reshape(values.shape)]
+
+
+def format_messages(messages):
+    """Return the CSV lines of a list of messages (as `to_txt`) as one string.
+
+    Fields are gathered into columns, prices are formatted once per distinct price (see `format_prices`), and lines are joined column by column rather than by calling `to_txt` on each message. Lists that mix messages with different columns are formatted one message at a time.
+
+    """
+    if len(messages) == 0:
+        return ''
+    first = messages[0]
+    if isinstance(first, NOIIMessage) and all(isinstance(m, NOIIMessage) for m in messages):
+        divide = np.array([m.type == 'Q' for m in messages])  # 'Q' prices or 'I' reference prices
+        columns = [[m.sec for m in messages],
+                   [m.nano for m in messages],
+                   [m.name for m in messages],
+                   [m.type for m in messages],
+                   [m.cross for m in messages],
+                   [m.shares for m in messages],
+                   _noii_prices([m.price for m in messages], divide),
+                   [m.paired for m in messages],
+                   [m.imbalance for m in messages],
+                   [m.direction for m in messages],
+                   _noii_prices([m.far for m in messages], ~divide),
+                   _noii_prices([m.near for m in messages], ~divide),
+                   _noii_prices([m.current for m in messages], ~divide)]
+    elif all(isinstance(m, Message) and m.type == 'P' for m in messages):
+        columns = [[m.sec for m in messages],
+                   [m.nano for m in messages],
+                   [m.name for m in messages],
+                   [m.buysell for m in messages],
+                   [m.shares for m in messages],
+                   format_prices([m.price for m in messages]).tolist()]
+    elif all(isinstance(m, Message) and m.type in ORDER_TYPES for m in messages):
+        columns = [[m.sec for m in messages],
+                   [m.nano for m in messages],
+                   [m.name for m in messages],
+                   [m.type for m in messages],
+                   [m.refno for m in messages],
+                   [m.buysell for m in messages],
+                   [m.shares for m in messages],
+                   format_prices([m.price for m in messages]).tolist(),
+                   [m.mpid for m in messages]]
+    else:
+        return ''.join([m.to_txt() for m in messages])
+    columns = [list(map(str, column)) for column in columns]
+    return '\n'.join(map(','.join, zip(*columns))) + '\n'
+
+
+def _noii_prices(prices, divide):
+    """Format a column of NOII prices, dividing by 10 ** 4 only where `divide` is True."""
+    return np.where(divide, format_prices(prices), [str(price) for price in prices]).tolist()
+
+
+def format_books(name, array):
+    """Return the CSV lines of `Book.to_array` rows (as `Book.to_txt`) as one string."""
+    if len(array) == 0:
+        return ''
+    nlevels = (array.shape[1] - 2) // 4
+    prices = format_prices(array[:, 2:2 + 2 * nlevels], missing=-1)
+    depths = format_integers(array[:, 2 + 2 * nlevels:])
+    columns = [list(map(str, array[:, 0].tolist())), list(map(str, array[:, 1].tolist())), [name] * array.shape[0]]
+    columns.extend(prices.T.tolist())
+    columns.extend(depths.T.tolist())
+    return '\n'.join(map(','.join, zip(*columns))) + '\n'
+
+
 class Messagelist():
     """A class to store messages.
 
-    Provides methods for writing to HDF5 and PostgreSQL databases.
+    Provides methods for writing to HDF5, CSV and SQLite databases.
 
     Parameters
     ----------
@@ -638,6 +991,8 @@ class Messagelist():
     ----------
     messages : dict
         Contains a Message objects for each name in names
+    on_flush : function
+        If set, called as `on_flush(name, grp, rows)` after messages are written
 
     Examples
     --------
@@ -650,6 +1005,9 @@ class Messagelist():
     def __init__(self, date, names):
         self.messages = {}
         self.date = date
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.on_flush = None
         for name in names:
             self.messages[name] = []
 
@@ -667,6 +1025,8 @@ class Messagelist():
         if len(m) > 0:
             listed = [message.to_array() for message in m]
             array = np.array(listed)
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * array.shape[1] * 4  # stored as 32-bit integers
             if grp == 'messages':
                 db_size, db_cols = db.messages[name].shape  # rows
                 array_size, array_cols = array.shape
@@ -686,23 +1046,43 @@ class Messagelist():
                 db.noii[name].resize((db_resize, db_cols))
                 db.noii[name][db_size:db_resize, :] = array
             self.messages[name] = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, grp, len(m))
         print('wrote {} messages to dataset (name={}, group={})'.format(len(m), name, grp))
 
+    def to_sqlite(self, name, db, grp):
+        """Write messages to SQLite database."""
+        assert db.method == 'sqlite', 'Attempted to write to non-SQLite database'
+        m = self.messages[name]
+        if len(m) > 0:
+            array = np.array([message.to_array() for message in m])
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * (array.shape[1] + 1) * 8  # stored as 64-bit integers
+            db.insert(grp, name, array)
+            self.messages[name] = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, grp, len(m))
+        print('wrote {} messages to table (name={}, table={})'.format(len(m), name, grp))
+
     def to_txt(self, name, db, grp):
         assert db.method == 'csv', 'Attempted to write to non-CSV database'
         message_list = self.messages[name]
         if len(message_list) > 0:
-            texted = [message.to_txt() for message in message_list]
+            texted = format_messages(message_list)
+            self.rows_written += len(message_list)
+            self.bytes_written += len(texted)
             if grp == 'messages':
                 with open('{}/messages_{}.txt'.format(db.messages_path, name), 'a') as fout:
-                    fout.writelines(texted)
+                    fout.write(texted)
             if grp == 'trades':
                 with open('{}/trades_{}.txt'.format(db.trades_path, name), 'a') as fout:
-                    fout.writelines(texted)
+                    fout.write(texted)
             if grp == 'noii':
                 with open('{}/noii_{}.txt'.format(db.noii_path, name), 'a') as fout:
-                    fout.writelines(texted)
+                    fout.write(texted)
             self.messages[name] = []
+            if self.on_flush is not None:
+                self.on_flush(name, grp, len(message_list))
         print('wrote {} messages to dataset (name={}, group={})'.format(len(message_list), name, grp))
 
 
@@ -724,6 +1104,8 @@ class Order():
 
     """
 
+    __slots__ = ('name', 'buysell', 'price', 'shares')
+
     def __init__(self, name='.', buysell='.', price='.', shares='.'):
         self.name = name
         self.buysell = buysell
@@ -752,15 +1134,40 @@ class Orderlist():
 
     This class handles the matching of messages to standing orders. Incoming messages are first matched to standing orders so that missing message data can be completed, and then the referenced order is updated based on the message.
 
+    If `lifecycles` is True, the history of each order is recorded as well, and one row is buffered for each order when it is finished (fully executed, deleted or replaced), or when `close` is called for orders that are still open. Rows are buffered by name in typed arrays and have the columns of `ORDER_COLUMNS`:
+
+    - sec, nano: time the order finished
+    - refno: reference number
+    - origin: reference number of the first order of its chain of replacements (`refno` if it doesn't replace an order)
+    - prevrefno: reference number of the order it replaced (-1 if none)
+    - side, price, shares: side (1 for bids, -1 for asks), price and shares when it was added
+    - addsec, addnano: time it was added
+    - firstsec, firstnano, lastsec, lastnano: times of its first and last executions (-1 if none)
+    - filled, cancelled: shares executed and cancelled (shares moved to a replacement aren't cancelled)
+    - status: `OPEN`, `FILLED`, `DELETED` or `REPLACED`
+    - distance: distance from its price to the best price on its side of the book when it was added (in price units, positive if behind the best price, and 0 if that side was empty)
+
     Attributes
     ----------
     orders : dict
         Keys are reference numbers, values are Orders.
+    lifecycles : dict
+        Keys are reference numbers, values are the history of open orders (None unless `lifecycles` is True)
+    rows : dict
+        Keys are names, values are buffered rows of finished orders (flat `array.array`s of 64-bit integers)
+    on_flush : function
+        If set, called as `on_flush(name, 'orders', rows)` after rows are written
 
     """
 
-    def __init__(self):
+    def __init__(self, lifecycles=False):
         self.orders = {}
+        self.lifecycles = {} if lifecycles else None
+        self.origins = {}
+        self.rows = {}
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.on_flush = None
 
     def __str__(self):
         sep = '\n'
@@ -795,18 +1202,43 @@ class Orderlist():
                 message.price = ref_order.price
                 message.shares = -ref_order.shares
 
-    def add(self, message):
-        """Add a new Order to the list."""
+    def add(self, message, book=None, replaces=None):
+        """Add a new Order to the list.
+
+        When recording lifecycles, `book` is the Book of the order before it is added, and `replaces` is the reference number of the order it replaces (if any).
+
+        """
         order = Order()
         order.name = message.name
         order.buysell = message.buysell
         order.price = message.price
         order.shares = message.shares
         self.orders[message.refno] = order
+        if self.lifecycles is not None:
+            side = 1 if message.buysell == 'B' else -1
+            distance = 0
+            if book is not None:
+                if side == 1 and len(book.bids) > 0:
+                    distance = max(book.bids) - message.price
+                elif side == -1 and len(book.asks) > 0:
+                    distance = message.price - min(book.asks)
+            if replaces is None:
+                origin, prev = message.refno, -1
+            else:
+                origin, prev = self.origins.pop(replaces, replaces), replaces
+            # name, origin, prevrefno, side, price, shares, addsec, addnano, firstsec, firstnano, lastsec, lastnano, filled, cancelled, distance
+            self.lifecycles[message.refno] = [message.name, origin, prev, side, message.price, message.shares,
+                                              message.sec, message.nano, -1, -1, -1, -1, 0, 0, distance]
 
-    def update(self, message):
-        """Update an existing Order based on incoming Message."""
+    def update(self, message, replaced=False):
+        """Update an existing Order based on incoming Message.
+
+        `replaced` is True for the delete half of a replace message (see `Message.split`).
+
+        """
         if message.refno in self.orders.keys():
+            if self.lifecycles is not None:
+                self._record(message, replaced)
             if message.type == 'E':  # execute
                 self.orders[message.refno].shares += message.shares
             elif message.type == 'X':  # execute w/ price
@@ -818,6 +1250,248 @@ class Orderlist():
         else:
             pass
 
+    def _record(self, message, replaced):
+        """Add a message to the history of an order, and finish the order if it is done."""
+        lifecycle = self.lifecycles.get(message.refno)
+        if lifecycle is None:
+            return
+        if message.type in ('E', 'C'):
+            if lifecycle[8] == -1:
+                lifecycle[8] = message.sec
+                lifecycle[9] = message.nano
+            lifecycle[10] = message.sec
+            lifecycle[11] = message.nano
+            lifecycle[12] -= message.shares
+            if self.orders[message.refno].shares + message.shares <= 0:
+                self._finish(message.refno, message.sec, message.nano, FILLED)
+        elif message.type == 'X':
+            lifecycle[13] -= message.shares
+            if self.orders[message.refno].shares + message.shares <= 0:
+                self._finish(message.refno, message.sec, message.nano, DELETED)
+        elif message.type == 'D':
+            if replaced:
+                self.origins[message.refno] = lifecycle[1]
+                self._finish(message.refno, message.sec, message.nano, REPLACED)
+            else:
+                lifecycle[13] += self.orders[message.refno].shares
+                self._finish(message.refno, message.sec, message.nano, DELETED)
+
+    def _finish(self, refno, sec, nano, status):
+        """Buffer the row of a finished order."""
+        name, origin, prev, side, price, shares, addsec, addnano, firstsec, firstnano, lastsec, lastnano, \
+            filled, cancelled, distance = self.lifecycles.pop(refno)
+        rows = self.rows.get(name)
+        if rows is None:
+            rows = self.rows[name] = array.array('q')
+        rows.extend((sec, nano, refno, origin, prev, side, price, shares, addsec, addnano,
+                     firstsec, firstnano, lastsec, lastnano, filled, cancelled, status, distance))
+
+    def close(self, sec, nano):
+        """Buffer the rows of all open orders (with status `OPEN`) at a time, e.g. the end of the day."""
+        for refno in list(self.lifecycles):
+            self._finish(refno, sec, nano, OPEN)
+
+    def buffered(self, name):
+        """Return the number of buffered rows for a name."""
+        return len(self.rows.get(name, ())) // len(ORDER_COLUMNS)
+
+    def to_array(self, name):
+        """Return the buffered rows for a name as an np.array (and reset the buffer)."""
+        rows = self.rows.pop(name, None)
+        if rows is None:
+            return np.zeros((0, len(ORDER_COLUMNS)), dtype=np.int64)
+        return np.frombuffer(rows, dtype=np.int64).reshape(-1, len(ORDER_COLUMNS))
+
+    def to_hdf5(self, name, db):
+        """Write order lifecycle rows to HDF5 file."""
+        array = self.to_array(name)
+        if array.shape[0] > 0:
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.nbytes
+            db_size, db_cols = db.orders[name].shape  # rows
+            array_size, array_cols = array.shape
+            db_resize = db_size + array_size
+            db.orders[name].resize((db_resize, db_cols))
+            db.orders[name][db_size:db_resize, :] = array
+            if self.on_flush is not None:
+                self.on_flush(name, 'orders', array.shape[0])
+        print('wrote {} orders to dataset (name={})'.format(array.shape[0], name))
+
+    def to_sqlite(self, name, db):
+        """Write order lifecycle rows to SQLite database."""
+        array = self.to_array(name)
+        if array.shape[0] > 0:
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * (array.shape[1] + 1) * 8  # stored as 64-bit integers
+            db.insert('orders', name, array)
+            if self.on_flush is not None:
+                self.on_flush(name, 'orders', array.shape[0])
+        print('wrote {} orders to table (name={})'.format(array.shape[0], name))
+
+    def to_txt(self, name, db):
+        array = self.to_array(name)
+        if array.shape[0] > 0:
+            columns = [format_integers(array[:, 0]), format_integers(array[:, 1]), [name] * array.shape[0]]
+            columns.extend(format_integers(array[:, 2:]).T)
+            texted = '\n'.join(map(','.join, zip(*columns))) + '\n'
+            self.rows_written += array.shape[0]
+            self.bytes_written += len(texted)
+            with open('{}/orders_{}.txt'.format(db.orders_path, name), 'a') as fout:
+                fout.write(texted)
+            if self.on_flush is not None:
+                self.on_flush(name, 'orders', array.shape[0])
+        print('wrote {} orders to dataset (name={})'.format(array.shape[0], name))
+
+
+class L3Book():
+    """A class to track the queue of orders at each price level (an order-level, or L3, book).
+
+    Orders at each price level are kept in time priority in a doubly-linked list. The links are stored in flat lists indexed by slot (one slot per order, reused once the order is removed), so adding, executing, cancelling and deleting an order take constant time however long the queue is. The queue position of an order and the number of shares ahead of it are computed on demand by walking its queue from the front.
+
+    Messages must be completed by `Orderlist.complete_message` first (replace messages are split into a delete and an add, so a replaced order loses its priority).
+
+    Attributes
+    ----------
+    slots : dict
+        Keys are reference numbers, values are slots
+    levels : dict
+        Keys are (name, buysell, price), values are [first slot, last slot, orders, shares] of the queue at that price
+
+    Examples
+    --------
+    Track queues while unpacking and look up the position of each new order::
+
+    >> def on_message(message, booklist):
+    >>     if message.type == 'A':
+    >>         position, ahead = booklist.queues.position(message.refno)
+    >> pk.unpack(..., queues=True, on_message=on_message)
+
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.levels = {}
+        self.refnos = []
+        self.shares = []
+        self.keys = []
+        self.prev = []
+        self.next = []
+        self.free = []
+
+    def __str__(self):
+        return 'L3Book(orders={}, levels={})'.format(len(self.slots), len(self.levels))
+
+    def __repr__(self):
+        return str(self)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def update(self, message):
+        """Update the queues from a message that changed an order book."""
+        if message.type in ('A', 'F'):
+            self.add(message.refno, message.name, message.buysell, message.price, message.shares)
+        elif message.type in ('E', 'C', 'X'):
+            self.reduce(message.refno, -message.shares)
+        elif message.type == 'D':
+            self.remove(message.refno)
+
+    def add(self, refno, name, buysell, price, shares):
+        """Add an order to the back of the queue at its price."""
+        if refno in self.slots:
+            self.remove(refno)
+        key = (name, buysell, price)
+        if len(self.free) > 0:
+            slot = self.free.pop()
+            self.refnos[slot] = refno
+            self.shares[slot] = shares
+            self.keys[slot] = key
+            self.next[slot] = -1
+        else:
+            slot = len(self.refnos)
+            self.refnos.append(refno)
+            self.shares.append(shares)
+            self.keys.append(key)
+            self.prev.append(-1)
+            self.next.append(-1)
+        level = self.levels.get(key)
+        if level is None:
+            self.prev[slot] = -1
+            self.levels[key] = [slot, slot, 1, shares]
+        else:
+            self.prev[slot] = level[1]
+            self.next[level[1]] = slot
+            level[1] = slot
+            level[2] += 1
+            level[3] += shares
+        self.slots[refno] = slot
+
+    def reduce(self, refno, shares):
+        """Remove shares from an order (executed or cancelled), removing the order if none are left."""
+        slot = self.slots.get(refno)
+        if slot is None:
+            return
+        if shares >= self.shares[slot]:
+            self.remove(refno)
+        else:
+            self.shares[slot] -= shares
+            self.levels[self.keys[slot]][3] -= shares
+
+    def remove(self, refno):
+        """Remove an order from its queue."""
+        slot = self.slots.pop(refno, None)
+        if slot is None:
+            return
+        key = self.keys[slot]
+        level = self.levels[key]
+        before = self.prev[slot]
+        after = self.next[slot]
+        if before == -1:
+            level[0] = after
+        else:
+            self.next[before] = after
+        if after == -1:
+            level[1] = before
+        else:
+            self.prev[after] = before
+        level[2] -= 1
+        level[3] -= self.shares[slot]
+        if level[2] == 0:
+            del self.levels[key]
+        self.keys[slot] = None
+        self.free.append(slot)
+
+    def position(self, refno):
+        """Return the number of orders and shares ahead of an order in its queue (or None if there is no such order)."""
+        slot = self.slots.get(refno)
+        if slot is None:
+            return None
+        orders = 0
+        ahead = 0
+        i = self.levels[self.keys[slot]][0]
+        while i != slot:
+            orders += 1
+            ahead += self.shares[i]
+            i = self.next[i]
+        return orders, ahead
+
+    def queue(self, name, buysell, price):
+        """Return the orders at a price as a list of (refno, shares), from the front of the queue."""
+        level = self.levels.get((name, buysell, price))
+        orders = []
+        i = -1 if level is None else level[0]
+        while i != -1:
+            orders.append((self.refnos[i], self.shares[i]))
+            i = self.next[i]
+        return orders
+
+    def depth(self, name, buysell, price):
+        """Return the number of orders and shares at a price."""
+        level = self.levels.get((name, buysell, price))
+        if level is None:
+            return 0, 0
+        return level[2], level[3]
+
 
 class Book():
     """A class to represent an order book.
@@ -941,34 +1615,43 @@ class Book():
                 values.append(0)
         return values
 
+    def to_values(self):
+        """Return the `to_array` row as a list of integers."""
+        sorted_bids = sorted(self.bids.keys(), reverse=True)[:self.levels]
+        sorted_asks = sorted(self.asks.keys())[:self.levels]
+        values = [int(self.sec), int(self.nano)]
+        values.extend(sorted_bids)  # bid price
+        values.extend([-1] * (self.levels - len(sorted_bids)))
+        values.extend(sorted_asks)  # ask price
+        values.extend([-1] * (self.levels - len(sorted_asks)))
+        values.extend([self.bids[price] for price in sorted_bids])  # bid depth
+        values.extend([0] * (self.levels - len(sorted_bids)))
+        values.extend([self.asks[price] for price in sorted_asks])  # ask depth
+        values.extend([0] * (self.levels - len(sorted_asks)))
+        return values
+
     def to_array(self):
         '''Return Order as numpy array.'''
-        values = []
-        values.append(int(self.sec))
-        values.append(int(self.nano))
-        sorted_bids = sorted(self.bids.keys(), reverse=True)
-        sorted_asks = sorted(self.asks.keys())
-        for i in range(0, self.levels):  # bid price
-            if i < len(self.bids):
-                values.append(sorted_bids[i])
-            else:
-                values.append(-1)
-        for i in range(0, self.levels):  # ask price
-            if i < len(self.asks):
-                values.append(sorted_asks[i])
-            else:
-                values.append(-1)
-        for i in range(0, self.levels):  # bid depth
-            if i < len(self.bids):
-                values.append(self.bids[sorted_bids[i]])
-            else:
-                values.append(0)
-        for i in range(0, self.levels):  # ask depth
-            if i < len(self.asks):
-                values.append(self.asks[sorted_asks[i]])
-            else:
-                values.append(0)
-        return np.array(values)
+        return np.array(self.to_values())
+
+    def to_delta(self, message):
+        """Return the price level updated by a message as [sec, nano, side, price, shares].
+
+        Side is 1 for bids and -1 for asks, and shares is the new depth of the level (0 if the level was removed). Messages that don't update a level return side 0.
+
+        """
+        if message.buysell == 'B':
+            return [int(self.sec), int(self.nano), 1, message.price, self.bids.get(message.price, 0)]
+        elif message.buysell == 'S':
+            return [int(self.sec), int(self.nano), -1, message.price, self.asks.get(message.price, 0)]
+        else:
+            return [int(self.sec), int(self.nano), 0, 0, 0]
+
+    def to_levels(self):
+        """Return every price level of the book as rows of [side, price, shares]."""
+        levels = [[1, price, shares] for price, shares in self.bids.items()]
+        levels.extend([[-1, price, shares] for price, shares in self.asks.items()])
+        return levels
 
     def to_txt(self):
         values = []
@@ -1016,46 +1699,494 @@ class Booklist():
     books : list
         A list of Books
     method : string
-        Specifies the type of database to create ('hdf5' or 'postgres')
+        Specifies the type of database to create ('hdf5', 'csv' or 'sqlite')
+    keyframes : int
+        If set (HDF5 only), each update is stored as a delta (see `Book.to_delta`) instead of a snapshot, and every level of the book is stored after every `keyframes` updates (see `BookReader`)
+    on_flush : function
+        If set, called as `on_flush(name, 'books', rows)` after books are written
+    queues : L3Book
+        If set, the queue of orders at each price level is updated along with the books
 
     """
 
-    def __init__(self, date, names, levels, method):
+    def __init__(self, date, names, levels, method, keyframes=None):
         self.books = {}
         self.method = method
+        self.keyframes = keyframes
+        self.queues = None
+        self.snapshot_time = 0.0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.on_flush = None
         for name in names:
             self.books[name] = {'hist': [], 'cur': Book(date, name, levels)}
+            if keyframes is not None:
+                self.books[name]['keys'] = []  # [side, price, shares]
+                self.books[name]['index'] = []  # [row, start, count]
+                self.books[name]['rows'] = 0
+                self.books[name]['keyrows'] = 0
 
     def update(self, message):
         """Update Book data from message."""
         b = self.books[message.name]['cur'].update(message)
-        if self.method == 'hdf5':
-            self.books[message.name]['hist'].append(b.to_array())
-        if self.method == 'csv':
-            self.books[message.name]['hist'].append(b.to_txt())
+        if self.queues is not None:
+            self.queues.update(message)
+        start = time.perf_counter()
+        if self.keyframes is not None:
+            book = self.books[message.name]
+            book['hist'].append(b.to_delta(message))
+            book['rows'] += 1
+            if book['rows'] % self.keyframes == 0:
+                levels = b.to_levels()
+                book['index'].append([book['rows'], book['keyrows'], len(levels)])
+                book['keys'].extend(levels)
+                book['keyrows'] += len(levels)
+        else:
+            self.books[message.name]['hist'].append(b.to_values())  # formatted when written (see `format_books`)
+        self.snapshot_time += time.perf_counter() - start
 
     def to_hdf5(self, name, db):
         """Write Book data to HDF5 file."""
+        if self.keyframes is not None:
+            return self._deltas_to_hdf5(name, db)
         hist = self.books[name]['hist']
         if len(hist) > 0:
             array = np.array(hist)
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * array.shape[1] * 4  # stored as 32-bit integers
             db_size, db_cols = db.orderbooks[name].shape  # rows
             array_size, array_cols = array.shape
             db_resize = db_size + array_size
             db.orderbooks[name].resize((db_resize, db_cols))
             db.orderbooks[name][db_size:db_resize, :] = array
             self.books[name]['hist'] = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, 'books', len(hist))
         print('wrote {} books to dataset (name={})'.format(len(hist), name))
 
+    def _deltas_to_hdf5(self, name, db):
+        book = self.books[name]
+        hist = book['hist']
+        for dataset, rows in ((db.deltas[name], hist),
+                              (db.keyframes[name], book['keys']),
+                              (db.keyindex[name], book['index'])):
+            if len(rows) > 0:
+                array = np.array(rows)
+                self.bytes_written += array.shape[0] * array.shape[1] * 4  # stored as 32-bit integers
+                db_size, db_cols = dataset.shape  # rows
+                array_size, array_cols = array.shape
+                db_resize = db_size + array_size
+                dataset.resize((db_resize, db_cols))
+                dataset[db_size:db_resize, :] = array
+        self.rows_written += len(hist)
+        book['hist'] = []  # reset
+        book['keys'] = []
+        book['index'] = []
+        if len(hist) > 0 and self.on_flush is not None:
+            self.on_flush(name, 'books', len(hist))
+        print('wrote {} book deltas to dataset (name={})'.format(len(hist), name))
+
+    def to_sqlite(self, name, db):
+        """Write Book data to SQLite database."""
+        hist = self.books[name]['hist']
+        if len(hist) > 0:
+            array = np.array(hist)
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * (array.shape[1] + 1) * 8  # stored as 64-bit integers
+            db.insert('books', name, array)
+            self.books[name]['hist'] = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, 'books', len(hist))
+        print('wrote {} books to table (name={})'.format(len(hist), name))
+
     def to_txt(self, name, db):
+        """Write Book data to CSV file (see `format_books`)."""
         hist = self.books[name]['hist']
         if len(hist) > 0:
+            texted = format_books(name, np.array(hist, dtype=np.int64))
+            self.rows_written += len(hist)
+            self.bytes_written += len(texted)
             with open('{}/books_{}.txt'.format(db.books_path, name), 'a') as fout:
-                fout.writelines(hist)
+                fout.write(texted)
             self.books[name]['hist'] = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, 'books', len(hist))
         print('wrote {} books to dataset (name={})'.format(len(hist), name))
 
 
+class Bars():
+    """A class to aggregate the trades and order book of a stock into bars.
+
+    Each bar records the open, high, low and close trade prices, the volume-weighted average price, the number of shares traded and the number of trades, along with the time-weighted average spread and depth at the best bid and ask. Bars with no trades have NaN prices.
+
+    Parameters
+    ----------
+    name : string
+        Stock ticker
+    kind : string
+        'time' (a bar every `size` seconds), 'volume' (a bar every `size` shares traded) or 'tick' (a bar every `size` trades)
+    size : int
+        Size of a bar. Trades are not split between bars: a volume bar is completed by the trade that brings its volume to at least `size`, and the next bar starts at the time of that trade. Time bars without trades are still recorded (with NaN prices).
+
+    Attributes
+    ----------
+    hist : list
+        Completed bars, as lists of (sec, nano, open, high, low, close, vwap, volume, count, spread, bid_depth, ask_depth), where sec and nano give the start of the bar.
+
+    """
+
+    def __init__(self, name, kind, size):
+        if kind not in ('time', 'volume', 'tick'):
+            raise ValueError('Unknown type of bar: {}'.format(kind))
+        self.name = name
+        self.kind = kind
+        self.size = size
+        self.hist = []
+        self.start = None  # nanoseconds
+        self.last = None  # nanoseconds
+        self.spread = None
+        self.bid_depth = 0
+        self.ask_depth = 0
+        self.reset()
+
+    def __str__(self):
+        return 'Bars(name={}, kind={}, size={}, bars={})'.format(self.name, self.kind, self.size, len(self.hist))
+
+    def __repr__(self):
+        return str(self)
+
+    def reset(self):
+        """Clear the current bar."""
+        self.open = None
+        self.high = None
+        self.low = None
+        self.close = None
+        self.value = 0
+        self.volume = 0
+        self.count = 0
+        self.spread_sum = 0
+        self.spread_time = 0
+        self.bid_sum = 0
+        self.ask_sum = 0
+        self.depth_time = 0
+
+    def advance(self, t):
+        """Move the clock forward to `t` nanoseconds, completing any time bars that end in between."""
+        if self.start is None:
+            if self.kind == 'time':
+                self.start = t - t % (self.size * 10 ** 9)
+            else:
+                self.start = t
+            self.last = t
+            return
+        if self.kind == 'time':
+            end = self.start + self.size * 10 ** 9
+            while t >= end:
+                self.accumulate(end)
+                self.complete(end)
+                end = self.start + self.size * 10 ** 9
+        self.accumulate(t)
+
+    def accumulate(self, t):
+        """Add the state of the book since the last update to the time-weighted averages."""
+        dt = t - self.last
+        if dt > 0:
+            if self.spread is not None:
+                self.spread_sum += self.spread * dt
+                self.spread_time += dt
+            self.bid_sum += self.bid_depth * dt
+            self.ask_sum += self.ask_depth * dt
+            self.depth_time += dt
+        self.last = t
+
+    def complete(self, t):
+        """Add the current bar to `hist` and start a new bar at `t` nanoseconds."""
+        if self.count > 0:
+            vwap = self.value / self.volume if self.volume != 0 else np.nan
+            prices = [self.open, self.high, self.low, self.close, vwap]
+        else:
+            prices = [np.nan] * 5
+        if self.spread_time > 0:
+            spread = self.spread_sum / self.spread_time
+        elif self.spread is not None:
+            spread = self.spread
+        else:
+            spread = np.nan
+        if self.depth_time > 0:
+            bid_depth = self.bid_sum / self.depth_time
+            ask_depth = self.ask_sum / self.depth_time
+        else:
+            bid_depth = self.bid_depth
+            ask_depth = self.ask_depth
+        sec, nano = divmod(self.start, 10 ** 9)
+        self.hist.append([sec, nano] + prices + [self.volume, self.count, spread, bid_depth, ask_depth])
+        self.start = t
+        self.reset()
+
+    def trade(self, sec, nano, price, shares):
+        """Add a trade to the current bar."""
+        self.advance(sec * 10 ** 9 + nano)
+        if self.count == 0:
+            self.open = price
+            self.high = price
+            self.low = price
+        else:
+            self.high = max(self.high, price)
+            self.low = min(self.low, price)
+        self.close = price
+        self.value += price * shares
+        self.volume += shares
+        self.count += 1
+        if self.kind == 'volume' and self.volume >= self.size:
+            self.complete(self.last)
+        elif self.kind == 'tick' and self.count >= self.size:
+            self.complete(self.last)
+
+    def update(self, book):
+        """Record the state of the order book after an update."""
+        self.advance(book.sec * 10 ** 9 + book.nano)
+        if len(book.bids) > 0:
+            best_bid = max(book.bids)
+            self.bid_depth = book.bids[best_bid]
+        else:
+            self.bid_depth = 0
+        if len(book.asks) > 0:
+            best_ask = min(book.asks)
+            self.ask_depth = book.asks[best_ask]
+        else:
+            self.ask_depth = 0
+        if len(book.bids) > 0 and len(book.asks) > 0:
+            self.spread = best_ask - best_bid
+        else:
+            self.spread = None
+
+    def finish(self):
+        """Complete the last bar (at the end of the data)."""
+        if self.start is not None:
+            self.complete(self.last)
+            self.start = None
+
+
+class Barlist():
+    """A class to store Bars.
+
+    Provides methods for writing to external databases.
+
+    Parameters
+    ----------
+    names : list
+        Contains the stock tickers to include in the database
+    kind : string
+        Type of bar ('time', 'volume' or 'tick')
+    size : int
+        Size of a bar (seconds, shares or trades)
+    method : string
+        Specifies the type of database to create ('hdf5' or 'csv')
+
+    Attributes
+    ----------
+    bars : dict
+        Keys are names, values are Bars
+    on_flush : function
+        If set, called as `on_flush(name, 'bars', rows)` after bars are written
+
+    Examples
+    --------
+    Create a Barlist of one minute bars::
+
+    >> barlist = pk.Barlist(['GOOG', 'AAPL'], 'time', 60, 'hdf5')
+
+    """
+
+    def __init__(self, names, kind, size, method):
+        self.bars = {}
+        self.method = method
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.on_flush = None
+        for name in names:
+            self.bars[name] = Bars(name, kind, size)
+
+    def update(self, book):
+        """Record the state of a Book after an update."""
+        self.bars[book.name].update(book)
+
+    def trade(self, message, price, shares):
+        """Add a trade from an execution message."""
+        self.bars[message.name].trade(message.sec, message.nano, price, shares)
+
+    def finish(self):
+        """Complete the last bar of every stock."""
+        for bars in self.bars.values():
+            bars.finish()
+
+    def to_hdf5(self, name, db):
+        """Write Bars to HDF5 file."""
+        hist = self.bars[name].hist
+        if len(hist) > 0:
+            array = np.array(hist, dtype=float)
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * array.shape[1] * 8  # stored as 64-bit floats
+            db_size, db_cols = db.bars[name].shape  # rows
+            array_size, array_cols = array.shape
+            db_resize = db_size + array_size
+            db.bars[name].resize((db_resize, db_cols))
+            db.bars[name][db_size:db_resize, :] = array
+            self.bars[name].hist = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, 'bars', len(hist))
+        print('wrote {} bars to dataset (name={})'.format(len(hist), name))
+
+    def to_sqlite(self, name, db):
+        """Write Bars to SQLite database."""
+        hist = self.bars[name].hist
+        if len(hist) > 0:
+            array = np.array(hist, dtype=float)
+            self.rows_written += array.shape[0]
+            self.bytes_written += array.shape[0] * (array.shape[1] + 1) * 8  # stored as 64-bit floats
+            db.insert('bars', name, array)
+            self.bars[name].hist = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, 'bars', len(hist))
+        print('wrote {} bars to table (name={})'.format(len(hist), name))
+
+    def to_txt(self, name, db):
+        hist = self.bars[name].hist
+        if len(hist) > 0:
+            texted = []
+            for values in hist:
+                line = [str(int(values[0])), str(int(values[1])), name]
+                line.extend([str(v / 10 ** 4) for v in values[2:7]])  # prices
+                line.extend([str(values[7]), str(values[8]), str(values[9] / 10 ** 4)])
+                line.extend([str(v) for v in values[10:]])
+                texted.append(','.join(line) + '\n')
+            self.rows_written += len(texted)
+            self.bytes_written += sum(len(line) for line in texted)
+            with open('{}/bars_{}.txt'.format(db.bars_path, name), 'a') as fout:
+                fout.writelines(texted)
+            self.bars[name].hist = []  # reset
+            if self.on_flush is not None:
+                self.on_flush(name, 'bars', len(hist))
+        print('wrote {} bars to dataset (name={})'.format(len(hist), name))
+
+
+# Message layouts by version and message type. Each entry is a struct format string (excluding the message type byte) and the Message attribute assigned to each unpacked value (None discards the value). ITCH 5.0 timestamps are six bytes, unpacked as a two-byte high part ('nano_hi') and a four-byte low part ('nano'). Messages without a 'sec' field are assigned the time of the last time message.
+PROTOCOLS = {
+    4.0: {'T': ('>I', ['sec']),
+          'S': ('>Is', ['nano', 'event']),
+          'H': ('>I6sss4s', ['nano', 'name', 'event', None, None]),
+          'A': ('>IQsI6sI', ['nano', 'refno', 'buysell', 'shares', 'name', 'price']),
+          'F': ('>IQsI6sI4s', ['nano', 'refno', 'buysell', 'shares', 'name', 'price', 'mpid']),
+          'E': ('>IQIQ', ['nano', 'refno', 'shares', None]),
+          'C': ('>IQIQsI', ['nano', 'refno', 'shares', None, None, 'price']),
+          'X': ('>IQI', ['nano', 'refno', 'shares']),
+          'D': ('>IQ', ['nano', 'refno']),
+          'U': ('>IQQII', ['nano', 'refno', 'newrefno', 'shares', 'price']),
+          'Q': ('>IQ6sIQs', ['nano', 'shares', 'name', 'price', 'matchno', 'cross'])},
+    4.1: {'T': ('>I', ['sec']),
+          'S': ('>Is', ['nano', 'event']),
+          'H': ('>I8sss4s', ['nano', 'name', 'event', None, None]),
+          'A': ('>IQsI8sI', ['nano', 'refno', 'buysell', 'shares', 'name', 'price']),
+          'F': ('>IQsI8sI4s', ['nano', 'refno', 'buysell', 'shares', 'name', 'price', 'mpid']),
+          'E': ('>IQIQ', ['nano', 'refno', 'shares', None]),
+          'C': ('>IQIQsI', ['nano', 'refno', 'shares', None, None, 'price']),
+          'X': ('>IQI', ['nano', 'refno', 'shares']),
+          'D': ('>IQ', ['nano', 'refno']),
+          'U': ('>IQQII', ['nano', 'refno', 'newrefno', 'shares', 'price']),
+          'P': ('>IQsI8sIQ', ['nano', 'refno', 'buysell', 'shares', 'name', 'price', None]),
+          'Q': ('>IQ8sIQs', ['nano', 'shares', 'name', 'price', 'matchno', 'cross']),
+          'I': ('>IQQs8sIIIss', ['nano', 'paired', 'imbalance', 'direction', 'name', 'far', 'near', 'current', 'cross', None])},
+    5.0: {'S': ('>HHHIs', [None, None, 'nano_hi', 'nano', 'event']),
+          'R': ('>HHHI8sssIss2ssssssIs', [None, None, 'nano_hi', 'nano', 'name', 'event', None, None, None, None, None, None, None, None, None, None, None, None]),
+          'H': ('>HHHI8sss4s', [None, None, 'nano_hi', 'nano', 'name', 'event', None, None]),
+          'Y': ('>HHHI8ss', [None, None, 'nano_hi', 'nano', 'name', 'event']),
+          'L': ('>HHHI4s8ssss', [None, None, 'nano_hi', 'nano', 'mpid', 'name', None, None, 'event']),
+          'A': ('>HHHIQsI8sI', [None, None, 'nano_hi', 'nano', 'refno', 'buysell', 'shares', 'name', 'price']),
+          'F': ('>HHHIQsI8sI4s', [None, None, 'nano_hi', 'nano', 'refno', 'buysell', 'shares', 'name', 'price', 'mpid']),
+          'E': ('>HHHIQIQ', [None, None, 'nano_hi', 'nano', 'refno', 'shares', None]),
+          'C': ('>HHHIQIQsI', [None, None, 'nano_hi', 'nano', 'refno', 'shares', None, None, 'price']),
+          'X': ('>HHHIQI', [None, None, 'nano_hi', 'nano', 'refno', 'shares']),
+          'D': ('>HHHIQ', [None, None, 'nano_hi', 'nano', 'refno']),
+          'U': ('>HHHIQQII', [None, None, 'nano_hi', 'nano', 'refno', 'newrefno', 'shares', 'price']),
+          'P': ('>HHHIQsI8sIQ', [None, None, 'nano_hi', 'nano', 'refno', 'buysell', 'shares', 'name', 'price', None]),
+          'Q': ('>HHHIQ8sIQs', [None, None, 'nano_hi', 'nano', 'shares', 'name', 'price', 'matchno', 'cross']),
+          'I': ('>HHHIQQs8sIIIss', [None, None, 'nano_hi', 'nano', 'paired', 'imbalance', 'direction', 'name', 'far', 'near', 'current', 'cross', None])}
+}
+
+
+def compile_decoder(message_type, fmt, fields):
+    """Return a function that decodes binary message data as a Message.
+
+    The function is generated once from a message layout (see `PROTOCOLS`) so that decoding a message requires a single call to a precompiled `struct.Struct` followed by one assignment per attribute (bypassing `__init__`).
+
+    """
+    unpacker = struct.Struct(fmt)
+    values = unpacker.unpack(bytes(unpacker.size))
+    if len(values) != len(fields):
+        raise ValueError('Format {} does not match fields {}'.format(fmt, fields))
+    if message_type in ('Q', 'I'):
+        cls = NOIIMessage
+    else:
+        cls = Message
+    assigned = {'type': repr(message_type)}
+    for i, (field, value) in enumerate(zip(fields, values)):
+        if field is None or field == 'nano_hi':
+            continue
+        elif isinstance(value, bytes) and field in ('name', 'mpid'):
+            assigned[field] = "temp[{}].decode('ascii').rstrip(' ')".format(i)
+        elif isinstance(value, bytes):
+            assigned[field] = "temp[{}].decode('ascii')".format(i)
+        else:
+            assigned[field] = 'temp[{}]'.format(i)
+    if 'nano_hi' not in fields:
+        assigned.setdefault('sec', 'time')
+        assigned.setdefault('nano', '0')
+    default = cls()
+    lines = ['def decode(message_bytes, time):',
+             '    temp = unpack(message_bytes)',
+             '    message = new(cls)']
+    for attr in cls.__slots__:
+        if attr == 'sec' and 'nano_hi' in fields:
+            lines.append('    message.sec, message.nano = divmod(temp[{}] << 32 | {}, 1000000000)'.format(fields.index('nano_hi'), assigned['nano']))
+        elif attr == 'nano' and 'nano_hi' in fields:
+            continue
+        else:
+            lines.append('    message.{} = {}'.format(attr, assigned.get(attr, repr(getattr(default, attr)))))
+    lines.append('    return message')
+    namespace = {'unpack': unpacker.unpack, 'cls': cls, 'new': object.__new__}
+    exec('\n'.join(lines), namespace)
+    return namespace['decode']
+
+
+def add_protocol(version, layouts):
+    """Register message layouts for an ITCH version and compile their decoders.
+
+    Parameters
+    ----------
+    version : float
+        ITCH version number
+    layouts : dict
+        Keys are message types, values are `(format, fields)` tuples (see `PROTOCOLS`)
+
+    """
+    PROTOCOLS[version] = layouts
+    DECODERS[version] = {message_type: compile_decoder(message_type, fmt, fields)
+                         for message_type, (fmt, fields) in layouts.items()}
+
+
+def get_decoders(version):
+    """Return the message decoders for an ITCH version, keyed by message type."""
+    try:
+        return DECODERS[version]
+    except KeyError:
+        raise ValueError('ITCH version ' + str(version) + ' is not supported')
+
+
+DECODERS = {}
+for _version, _layouts in list(PROTOCOLS.items()):
+    add_protocol(_version, _layouts)
+
+
 def get_message_size(size_in_bytes):
     """Return number of bytes in binary message as an integer."""
     (message_size,) = struct.unpack('>H', size_in_bytes)
@@ -1068,667 +2199,1122 @@ def get_message_type(type_in_bytes):
 
 
 def get_message(message_bytes, message_type, date, time, version):
-    """Return binary message data as a Message."""
-    if message_type in ('T', 'S', 'H', 'A', 'F', 'E', 'C', 'X', 'D', 'U', 'P', 'Q', 'I'):
-        message = protocol(message_bytes, message_type, time, version)
-        if version == 5.0:
-            message.sec = int(message.nano / 10 ** 9)
-            message.nano = message.nano % 10 ** 9
-        message.date = date
-        return message
-    else:
+    """Return binary message data as a Message (or None for unsupported message types)."""
+    decoder = get_decoders(version).get(message_type)
+    if decoder is None:
         return None
+    message = decoder(message_bytes, time)
+    message.date = date
+    return message
 
 
 def protocol(message_bytes, message_type, time, version):
     """Decode binary message data and return as a Message."""
-    if message_type in ('T', 'S', 'H', 'A', 'F', 'E', 'C', 'X', 'D', 'U', 'P'):
-        message = Message()
-    elif message_type in ('Q', 'I'):
-        message = NOIIMessage()
-    # elif message_type in ('H'):
-    #     message = TradingActionMessage()
-    message.type = message_type
-
-    if version == 4.0:
-        if message.type == 'T':  # time
-            temp = struct.unpack('>I', message_bytes)
-            message.sec = temp[0]
-            message.nano = 0
-        elif message_type == 'S':  # systems
-            temp = struct.unpack('>Is', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.event = temp[1].decode('ascii')
-        elif message_type == 'H':  # trade-action
-            temp = struct.unpack('>I6sss4s', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.name = temp[1].decode('ascii').rstrip(' ')
-            message.event = temp[2].decode('ascii')
-        elif message.type == 'A':  # add
-            temp = struct.unpack('>IQsI6sI', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.buysell = temp[2].decode('ascii')
-            message.shares = temp[3]
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.price = temp[5]
-        elif message.type == 'F':  # add w/mpid
-            temp = struct.unpack('>IQsI6sI4s', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.buysell = temp[2].decode('ascii')
-            message.shares = temp[3]
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.price = temp[5]
-        elif message.type == 'E':  # execute
-            temp = struct.unpack('>IQIQ', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.shares = temp[2]
-        elif message.type == 'C':  # execute w/price (actually don't need price...)
-            temp = struct.unpack('>IQIQsI', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.shares = temp[2]
-            message.price = temp[5]
-        elif message.type == 'X':  # cancel
-            temp = struct.unpack('>IQI', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.shares = temp[2]
-        elif message.type == 'D':  # delete
-            temp = struct.unpack('>IQ', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-        elif message.type == 'U':  # replace
-            temp = struct.unpack('>IQQII', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.newrefno = temp[2]
-            message.shares = temp[3]
-            message.price = temp[4]
-        elif message.type == 'Q':
-            temp = struct.unpack('>IQ6sIQs', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.shares = temp[1]
-            message.name = temp[2].decode('ascii').rstrip(' ')
-            message.price = temp[3]
-            message.event = temp[5].decode('ascii')
-        return message
-    elif version == 4.1:
-        if message.type == 'T':  # time
-            temp = struct.unpack('>I', message_bytes)
-            message.sec = temp[0]
-            message.nano = 0
-        elif message.type == 'S':  # systems
-            temp = struct.unpack('>Is', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.name = '.'
-            message.event = temp[1].decode('ascii')
-        elif message.type == 'H':  # trade-action
-            temp = struct.unpack('>I8sss4s', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.name = temp[1].decode('ascii').rstrip(' ')
-            message.event = temp[2].decode('ascii')
-        elif message.type == 'A':  # add
-            temp = struct.unpack('>IQsI8sI', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.buysell = temp[2].decode('ascii')
-            message.shares = temp[3]
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.price = temp[5]
-        elif message.type == 'F':  # add w/mpid
-            temp = struct.unpack('>IQsI8sI4s', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.buysell = temp[2].decode('ascii')
-            message.shares = temp[3]
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.price = temp[5]
-            message.mpid = temp[6].decode('ascii').rstrip(' ')
-        elif message.type == 'E':  # execute
-            temp = struct.unpack('>IQIQ', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.shares = temp[2]
-        elif message.type == 'C':  # execute w/price
-            temp = struct.unpack('>IQIQsI', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.shares = temp[2]
-            message.price = temp[5]
-        elif message.type == 'X':  # cancel
-            temp = struct.unpack('>IQI', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.shares = temp[2]
-        elif message.type == 'D':  # delete
-            temp = struct.unpack('>IQ', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-        elif message.type == 'U':  # replace
-            temp = struct.unpack('>IQQII', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.newrefno = temp[2]
-            message.shares = temp[3]
-            message.price = temp[4]
-        elif message.type == 'Q':  # cross-trade
-            temp = struct.unpack('>IQ8sIQs', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.shares = temp[1]
-            message.name = temp[2].decode('ascii').rstrip(' ')
-            message.price = temp[3]
-            message.event = temp[5].decode('ascii')
-        elif message.type == 'P':  # trade message
-            temp = struct.unpack('>IQsI8sIQ', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.refno = temp[1]
-            message.buysell = temp[2].decode('ascii')
-            message.shares = temp[3]
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.price = temp[5]
-            # message.matchno = temp[6]
-        elif message.type == 'I':
-            temp = struct.unpack('>IQQs8sIIIss', message_bytes)
-            message.sec = time
-            message.nano = temp[0]
-            message.paired = temp[1]
-            message.imbalance = temp[2]
-            message.direction = temp[3].decode('ascii')
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.far = temp[5]
-            message.near = temp[6]
-            message.current = temp[7]
-            message.cross = temp[8].decode('ascii')
-            # message.pvar = temp[9].decode('ascii'])
-        return message
-    elif version == 5.0:
-        if message.type == 'T':  # time
-            raise ValueError('Time messages not supported in ITCHv5.0.')
-        elif message_type == 'S':  # systems
-            temp = struct.unpack('>HHHIs', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.event = temp[4].decode('ascii')
-        elif message.type == 'H':
-            temp = struct.unpack('>HHHI8sss4s', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.name = temp[4].decode('ascii').rstrip(' ')
-            message.event = temp[5].decode('ascii')
-        elif message.type == 'A':  # add
-            temp = struct.unpack('>HHHIQsI8sI', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-            message.buysell = temp[5].decode('ascii')
-            message.shares = temp[6]
-            message.name = temp[7].decode('ascii').rstrip(' ')
-            message.price = temp[8]
-        elif message.type == 'F':  # add w/mpid
-            temp = struct.unpack('>HHHIQsI8sI4s', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-            message.buysell = temp[5].decode('ascii')
-            message.shares = temp[6]
-            message.name = temp[7].decode('ascii').rstrip(' ')
-            message.price = temp[8]
-        elif message.type == 'E':  # execute
-            temp = struct.unpack('>HHHIQIQ', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-            message.shares = temp[5]
-        elif message.type == 'C':  # execute w/price
-            temp = struct.unpack('>HHHIQIQsI', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-            message.shares = temp[5]
-            message.price = temp[8]
-        elif message.type == 'X':  # cancel
-            temp = struct.unpack('>HHHIQI', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-            message.shares = temp[5]
-        elif message.type == 'D':  # delete
-            temp = struct.unpack('>HHHIQ', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-        elif message.type == 'U':  # replace
-            temp = struct.unpack('>HHHIQQII', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.refno = temp[4]
-            message.newrefno = temp[5]
-            message.shares = temp[6]
-            message.price = temp[7]
-        elif message.type == 'Q':  # cross-trade
-            temp = struct.unpack('>HHHIQ8sIQ1s', message_bytes)
-            message.sec = time
-            message.nano = temp[2] | (temp[3] << 16)
-            message.shares = temp[4]
-            message.name = temp[5].decode('ascii').rstrip(' ')
-            message.price = temp[6]
-            message.event = temp[8].decode('ascii')
-        return message
+    return get_decoders(version)[message_type](message_bytes, time)
+
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zst')
+
+
+class Stream(io.RawIOBase):
+    """A compressed file that is decompressed by a background thread.
+
+    The thread reads blocks of decompressed data into a bounded queue so that decompression overlaps with decoding, and so that no more than `nblocks` blocks are held in memory at once. Supports gzip (.gz), bzip2 (.bz2), xz (.xz) and, if the zstandard package is installed, Zstandard (.zst) files.
+
+    Parameters
+    ----------
+    fin : string
+        Location of the compressed file
+    block_size : int
+        Number of decompressed bytes per block
+    nblocks : int
+        Maximum number of blocks waiting to be read
+
+    """
+
+    def __init__(self, fin, block_size=2 ** 22, nblocks=8):
+        io.RawIOBase.__init__(self)
+        self.fin = fin
+        self.block_size = block_size
+        self.queue = queue.Queue(nblocks)
+        self.stopped = threading.Event()
+        self.block = memoryview(b'')
+        self.pos = 0
+        self.eof = False
+        self.thread = threading.Thread(target=self._decompress, daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        if self.fin.endswith('.gz'):
+            return gzip.open(self.fin, 'rb')
+        elif self.fin.endswith('.bz2'):
+            return bz2.open(self.fin, 'rb')
+        elif self.fin.endswith('.xz'):
+            return lzma.open(self.fin, 'rb')
+        elif self.fin.endswith('.zst'):
+            if zstandard is None:
+                raise ImportError('The zstandard package is required to read .zst files.')
+            return zstandard.ZstdDecompressor().stream_reader(open(self.fin, 'rb'), closefd=True)
+        else:
+            raise ValueError('Unrecognized compression format: {}'.format(self.fin))
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self):
+        try:
+            with self._open() as data:
+                while True:
+                    block = data.read(self.block_size)
+                    if not self._put(block) or not block:
+                        break
+        except Exception as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos == len(self.block):
+            if self.eof:
+                return 0
+            block = self.queue.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.eof = True
+                return 0
+            self.block = memoryview(block)
+            self.pos = 0
+        n = min(len(b), len(self.block) - self.pos)
+        b[:n] = self.block[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        self.stopped.set()
+        io.RawIOBase.close(self)
+
+
+def open_itch(fin, block_size=2 ** 22, nblocks=8):
+    """Open an ITCH data file for reading, decompressing it if necessary.
+
+    Files ending in one of `COMPRESSED_EXTENSIONS` are streamed through a `Stream`; all other files are opened directly.
+
+    """
+    if fin.endswith(COMPRESSED_EXTENSIONS):
+        return io.BufferedReader(Stream(fin, block_size, nblocks), buffer_size=2 ** 16)
     else:
-        raise ValueError('ITCH version ' + str(version) + ' is not supported')
+        return open(fin, 'rb')
+
+
+CHUNK_DTYPE = np.dtype([('type', 'S1'),
+                        ('sec', 'i8'),
+                        ('nano', 'i8'),
+                        ('name', 'S8'),
+                        ('event', 'S1'),
+                        ('buysell', 'S1'),
+                        ('price', 'i8'),
+                        ('shares', 'i8'),
+                        ('refno', 'i8'),
+                        ('newrefno', 'i8'),
+                        ('mpid', 'S4'),
+                        ('cross', 'S1'),
+                        ('matchno', 'i8'),
+                        ('paired', 'i8'),
+                        ('imbalance', 'i8'),
+                        ('direction', 'S1'),
+                        ('far', 'i8'),
+                        ('near', 'i8'),
+                        ('current', 'i8'),
+                        ('offset', 'i8'),
+                        ('reads', 'i8')])
+
+
+def scan(fin, chunk_size=2 ** 26, start=0, clock=0):
+    """Find message boundaries that split an ITCH data file into chunks.
+
+    Walks the message sizes of the file (without decoding messages) and records a boundary roughly every `chunk_size` bytes. Each boundary is a tuple `(offset, clock)`, where `clock` is the value of the most recent time message before `offset`. The last boundary marks the end of the file.
+
+    The walk begins at byte `start` (which must be the start of a message, e.g. the offset of a checkpoint) with the clock set to `clock`, so the first boundary is `(start, clock)`.
+
+    """
+
+    boundaries = [(start, clock)]
+    pos = 0
+    next_boundary = start + chunk_size
+    with open(fin, 'rb') as data:
+        data.seek(start)
+        buf = data.read(chunk_size)
+        while True:
+            if pos + 2 > len(buf) or pos + 2 + struct.unpack_from('>H', buf, pos)[0] > len(buf):
+                more = data.read(chunk_size)
+                if not more:
+                    break
+                buf = buf[pos:] + more
+                start += pos
+                pos = 0
+                continue
+            if start + pos >= next_boundary:
+                boundaries.append((start + pos, clock))
+                next_boundary = start + pos + chunk_size
+            (message_size,) = struct.unpack_from('>H', buf, pos)
+            if buf[pos + 2] == 84 and message_size == 5:  # 'T'
+                (clock,) = struct.unpack_from('>I', buf, pos + 3)
+            pos += message_size + 2
+    if start + pos > boundaries[-1][0]:
+        boundaries.append((start + pos, clock))
+    return boundaries
+
+
+def decode(fin, start, stop, ver, date, clock, names):
+    """Decode the messages of an ITCH data file between two boundaries.
+
+    Messages that can't affect the stocks in `names` are dropped. Decoding stops after the end of messages system event. Each row records the byte offset of the next message and the number of messages read so far.
+
+    Returns
+    -------
+    array : np.array
+        Decoded messages as rows of `CHUNK_DTYPE`
+    reads : int
+        Number of messages read
+
+    """
+
+    decoders = get_decoders(ver)
+    rows = []
+    reads = 0
+    pos = 0
+    with open(fin, 'rb') as data:
+        data.seek(start)
+        buf = data.read(stop - start)
+    while pos < len(buf):
+        message_size = (buf[pos] << 8) | buf[pos + 1]
+        message_type = chr(buf[pos + 2])
+        message_bytes = buf[pos + 3:pos + 2 + message_size]
+        pos += message_size + 2
+        reads += 1
+        decoder = decoders.get(message_type)
+        if decoder is None:
+            continue
+        message = decoder(message_bytes, clock)
+        if message_type == 'T':
+            clock = message.sec
+        elif message_type in ('H', 'A', 'F', 'P', 'Q', 'I'):
+            if message.name not in names:
+                continue
+        elif message_type not in ('S', 'E', 'C', 'X', 'D', 'U'):
+            continue
+        rows.append((message_type.encode('ascii'),
+                     message.sec,
+                     message.nano,
+                     message.name.encode('ascii'),
+                     getattr(message, 'event', '.').encode('ascii'),
+                     message.buysell.encode('ascii'),
+                     message.price,
+                     message.shares,
+                     getattr(message, 'refno', -1),
+                     getattr(message, 'newrefno', -1),
+                     getattr(message, 'mpid', '.').encode('ascii'),
+                     getattr(message, 'cross', '.').encode('ascii'),
+                     getattr(message, 'matchno', -1),
+                     getattr(message, 'paired', -1),
+                     getattr(message, 'imbalance', -1),
+                     getattr(message, 'direction', '.').encode('ascii'),
+                     getattr(message, 'far', -1),
+                     getattr(message, 'near', -1),
+                     getattr(message, 'current', -1),
+                     start + pos,
+                     reads))
+        if message_type == 'S' and message.event == 'C':  # end messages
+            break
+    return np.array(rows, dtype=CHUNK_DTYPE), reads
+
+
+def _decode(args):
+    return decode(*args)
+
+
+class Reader():
+    """Iterates over the messages of an ITCH data file.
+
+    Yields `(message_type, message)` pairs in file order. Messages of types without a decoder (see `PROTOCOLS`) are counted but not yielded.
+
+    Parameters
+    ----------
+    fin : string
+        Location of the ITCH data file
+    ver : float
+        ITCH version number
+    date : string
+        Date to be assigned to messages
+
+    Attributes
+    ----------
+    reads : int
+        Number of messages read
+    offset : int
+        Byte offset of the next message
+    clock : int
+        Seconds of the most recent time message
+    decode_time : float
+        Seconds spent decoding messages
+
+    """
+
+    def __init__(self, fin, ver, date):
+        self.fin = fin
+        self.ver = ver
+        self.date = date
+        self.reads = 0
+        self.offset = 0
+        self.clock = 0
+        self.decode_time = 0.0
+
+    def __iter__(self):
+        decoders = get_decoders(self.ver)
+        perf_counter = time.perf_counter
+        with open_itch(self.fin) as data:
+            if data.seekable():
+                data.seek(self.offset)
+            else:
+                skip = self.offset
+                while skip > 0:
+                    skip -= len(data.read(min(skip, 2 ** 22)))
+            while True:
+                header = data.read(3)
+                if len(header) < 3:
+                    break
+                message_size = (header[0] << 8) | header[1]
+                message_type = chr(header[2])
+                message_bytes = data.read(message_size - 1)
+                self.reads += 1
+                self.offset += message_size + 2
+                decoder = decoders.get(message_type)
+                if decoder is None:
+                    continue
+                start = perf_counter()
+                message = decoder(message_bytes, self.clock)
+                self.decode_time += perf_counter() - start
+                message.date = self.date
+                if message_type == 'T':
+                    self.clock = message.sec
+                yield message_type, message
+
+
+class ParallelReader(Reader):
+    """Iterates over the messages of an ITCH data file using worker processes.
+
+    The file is first split into chunks by `scan`, so compressed files can't be read in parallel. Worker processes then `decode` chunks in parallel, and the decoded chunks are yielded in file order. Order messages that don't reference an order in `orders` are skipped, so `orders` should be the dictionary that is updated as the messages are processed (i.e. `Orderlist.orders`).
+
+    Parameters
+    ----------
+    fin : string
+        Location of the ITCH data file
+    ver : float
+        ITCH version number
+    date : string
+        Date to be assigned to messages
+    names : list
+        Contains the stock tickers to keep
+    orders : dict
+        Keys are reference numbers of standing orders
+    nworkers : int
+        Number of worker processes
+    chunk_size : int
+        Approximate number of bytes decoded per task
+
+    """
+
+    def __init__(self, fin, ver, date, names, orders, nworkers, chunk_size=2 ** 26):
+        Reader.__init__(self, fin, ver, date)
+        self.names = names
+        self.orders = orders
+        self.nworkers = nworkers
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        boundaries = scan(self.fin, self.chunk_size, self.offset, self.clock)
+        tasks = deque()
+        for (start, clock), (stop, _) in zip(boundaries[:-1], boundaries[1:]):
+            tasks.append((self.fin, start, stop, self.ver, self.date, clock, self.names))
+        executor = ProcessPoolExecutor(self.nworkers)
+        try:
+            pending = deque()
+            while tasks or pending:
+                while tasks and len(pending) < 2 * self.nworkers:
+                    task = tasks.popleft()
+                    pending.append((task[2], executor.submit(_decode, task)))
+                stop, future = pending.popleft()
+                start = time.perf_counter()
+                array, reads = future.result()
+                rows = array.tolist()
+                self.decode_time += time.perf_counter() - start
+                base = self.reads
+                for row in rows:
+                    self.offset = row[19]
+                    self.reads = base + row[20]
+                    message_type = row[0].decode('ascii')
+                    if message_type in ('E', 'C', 'X', 'D', 'U') and row[8] not in self.orders:
+                        continue
+                    if message_type in ('Q', 'I'):
+                        message = NOIIMessage(date=self.date,
+                                              sec=row[1],
+                                              nano=row[2],
+                                              name=row[3].decode('ascii'),
+                                              type=message_type,
+                                              cross=row[11].decode('ascii'),
+                                              buysell=row[5].decode('ascii'),
+                                              price=row[6],
+                                              shares=row[7],
+                                              matchno=row[12],
+                                              paired=row[13],
+                                              imbalance=row[14],
+                                              direction=row[15].decode('ascii'),
+                                              far=row[16],
+                                              near=row[17],
+                                              current=row[18])
+                    else:
+                        message = Message(date=self.date,
+                                          sec=row[1],
+                                          nano=row[2],
+                                          type=message_type,
+                                          event=row[4].decode('ascii'),
+                                          name=row[3].decode('ascii'),
+                                          buysell=row[5].decode('ascii'),
+                                          price=row[6],
+                                          shares=row[7],
+                                          refno=row[8],
+                                          newrefno=row[9],
+                                          mpid=row[10].decode('ascii'))
+                    if message_type == 'T':
+                        self.clock = message.sec
+                    yield message_type, message
+                self.offset = stop
+                self.reads = base + reads
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def with_callback(messages, callback, *args, times=None):
+    """Call `callback(message, *args)` after each message is processed.
+
+    Wraps an iterator of `(message_type, message)` pairs (e.g. a `Reader`). The callback runs when the next message is requested, i.e. after the caller has finished with the current one, so a caller that stops iterating early has to call it for the last message itself. If `times` is given, the seconds spent in the callback are added to `times['callback']`.
+
+    """
+    if times is None:
+        for message_type, message in messages:
+            yield message_type, message
+            callback(message, *args)
+        return
+    perf_counter = time.perf_counter
+    for message_type, message in messages:
+        yield message_type, message
+        start = perf_counter()
+        callback(message, *args)
+        times['callback'] += perf_counter() - start
+
+
+def with_profiler(messages, start, stop, path, method='cprofile', times=None):
+    """Profile the processing of a window of messages.
+
+    Wraps an iterator of `(message_type, message)` pairs (e.g. a `Reader`) and profiles everything that happens between message number `start` and message number `stop` (counting from zero). The report is written to `path` when the window closes.
+
+    Parameters
+    ----------
+    messages : iterator
+        Yields `(message_type, message)` pairs
+    start : int
+        First message to profile
+    stop : int
+        Message to stop profiling at
+    path : string
+        Location of the report
+    method : string
+        Either 'cprofile' (function timings, also saved in binary form with a '.prof' extension) or 'tracemalloc' (memory allocated in the window, by line)
+    times : dict
+        If given, the seconds spent starting the profiler and writing the report are added to `times['profile']` (the slowdown of the profiled code itself is not)
+
+    """
+    if method not in ('cprofile', 'tracemalloc'):
+        raise ValueError('Unknown profiling method: {}'.format(method))
+    messages = iter(messages)
+    count = 0
+    for item in messages:
+        if count == start:
+            break
+        yield item
+        count += 1
+    else:
+        return
+    begin = time.perf_counter()
+    if method == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        tracemalloc.start()
+    if times is not None:
+        times['profile'] += time.perf_counter() - begin
+    try:
+        yield item
+        count += 1
+        for item in messages:
+            if count == stop:
+                break
+            yield item
+            count += 1
+        else:
+            item = None
+    finally:
+        begin = time.perf_counter()
+        if method == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(os.path.splitext(path)[0] + '.prof')
+            with open(path, 'w') as fout:
+                fout.write('Messages {} to {}\n'.format(start, count))
+                pstats.Stats(profiler, stream=fout).sort_stats('cumulative').print_stats(50)
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            with open(path, 'w') as fout:
+                fout.write('Messages {} to {}\n'.format(start, count))
+                for line in snapshot.statistics('lineno')[:50]:
+                    fout.write(str(line) + '\n')
+        if times is not None:
+            times['profile'] += time.perf_counter() - begin
+    if item is not None:
+        yield item
+        yield from messages
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes (or None if unavailable)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname == 'Darwin':
+        return rss  # bytes
+    return rss * 1024  # kilobytes
+
 
+class Stats():
+    """Performance metrics collected by `unpack`.
 
-def unpack(fin, ver, date, nlevels, names, method='csv', fout=None, host=None, user=None):
+    Attributes
+    ----------
+    elapsed : float
+        Seconds since the job started
+    reads : int
+        Number of messages read
+    counts : dict
+        Keys are message types, values are the number of messages processed
+    times : dict
+        Cumulative seconds spent in each stage: 'read' (reading the file), 'decode' (decoding messages, or waiting for worker processes), 'update' (completing messages and updating orders and books), 'snapshot' (copying books), 'write' (writing to the database), 'callback' (running `on_message`), and 'profile' (starting the profiler and writing its report)
+    rows : dict
+        Keys are groups, values are the number of rows written
+    bytes : dict
+        Keys are groups, values are the number of bytes written
+    buffers : dict
+        Keys are groups, values are the number of rows waiting to be written
+    peak_rss : int
+        Peak resident set size of the process in bytes
+
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.reads = 0
+        self.counts = {}
+        self.times = {'read': 0.0, 'decode': 0.0, 'update': 0.0, 'snapshot': 0.0, 'write': 0.0, 'callback': 0.0,
+                      'profile': 0.0}
+        self.rows = {}
+        self.bytes = {}
+        self.buffers = {}
+        self.peak_rss = None
+
+    def __str__(self):
+        sep = '\n'
+        line = ['elapsed={:.2f}s, reads={}, peak_rss={}'.format(self.elapsed, self.reads, self.peak_rss)]
+        line.append('times: ' + ', '.join('{}={:.2f}s'.format(k, v) for k, v in self.times.items()))
+        line.append('rates: ' + ', '.join('{}={:.0f}/s'.format(k, v) for k, v in sorted(self.rates().items())))
+        line.append('rows: ' + ', '.join('{}={}'.format(k, v) for k, v in self.rows.items()))
+        line.append('bytes: ' + ', '.join('{}={}'.format(k, v) for k, v in self.bytes.items()))
+        return sep.join(line)
+
+    def __repr__(self):
+        return 'Stats(' + str(self.to_dict()) + ')'
+
+    def rates(self):
+        """Return the number of messages processed per second by type."""
+        if self.elapsed == 0:
+            return {k: 0.0 for k in self.counts}
+        return {k: v / self.elapsed for k, v in self.counts.items()}
+
+    def update(self, elapsed, times, reader, booklist, lists, barlist=None, orderlist=None):
+        """Collect metrics from the objects used by `unpack`.
+
+        Parameters
+        ----------
+        elapsed : float
+            Seconds since the job started
+        times : dict
+            Seconds spent in the 'read', 'update' and 'write' sections of `unpack`, and in the 'callback' and 'profile' wrappers of the reader (which run in the 'read' section)
+        reader : Reader
+            The message reader
+        booklist : Booklist
+            The book buffers
+        lists : dict
+            Keys are groups, values are Messagelists
+        barlist : Barlist
+            The bar buffers (if bars are computed)
+        orderlist : Orderlist
+            The orders (if order lifecycles are recorded)
+
+        """
+        self.elapsed = elapsed
+        self.reads = reader.reads
+        self.times['read'] = times['read'] - reader.decode_time - times['callback'] - times['profile']
+        self.times['decode'] = reader.decode_time
+        self.times['update'] = times['update'] - booklist.snapshot_time
+        self.times['snapshot'] = booklist.snapshot_time
+        self.times['write'] = times['write']
+        self.times['callback'] = times['callback']
+        self.times['profile'] = times['profile']
+        for grp, buffers in lists.items():
+            self.rows[grp] = buffers.rows_written
+            self.bytes[grp] = buffers.bytes_written
+            self.buffers[grp] = sum(len(m) for m in buffers.messages.values())
+        self.rows['books'] = booklist.rows_written
+        self.bytes['books'] = booklist.bytes_written
+        self.buffers['books'] = sum(len(b['hist']) for b in booklist.books.values())
+        if barlist is not None:
+            self.rows['bars'] = barlist.rows_written
+            self.bytes['bars'] = barlist.bytes_written
+            self.buffers['bars'] = sum(len(b.hist) for b in barlist.bars.values())
+        if orderlist is not None and orderlist.lifecycles is not None:
+            self.rows['orders'] = orderlist.rows_written
+            self.bytes['orders'] = orderlist.bytes_written
+            self.buffers['orders'] = sum(orderlist.buffered(name) for name in orderlist.rows)
+        self.peak_rss = peak_rss()
+
+    def to_dict(self):
+        """Return metrics as a dictionary."""
+        return {'elapsed': self.elapsed,
+                'reads': self.reads,
+                'counts': self.counts,
+                'rates': self.rates(),
+                'times': self.times,
+                'rows': self.rows,
+                'bytes': self.bytes,
+                'buffers': self.buffers,
+                'peak_rss': self.peak_rss}
+
+    def write(self, path):
+        """Append metrics to a file as a line of JSON."""
+        with open(path, 'a') as fout:
+            fout.write(json.dumps(self.to_dict()) + '\n')
+
+
+def save_checkpoint(path, state):
+    """Atomically write the state of an `unpack` job to file."""
+    with open(path + '.tmp', 'wb') as fout:
+        pickle.dump(state, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(path):
+    """Read the state of an `unpack` job from file."""
+    with open(path, 'rb') as fin:
+        return pickle.load(fin)
+
+
+def count_lines(path, block_size=2 ** 20):
+    """Count the lines of a text file."""
+    count = 0
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def checksum(path, block_size=2 ** 20):
+    """Return the SHA-256 digest of a file as a hex string."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_checksum(path, manifest):
+    """Return the checksum of an input file, reusing the checksum in `manifest` of a file with the same name, size and modification time."""
+    info = os.stat(path)
+    for entries in manifest.values():
+        for entry in entries.values():
+            if (entry.get('input'), entry.get('size'), entry.get('mtime')) == (os.path.basename(path), info.st_size, info.st_mtime_ns):
+                return entry['checksum']
+    return checksum(path)
+
+
+def load_manifest(path):
+    """Read the manifest of completed `unpack` jobs (empty if there is none).
+
+    The manifest is a JSON object keyed by date and then by name. Each entry records the input file (its name, size, modification time and checksum), the options that determine the layout of the output (`method`, `nlevels`, `bars`, `keyframes` and `lifecycles`), the time the job finished, and the number of rows written to each group.
+
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fin:
+        return json.load(fin)
+
+
+def save_manifest(path, manifest):
+    """Atomically write the manifest of completed `unpack` jobs to file."""
+    with open(path + '.tmp', 'w') as fout:
+        json.dump(manifest, fout, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _flush(names, method, db, messagelist, booklist, tradeslist, noiilist, barlist=None, orderlist=None):
+    """Write all buffered data to the database."""
+    if orderlist is not None and orderlist.lifecycles is None:
+        orderlist = None
+    for name in names:
+        if method == 'hdf5':
+            messagelist.to_hdf5(name=name, db=db, grp='messages')
+            booklist.to_hdf5(name=name, db=db)
+            tradeslist.to_hdf5(name=name, db=db, grp='trades')
+            noiilist.to_hdf5(name=name, db=db, grp='noii')
+            if barlist is not None:
+                barlist.to_hdf5(name=name, db=db)
+            if orderlist is not None:
+                orderlist.to_hdf5(name=name, db=db)
+        elif method == 'sqlite':
+            messagelist.to_sqlite(name=name, db=db, grp='messages')
+            booklist.to_sqlite(name=name, db=db)
+            tradeslist.to_sqlite(name=name, db=db, grp='trades')
+            noiilist.to_sqlite(name=name, db=db, grp='noii')
+            if barlist is not None:
+                barlist.to_sqlite(name=name, db=db)
+            if orderlist is not None:
+                orderlist.to_sqlite(name=name, db=db)
+        elif method == 'csv':
+            messagelist.to_txt(name=name, db=db, grp='messages')
+            booklist.to_txt(name=name, db=db)
+            tradeslist.to_txt(name=name, db=db, grp='trades')
+            noiilist.to_txt(name=name, db=db, grp='noii')
+            if barlist is not None:
+                barlist.to_txt(name=name, db=db)
+            if orderlist is not None:
+                orderlist.to_txt(name=name, db=db)
+
+
+def unpack(fin, ver, date, nlevels, names, method='csv', fout=None, host=None, user=None,
+           nworkers=None, chunk_size=2 ** 26, checkpoint=None, resume=False,
+           metrics=None, metrics_interval=60, on_message=None, on_flush=None,
+           profile=None, profiler='cprofile', bars=None, keyframes=None, compact=False, manifest=False,
+           queues=False, lifecycles=False):
     """Read ITCH data file, construct LOB, and write to database.
 
     This method reads binary data from a ITCH data file, converts it into human-readable data, then saves time series of out-going messages as well as reconstructed order book snapshots to a research database.
 
-    The version number of the ITCH data is specified as a float. Supported versions are: 4.1.
+    The version number of the ITCH data is specified as a float. Supported versions are: 4.0, 4.1 and 5.0 (see `PROTOCOLS`). Version 4.0 files have no non-cross trade (P) or NOII (I) messages. In version 5.0, each message carries its own timestamp (a six byte count of nanoseconds since midnight), which is split into `sec` and `nano`; earlier releases set `sec` to 0 and combined the wrong bytes of the timestamp into `nano`, and did not decode version 5.0 P and I messages, which are now written to the 'trades' and 'noii' groups. Cross trade (Q) messages now fill the `cross` and `matchno` columns, which earlier releases left as '.' and -1.
+
+    If `nworkers` is given, messages are decoded by that many worker processes, each decoding roughly `chunk_size` bytes at a time (see `ParallelReader`). Order book reconstruction and writing always happen in the calling process.
+
+    The data file can be compressed with gzip, bzip2, xz or Zstandard, in which case it is decompressed on the fly by a background thread (see `open_itch`).
+
+    If `checkpoint` is given, all buffers are written and the state of the job is saved to `<fout>.checkpoint` every `checkpoint` messages. Setting `resume=True` continues from the last checkpoint (if there is one) instead of starting over. The checkpoint is removed once the job finishes.
+
+    Optional callbacks can be used to observe the job: `on_message(message, booklist)` is called after each message is processed (including the end-of-messages system event), and `on_flush(name, grp, rows)` is called after buffered data is written. To profile a window of messages, pass `profile=(start, stop)` and `profiler='cprofile'` or `'tracemalloc'`; the report is written to `<fout>.profile.txt` (see `with_profiler`). Unused callbacks and profilers add no work to the loop.
+
+    If `bars` is given as `(kind, size)`, bars are computed for each stock while the file is read and written to a 'bars' group. `kind` is 'time' (a bar every `size` seconds), 'volume' (a bar every `size` shares) or 'tick' (a bar every `size` trades); see `Bars` for the contents of each bar. Trades are taken from execution (E, C) and non-cross trade (P) messages.
+
+    If `keyframes` is given (HDF5 only), order books are stored compactly: each update is stored as the new depth of the price level it changed (the 'deltas' group), and every level of the book is stored after every `keyframes` updates (the 'keyframes' and 'keyindex' groups). Use `BookReader` to read books at any row or time, or to convert them to snapshots.
+
+    If `method='sqlite'`, `fout` is the location of a SQLite database file, which can hold any number of dates and stocks. Each group is written to a table ('messages', 'books', 'trades', 'noii' and 'bars') whose rows are identified by name, date and time (integer nanoseconds since midnight), followed by the same columns as the HDF5 datasets. Rows are inserted in bulk, one transaction per buffer, and the (name, date, time) indexes are built once the job finishes. Use `load_sqlite` to read the tables.
+
+    If `compact` is True, an HDF5 database is rewritten with contiguous datasets when the job finishes (see `compact`).
+
+    If `queues` is True, the queue of orders at each price level is tracked as well (see `L3Book`). The queues are available to `on_message` callbacks as `booklist.queues`, e.g. to look up the queue position of an order and the number of shares ahead of it.
+
+    If `lifecycles` is True, one row is written to an 'orders' group for each order when it is fully executed, deleted or replaced (and for each order still open at the end of the file), with the times it was added, first and last executed and finished, the shares filled and cancelled, the chain of replacements it belongs to, and its distance from the best price when it was added (see `Orderlist`).
+
+    If `manifest` is True, each name is recorded in `<fout>.manifest.json` when the job finishes, along with the size, modification time and SHA-256 checksum of the input file, the output options, and the number of rows written to each group (see `load_manifest`). The checksum is computed once per input file and reused on later runs. Names that the manifest lists as completed for the same date, input file (same name, size and modification time) and options (`method`, `nlevels`, `bars`, `keyframes` and `lifecycles`) are skipped, so rerunning a job after a failure only processes the missing names (in a single pass over the file), and existing data for the skipped names is left in place. The skipped names are printed. By default (`manifest=False`), every name is processed and no manifest is written.
+
+    Returns a `Stats` object with the time spent in each stage, message rates, rows and bytes written, and peak memory use. If `metrics` is given, the metrics are also appended to that file as a line of JSON every `metrics_interval` seconds and when the job finishes.
 
     """
 
     BUFFER_SIZE = 10 ** 4
 
-    orderlist = Orderlist()
-    booklist = Booklist(date, names, nlevels, method)
+    if keyframes is not None and method != 'hdf5':
+        raise ValueError('Keyframes are only supported for HDF5 databases')
+
+    if manifest:
+        if fout is None:
+            raise ValueError('A manifest requires an output location (fout)')
+        manifest_path = '{}.manifest.json'.format(fout.rstrip('/'))
+        info = os.stat(fin)
+        source = {'input': os.path.basename(fin), 'size': info.st_size, 'mtime': info.st_mtime_ns}
+        options = {'method': method,
+                   'nlevels': nlevels,
+                   'bars': list(bars) if bars is not None else None,
+                   'keyframes': keyframes,
+                   'lifecycles': bool(lifecycles)}
+        completed = load_manifest(manifest_path).get(date, {}) if os.path.exists(fout) else {}
+        skipped = [name for name in names if name in completed
+                   and all(completed[name].get(key) == value for key, value in source.items())
+                   and completed[name].get('options') == options]
+        if len(skipped) > 0:
+            print('Skipping completed names: {}'.format(', '.join(skipped)))
+            names = [name for name in names if name not in skipped]
+        if len(names) == 0:
+            print('All names are complete.')
+            return Stats()
+        entries = load_manifest(manifest_path)
+        if any(name in entries.get(date, {}) for name in names):  # incomplete until this job finishes
+            for name in names:
+                entries[date].pop(name, None)
+            save_manifest(manifest_path, entries)
+
+    orderlist = Orderlist(lifecycles)
+    booklist = Booklist(date, names, nlevels, method, keyframes)
+    if queues:
+        booklist.queues = L3Book()
     messagelist = Messagelist(date, names)
     tradeslist = Messagelist(date, names)
     noiilist = Messagelist(date, names)
+    if bars is not None:
+        barlist = Barlist(names, bars[0], bars[1], method)
+    else:
+        barlist = None
+
+    if fout is not None:
+        checkpoint_path = '{}.checkpoint'.format(fout.rstrip('/'))
+    elif checkpoint is not None or resume:
+        raise ValueError('Checkpoints require an output location (fout)')
+    else:
+        checkpoint_path = None
+    if resume and os.path.exists(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+        print('Resuming from checkpoint (offset={})'.format(state['offset']))
+    else:
+        state = None
 
     if method == 'hdf5':
-        db = Database(path=fout, names=names, nlevels=nlevels, method='hdf5')
+        db = Database(path=fout, names=names, nlevels=nlevels, method='hdf5', resume=state is not None,
+                      bars=barlist is not None, deltas=keyframes is not None, orders=lifecycles)
+        log_path = os.path.abspath('{}/../system.log'.format(fout))
+    elif method == 'sqlite':
+        db = Database(path=fout, names=names, nlevels=nlevels, method='sqlite', resume=state is not None,
+                      bars=barlist is not None, orders=lifecycles, date=date)
         log_path = os.path.abspath('{}/../system.log'.format(fout))
-        with open(log_path, 'w') as system_file:
-            system_file.write('sec,nano,name,event\n')
     elif method == 'csv':
-        db = Database(path=fout, names=names, nlevels=nlevels, method='csv')
+        db = Database(path=fout, names=names, nlevels=nlevels, method='csv', resume=state is not None,
+                      bars=barlist is not None, orders=lifecycles)
         log_path = '{}/system.log'.format(fout)
+    if state is None:
         with open(log_path, 'w') as system_file:
             system_file.write('sec,nano,name,event\n')
-
-    data = open(fin, 'rb')
-    message_reads = 0
+    else:
+        db.truncate(state['sizes'])
+        os.truncate(log_path, state['log'])
+        orderlist.orders = state['orders']
+        if lifecycles:
+            orderlist.lifecycles = state['lifecycles']
+            orderlist.origins = state['origins']
+        for name in names:
+            booklist.books[name]['cur'] = state['books'][name]
+            if keyframes is not None:
+                booklist.books[name]['rows'] = state['sizes'][('books', name)]
+                booklist.books[name]['keyrows'] = state['sizes'][('keyframes', name)]
+        if barlist is not None:
+            barlist.bars = state['bars']
+        if queues:
+            booklist.queues = state['queues']
+
+    if nworkers is not None and fin.endswith(COMPRESSED_EXTENSIONS):
+        print('Compressed files are decoded serially.')
+        nworkers = None
+    if nworkers is None:
+        reader = Reader(fin, ver, date)
+    else:
+        reader = ParallelReader(fin, ver, date, names, orderlist.orders, nworkers, chunk_size)
     message_writes = 0
     trade_writes = 0
     noii_writes = 0
-    reading = True
-    clock = 0
+    if state is not None:
+        reader.offset = state['offset']
+        reader.clock = state['clock']
+        reader.reads = state['reads']
+        message_writes, trade_writes, noii_writes = state['writes']
+    if checkpoint is not None:
+        next_checkpoint = reader.reads + checkpoint
+    lists = {'messages': messagelist, 'trades': tradeslist, 'noii': noiilist}
+    times = {'read': 0.0, 'update': 0.0, 'write': 0.0, 'callback': 0.0, 'profile': 0.0}
+    messages = decoded = iter(reader)
+    if on_message is not None:
+        messages = with_callback(messages, on_message, booklist, times=times)
+    if profile is not None:
+        messages = with_profiler(messages, profile[0], profile[1],
+                                 '{}.profile.txt'.format(fout.rstrip('/')), profiler, times=times)
+    if on_flush is not None:
+        for buffers in (messagelist, tradeslist, noiilist, booklist, barlist, orderlist):
+            if buffers is not None:
+                buffers.on_flush = on_flush
+    stats = Stats()
+    if state is not None:
+        stats.counts = state['counts']
+    counts = stats.counts
+    perf_counter = time.perf_counter
     start = time.time()
-
-    while reading:
-
-        # read message
-        message_size = get_message_size(data.read(2))
-        message_type = get_message_type(data.read(1))
-        message_bytes = data.read(message_size - 1)
-        message = get_message(message_bytes, message_type, date, clock, ver)
-        message_reads += 1
-
-        # update clock
-        if message_type == 'T':
-            if message.sec % 1800 == 0:
-                print('TIME={}'.format(message.sec))
-            clock = message.sec
-
-        # update system
-        if message_type == 'S':
-            print('SYSTEM MESSAGE: {}'.format(message.event))
-            message.to_txt(log_path)
-            if message.event == 'C':  # end messages
-                reading = False
-        if message_type == 'H':
-            if message.name in names:
-                print('TRADING MESSAGE ({}): {}'.format(message.name, message.event))
+    next_metrics = start + metrics_interval
+    last = perf_counter()
+    message = None  # stays None if a resumed job has nothing left to read
+
+    try:
+        for message_type, message in messages:
+            read = perf_counter()
+            times['read'] += read - last
+            counts[message_type] = counts.get(message_type, 0) + 1
+
+            # update clock
+            if message_type == 'T':
+                if message.sec % 1800 == 0:
+                    print('TIME={}'.format(message.sec))
+
+            # update system
+            if message_type == 'S':
+                print('SYSTEM MESSAGE: {}'.format(message.event))
                 message.to_txt(log_path)
-                # TODO: What to do about halts?
-                if message.event == 'H':  # halted (all US)
-                    pass
-                elif message.event == 'P':  # paused (all US)
-                    pass
-                elif message.event == 'Q':  # quotation only
-                    pass
-                elif message.event == 'T':  # trading on nasdaq
-                    pass
-
-        # complete message
-        if message_type == 'U':
-            message, del_message, add_message = message.split()
-            orderlist.complete_message(message)
-            orderlist.complete_message(del_message)
-            orderlist.complete_message(add_message)
-            if message.name in names:
-                message_writes += 1
-                orderlist.update(del_message)
-                booklist.update(del_message)
-                orderlist.add(add_message)
-                booklist.update(add_message)
-                messagelist.add(message)
-                # print('ORDER MESSAGE <REPLACE>')
-        elif message_type in ('E', 'C', 'X', 'D'):
-            orderlist.complete_message(message)
-            if message.name in names:
-                message_writes += 1
-                orderlist.update(message)
-                booklist.update(message)
-                messagelist.add(message)
-                # print('ORDER MESSAGE')
-        elif message_type in ('A', 'F'):
-            if message.name in names:
-                message_writes += 1
-                orderlist.add(message)
-                booklist.update(message)
-                messagelist.add(message)
-                # print('ORDER MESSAGE')
-        elif message_type == 'P':
-            if message.name in names:
-                trade_writes += 1
-                tradeslist.add(message)
-                # print('TRADE MESSAGE')
-        elif message_type in ('Q', 'I'):
-            if message.name in names:
-                noii_writes += 1
-                noiilist.add(message)
-                # print('NOII MESSAGE')
-
-        # write message
-        if method == 'hdf5':
-            if message_type in ('U', 'A', 'F', 'E', 'C', 'X', 'D'):
+                if message.event == 'C':  # end messages
+                    if on_message is not None:  # the loop stops before with_callback gets to it
+                        callback = perf_counter()
+                        on_message(message, booklist)
+                        times['callback'] += perf_counter() - callback
+                    break
+            if message_type == 'H':
                 if message.name in names:
-                    if len(messagelist.messages[message.name]) == BUFFER_SIZE:
-                        messagelist.to_hdf5(name=message.name, db=db, grp='messages')
-                    if len(booklist.books[message.name]['hist']) == BUFFER_SIZE:
-                        booklist.to_hdf5(name=message.name, db=db)
-            elif message_type == 'P':
+                    print('TRADING MESSAGE ({}): {}'.format(message.name, message.event))
+                    message.to_txt(log_path)
+                    # TODO: What to do about halts?
+                    if message.event == 'H':  # halted (all US)
+                        pass
+                    elif message.event == 'P':  # paused (all US)
+                        pass
+                    elif message.event == 'Q':  # quotation only
+                        pass
+                    elif message.event == 'T':  # trading on nasdaq
+                        pass
+
+            # complete message
+            if message_type == 'U':
+                message, del_message, add_message = message.split()
+                orderlist.complete_message(message)
+                orderlist.complete_message(del_message)
+                orderlist.complete_message(add_message)
                 if message.name in names:
-                    if len(tradeslist.messages[message.name]) == BUFFER_SIZE:
-                        tradeslist.to_hdf5(name=message.name, db=db, grp='trades')
-            elif message_type in ('Q', 'I'):
+                    message_writes += 1
+                    orderlist.update(del_message, replaced=True)
+                    booklist.update(del_message)
+                    orderlist.add(add_message, booklist.books[message.name]['cur'], message.refno)
+                    booklist.update(add_message)
+                    messagelist.add(message)
+                    if barlist is not None:
+                        barlist.update(booklist.books[message.name]['cur'])
+                    # print('ORDER MESSAGE <REPLACE>')
+            elif message_type in ('E', 'C', 'X', 'D'):
+                price = message.price  # execution price of C messages
+                orderlist.complete_message(message)
                 if message.name in names:
-                    if len(noiilist.messages[message.name]) == BUFFER_SIZE:
-                        noiilist.to_hdf5(name=message.name, db=db, grp='noii')
-        elif method == 'csv':
-            if message_type in ('U', 'A', 'F', 'E', 'C', 'X', 'D'):
+                    message_writes += 1
+                    orderlist.update(message)
+                    booklist.update(message)
+                    messagelist.add(message)
+                    if barlist is not None:
+                        if message_type == 'E':
+                            barlist.trade(message, message.price, -message.shares)
+                        elif message_type == 'C':
+                            barlist.trade(message, price, -message.shares)
+                        barlist.update(booklist.books[message.name]['cur'])
+                    # print('ORDER MESSAGE')
+            elif message_type in ('A', 'F'):
                 if message.name in names:
-                    if len(messagelist.messages[message.name]) == BUFFER_SIZE:
-                        messagelist.to_txt(name=message.name, db=db, grp='messages')
-                    if len(booklist.books[message.name]['hist']) == BUFFER_SIZE:
-                        booklist.to_txt(name=message.name, db=db)
+                    message_writes += 1
+                    orderlist.add(message, booklist.books[message.name]['cur'])
+                    booklist.update(message)
+                    messagelist.add(message)
+                    if barlist is not None:
+                        barlist.update(booklist.books[message.name]['cur'])
+                    # print('ORDER MESSAGE')
             elif message_type == 'P':
                 if message.name in names:
-                    if len(tradeslist.messages[message.name]) == BUFFER_SIZE:
-                        tradeslist.to_txt(name=message.name, db=db, grp='trades')
+                    trade_writes += 1
+                    tradeslist.add(message)
+                    if barlist is not None:
+                        barlist.trade(message, message.price, message.shares)
+                    # print('TRADE MESSAGE')
             elif message_type in ('Q', 'I'):
                 if message.name in names:
-                    if len(noiilist.messages[message.name]) == BUFFER_SIZE:
-                        noiilist.to_txt(name=message.name, db=db, grp='noii')
+                    noii_writes += 1
+                    noiilist.add(message)
+                    # print('NOII MESSAGE')
+
+            # write message
+            update = perf_counter()
+            times['update'] += update - read
+            if method == 'hdf5':
+                if message_type in ('U', 'A', 'F', 'E', 'C', 'X', 'D'):
+                    if message.name in names:
+                        if len(messagelist.messages[message.name]) == BUFFER_SIZE:
+                            messagelist.to_hdf5(name=message.name, db=db, grp='messages')
+                        if len(booklist.books[message.name]['hist']) == BUFFER_SIZE:
+                            booklist.to_hdf5(name=message.name, db=db)
+                elif message_type == 'P':
+                    if message.name in names:
+                        if len(tradeslist.messages[message.name]) == BUFFER_SIZE:
+                            tradeslist.to_hdf5(name=message.name, db=db, grp='trades')
+                elif message_type in ('Q', 'I'):
+                    if message.name in names:
+                        if len(noiilist.messages[message.name]) == BUFFER_SIZE:
+                            noiilist.to_hdf5(name=message.name, db=db, grp='noii')
+                if barlist is not None and message.name in barlist.bars:
+                    if len(barlist.bars[message.name].hist) >= BUFFER_SIZE:
+                        barlist.to_hdf5(name=message.name, db=db)
+                if lifecycles and message.name in names:
+                    if orderlist.buffered(message.name) >= BUFFER_SIZE:
+                        orderlist.to_hdf5(name=message.name, db=db)
+            elif method == 'sqlite':
+                if message_type in ('U', 'A', 'F', 'E', 'C', 'X', 'D'):
+                    if message.name in names:
+                        if len(messagelist.messages[message.name]) == BUFFER_SIZE:
+                            messagelist.to_sqlite(name=message.name, db=db, grp='messages')
+                            db.flush()
+                        if len(booklist.books[message.name]['hist']) == BUFFER_SIZE:
+                            booklist.to_sqlite(name=message.name, db=db)
+                            db.flush()
+                elif message_type == 'P':
+                    if message.name in names:
+                        if len(tradeslist.messages[message.name]) == BUFFER_SIZE:
+                            tradeslist.to_sqlite(name=message.name, db=db, grp='trades')
+                            db.flush()
+                elif message_type in ('Q', 'I'):
+                    if message.name in names:
+                        if len(noiilist.messages[message.name]) == BUFFER_SIZE:
+                            noiilist.to_sqlite(name=message.name, db=db, grp='noii')
+                            db.flush()
+                if barlist is not None and message.name in barlist.bars:
+                    if len(barlist.bars[message.name].hist) >= BUFFER_SIZE:
+                        barlist.to_sqlite(name=message.name, db=db)
+                        db.flush()
+                if lifecycles and message.name in names:
+                    if orderlist.buffered(message.name) >= BUFFER_SIZE:
+                        orderlist.to_sqlite(name=message.name, db=db)
+                        db.flush()
+            elif method == 'csv':
+                if message_type in ('U', 'A', 'F', 'E', 'C', 'X', 'D'):
+                    if message.name in names:
+                        if len(messagelist.messages[message.name]) == BUFFER_SIZE:
+                            messagelist.to_txt(name=message.name, db=db, grp='messages')
+                        if len(booklist.books[message.name]['hist']) == BUFFER_SIZE:
+                            booklist.to_txt(name=message.name, db=db)
+                elif message_type == 'P':
+                    if message.name in names:
+                        if len(tradeslist.messages[message.name]) == BUFFER_SIZE:
+                            tradeslist.to_txt(name=message.name, db=db, grp='trades')
+                elif message_type in ('Q', 'I'):
+                    if message.name in names:
+                        if len(noiilist.messages[message.name]) == BUFFER_SIZE:
+                            noiilist.to_txt(name=message.name, db=db, grp='noii')
+                if barlist is not None and message.name in barlist.bars:
+                    if len(barlist.bars[message.name].hist) >= BUFFER_SIZE:
+                        barlist.to_txt(name=message.name, db=db)
+                if lifecycles and message.name in names:
+                    if orderlist.buffered(message.name) >= BUFFER_SIZE:
+                        orderlist.to_txt(name=message.name, db=db)
+
+            # save checkpoint
+            if checkpoint is not None and reader.reads >= next_checkpoint:
+                _flush(names, method, db, messagelist, booklist, tradeslist, noiilist, barlist, orderlist)
+                db.flush()
+                save_checkpoint(checkpoint_path, {'offset': reader.offset,
+                                                  'clock': reader.clock,
+                                                  'reads': reader.reads,
+                                                  'orders': orderlist.orders,
+                                                  'books': {name: booklist.books[name]['cur'] for name in names},
+                                                  'sizes': db.sizes(names),
+                                                  'log': os.path.getsize(log_path),
+                                                  'writes': (message_writes, trade_writes, noii_writes),
+                                                  'counts': counts,
+                                                  'bars': barlist.bars if barlist is not None else None,
+                                                  'queues': booklist.queues,
+                                                  'lifecycles': orderlist.lifecycles,
+                                                  'origins': orderlist.origins,
+                                                  'time': (message.sec, message.nano)})
+                next_checkpoint = reader.reads + checkpoint
+
+            # report metrics
+            if metrics is not None and counts[message_type] % 4096 == 0 and time.time() > next_metrics:
+                stats.update(time.time() - start, times, reader, booklist, lists, barlist, orderlist)
+                stats.write(metrics)
+                next_metrics = time.time() + metrics_interval
+            last = perf_counter()
+            times['write'] += last - update
+    except BaseException:  # release the output, so that the job can be resumed in this process
+        messages.close()
+        decoded.close()  # waits for worker processes, which share the open files
+        db.abort()
+        raise
 
     # clean up
     print('Cleaning up...')
-    for name in names:
-        if method == 'hdf5':
-            messagelist.to_hdf5(name=name, db=db, grp='messages')
-            booklist.to_hdf5(name=name, db=db)
-            tradeslist.to_hdf5(name=name, db=db, grp='trades')
-            noiilist.to_hdf5(name=name, db=db, grp='noii')
-        elif method == 'csv':
-            messagelist.to_txt(name=name, db=db, grp='messages')
-            booklist.to_txt(name=name, db=db)
-            tradeslist.to_txt(name=name, db=db, grp='trades')
-            noiilist.to_txt(name=name, db=db, grp='noii')
+    update = perf_counter()
+    if barlist is not None:
+        barlist.finish()
+    if lifecycles and reader.reads > 0:
+        if message is not None:
+            orderlist.close(message.sec, message.nano)
+        else:  # resumed from a checkpoint at the end of the file
+            orderlist.close(*state['time'])
+    _flush(names, method, db, messagelist, booklist, tradeslist, noiilist, barlist, orderlist)
+    times['write'] += perf_counter() - update
 
     stop = time.time()
 
-    data.close()
+    if manifest:
+        rows = db.rows(names)
     db.close()
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if compact and method == 'hdf5':
+        from .storage import compact as compact_hdf5
+        compact_hdf5(fout)
+    if manifest:
+        entries = load_manifest(manifest_path)
+        source['checksum'] = input_checksum(fin, entries)
+        completed = entries.setdefault(date, {})
+        for name in names:
+            completed[name] = dict(source,
+                                   options=options,
+                                   completed=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                   rows={grp: n for (grp, key), n in rows.items() if key == name})
+        save_manifest(manifest_path, entries)
+
+    stats.update(stop - start, times, reader, booklist, lists, barlist, orderlist)
+    if metrics is not None:
+        stats.write(metrics)
 
     print('Elapsed time: {} seconds'.format(stop - start))
-    print('Messages read: {}'.format(message_reads))
+    print('Messages read: {}'.format(reader.reads))
     print('Messages written: {}'.format(message_writes))
     print('Trades written: {}'.format(trade_writes))
     print('NOII written: {}'.format(noii_writes))
 
-
-def load_hdf5(db, name, grp):
-    """Read data from database and return pd.DataFrames."""
-
-    if grp == 'messages':
-        try:
-            with h5py.File(db, 'r') as f:
-                try:
-                    messages = f['/messages/' + name]
-                    data = messages[:, :]
-                    T, N = data.shape
-                    columns = ['sec',
-                               'nano',
-                               'type',
-                               'side',
-                               'price',
-                               'shares',
-                               'refno',
-                               'newrefno']
-                    df = pd.DataFrame(data, index=np.arange(0, T), columns=columns)
-                    return df
-                except KeyError as e:
-                    print('Could not find name {} in messages'.format(name))
-        except OSError as e:
-            print('Could not find file {}'.format(path))
-
-    if grp == 'books':
-        try:
-            with h5py.File(db, 'r') as f:
-                try:
-                    data = f['/orderbooks/' + name]
-                    nlevels = int((data.shape[1] - 2) / 4)
-                    pidx = list(range(2, 2 + nlevels))
-                    pidx.extend(list(range(2 + nlevels, 2 + 2 * nlevels)))
-                    vidx = list(range(2 + 2 * nlevels, 2 + 3 * nlevels))
-                    vidx.extend(list(range(2 + 3 * nlevels, 2 + 4 * nlevels)))
-                    timestamps = data[:, 0:2]
-                    prices = data[:, pidx]
-                    volume = data[:, vidx]
-                    base_columns = [str(i) for i in list(range(1, nlevels + 1))]
-                    price_columns = ['bidprc.' + i for i in base_columns]
-                    volume_columns = ['bidvol.' + i for i in base_columns]
-                    price_columns.extend(['askprc.' + i for i in base_columns])
-                    volume_columns.extend(['askvol.' + i for i in base_columns])
-                    df_time = pd.DataFrame(timestamps, columns=['sec', 'nano'])
-                    df_price = pd.DataFrame(prices, columns=price_columns)
-                    df_volume = pd.DataFrame(volume, columns=volume_columns)
-                    df_price = pd.concat([df_time, df_price], axis=1)
-                    df_volume = pd.concat([df_time, df_volume], axis=1)
-                    return df_price, df_volume
-                except KeyError as e:
-                    print('Could not find name {} in orderbooks'.format(name))
-        except OSError as e:
-            print('Could not find file {}'.format(path))
-
-    if grp == 'trades':
-        try:
-            with h5py.File(db, 'r') as f:
-                try:
-                    messages = f['/trades/' + name]
-                    data = messages[:, :]
-                    T, N = data.shape
-                    columns = ['sec',
-                               'nano',
-                               'side',
-                               'price',
-                               'shares']
-                    df = pd.DataFrame(data, index=np.arange(0, T), columns=columns)
-                    return df
-                except KeyError as e:
-                    print('Could not find name {} in messages'.format(name))
-        except OSError as e:
-            print('Could not find file {}'.format(path))
-
-    if grp == 'noii':
-        try:
-            with h5py.File(db, 'r') as f:
-                try:
-                    messages = f['/noii/' + name]
-                    data = messages[:, :]
-                    T, N = data.shape
-                    columns = ['sec',
-                               'nano',
-                               'type',
-                               'cross',
-                               'side',
-                               'price',
-                               'shares',
-                               'matchno',
-                               'paired',
-                               'imb',
-                               'dir',
-                               'far',
-                               'near',
-                               'current']
-                    df = pd.DataFrame(data, index=np.arange(0, T), columns=columns)
-                    return df
-                except KeyError as e:
-                    print('Could not find name {} in messages'.format(name))
-        except OSError as e:
-            print('Could not find file {}'.format(path))
-
-
-def interpolate(data, tstep):
-    """Interpolate limit order data.
-
-    Uses left-hand interpolation, and assumes that the data is indexed by timestamp.
-
-    """
-    T, N = data.shape
-    timestamps = data.index
-    t0 = timestamps[0] - (timestamps[0] % tstep)  # 34200
-    tN = timestamps[-1] - (timestamps[-1] % tstep) + tstep  # 57600
-    timestamps_new = np.arange(t0 + tstep, tN + tstep, tstep)  # [34200, ..., 57600]
-    X = np.zeros((len(timestamps_new), N))  # np.array
-    X[-1, :] = data.values[-1, :]
-    t = timestamps_new[0]  # keeps track of time in NEW sampling frequency
-    for i in np.arange(0, T):  # observations in data...
-        if timestamps[i] > t:
-            s = timestamps[i] - (timestamps[i] % tstep)
-            tidx = int((t - t0) / tstep - 1)
-            sidx = int((s - t0) / tstep)  # plus one for python indexing (below)
-            X[tidx:sidx, :] = data.values[i - 1, :]
-            t = s + tstep
-        else:
-            pass
-    return pd.DataFrame(X,
-                        index=timestamps_new,
-                        columns=data.columns)
-
-
-def imshow(data, which, levels):
-    """
-        Display order book data as an image, where order book data is either of
-        `df_price` or `df_volume` returned by `load_hdf5` or `load_postgres`.
-    """
-
-    if which == 'prices':
-        idx = ['askprc.' + str(i) for i in range(levels, 0, -1)]
-        idx.extend(['bidprc.' + str(i) for i in range(1, levels + 1, 1)])
-    elif which == 'volumes':
-        idx = ['askvol.' + str(i) for i in range(levels, 0, -1)]
-        idx.extend(['bidvol.' + str(i) for i in range(1, levels + 1, 1)])
-    plt.imshow(data.loc[:, idx].T, interpolation='nearest', aspect='auto')
-    plt.yticks(range(0, levels * 2, 1), idx)
-    plt.colorbar()
-    plt.tight_layout()
-    plt.show()
-
-
-def reorder(data, columns):
-    """Reorder the columns of order data.
-
-    The resulting columns will be asks (high-to-low) followed by bids (low-to-high).
-
-    """
-    levels = int((data.shape[1] - 2) / 2)
-    if columns == 'volume' or type == 'v':
-        idx = ['askvol.' + str(i) for i in range(levels, 0, -1)]
-        idx.extend(['bidvol.' + str(i) for i in range(1, levels + 1, 1)])
-    elif columns == 'price' or type == 'p':
-        idx = ['askprc.' + str(i) for i in range(levels, 0, -1)]
-        idx.extend(['bidprc.' + str(i) for i in range(1, levels + 1, 1)])
-    return data.ix[:, idx]
-
-
-def find_trades(messages, eps=10 ** -6):
-    if 'time' not in messages.columns:
-        messages['time'] = messages['sec'] + messages['nano'] / 10 ** 9
-    if 'type' in messages.columns:
-        messages = messages[messages.type == 'E']
-    trades = []
-    i = 0
-    while i < len(messages):
-        time = messages.iloc[i].time
-        side = messages.iloc[i].side
-        shares = messages.iloc[i].shares
-        vwap = messages.iloc[i].price
-        hit = 0
-        i += 1
-        if i == len(messages):
-            break
-        while messages.iloc[i].time <= time + eps and messages.iloc[i].side == side:
-            shares += messages.iloc[i].shares
-            if messages.iloc[i].price != vwap:
-                hit = 1
-                vwap = messages.iloc[i].price * messages.iloc[i].shares / shares + vwap * (
-                        shares - messages.iloc[i].shares) / shares
-            i += 1
-            if i == len(messages):
-                break
-        # print('TRADE (time={}, side={}, shares={}, vwap={}, hit={})'.format(time, side, shares, vwap, hit))
-        trades.append([time, side, shares, vwap, hit])
-    return pd.DataFrame(trades, columns=['time', 'side', 'shares', 'vwap', 'hit'])
-
-
-def plot_trades(trades):
-    sells = trades[trades.side == 'B']
-    buys = trades[trades.side == 'S']
-    plt.hist(sells.shares, bins=np.arange(-1000, 100, 100), edgecolor='white', color='C0', alpha=0.5)
-    plt.hist(-buys.shares, bins=np.arange(1, 1100, 100), edgecolor='white', color='C1', alpha=0.5)
-    plt.show()
-    plt.clf()
-
-
-def nodups(books, messages):
-    """Return messages and books with rows remove for orders that didn't change book."""
-    assert books.shape[0] == messages.shape[0], "books and messages do not have the same number of rows"
-    subset = books.columns.drop(['sec', 'nano', 'name'])
-    dups = books.duplicated(subset=subset)
-    return books[~dups].reset_index(), messages[~dups].reset_index()
-
-
-def combine(messages, hidden):
-    """Combine hidden executions with message data."""
-    messages = messages.drop(['index', 'sec', 'nano', 'name', 'refno', 'mpid'], axis=1)
-    hidden['type'] = 'H'
-    hidden = hidden.drop(['hit'], axis=1)
-    hidden = hidden.rename(columns={'vwap': 'price'})
-    combined = pd.concat([messages, hidden])
-    return combined.sort_values(by='time', axis=0)
+    return stats
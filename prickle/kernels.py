@@ -0,0 +1,270 @@
+"""Numeric kernels for order book reconstruction and trade aggregation.
+
+The kernels operate on integer message arrays (as stored in the 'messages' group of an HDF5 database). If numba is installed they are JIT-compiled; otherwise the same functions run as ordinary Python, so the results don't depend on whether numba is available.
+
+"""
+
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+NUMBA = numba is not None
+
+# message type codes (see `Message.to_array`)
+ADD, ADD_MPID, CANCEL, DELETE, EXECUTE, EXECUTE_PRICE, REPLACE = range(7)
+BID, ASK = 1, -1
+
+
+def jit(func):
+    """Compile a function with numba (if it is installed)."""
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+
+@jit
+def _add(levels, price, shares):
+    """Add shares to an existing price level, or open a new level."""
+    if price in levels:
+        levels[price] += shares
+        if levels[price] == 0:
+            levels.pop(price)
+    else:
+        levels[price] = shares
+
+
+@jit
+def _remove(levels, price, shares):
+    """Remove shares from a price level (if it exists)."""
+    if price in levels:
+        levels[price] -= shares
+        if levels[price] == 0:
+            levels.pop(price)
+
+
+@jit
+def _top(levels, nlevels, descending, prices, depths):
+    """Write the best `nlevels` price levels into `prices` and `depths`."""
+    keys = np.empty(len(levels), np.int64)
+    i = 0
+    for price in levels:
+        keys[i] = price
+        i += 1
+    keys.sort()
+    for j in range(min(nlevels, len(keys))):
+        if descending:
+            price = keys[len(keys) - 1 - j]
+        else:
+            price = keys[j]
+        prices[j] = price
+        depths[j] = levels[price]
+
+
+@jit
+def _snapshot(out, row, sec, nano, bids, asks, nlevels):
+    """Write a `Book.to_array` row."""
+    out[row, 0] = sec
+    out[row, 1] = nano
+    _top(bids, nlevels, True, out[row, 2:2 + nlevels], out[row, 2 + 2 * nlevels:2 + 3 * nlevels])
+    _top(asks, nlevels, False, out[row, 2 + nlevels:2 + 2 * nlevels], out[row, 2 + 3 * nlevels:2 + 4 * nlevels])
+
+
+@jit
+def _reconstruct(messages, nlevels, bids, asks, orders):
+    n = messages.shape[0]
+    nrows = n
+    for i in range(n):
+        if messages[i, 2] == REPLACE:
+            nrows += 1
+    out = np.zeros((nrows, 2 + 4 * nlevels), np.int64)
+    out[:, 2:2 + 2 * nlevels] = -1
+    row = 0
+    for i in range(n):
+        sec = messages[i, 0]
+        nano = messages[i, 1]
+        kind = messages[i, 2]
+        side = messages[i, 3]
+        price = messages[i, 4]
+        shares = messages[i, 5]
+        refno = messages[i, 6]
+        if kind == ADD or kind == ADD_MPID:
+            orders[refno] = (side, price, shares)
+            if side == BID:
+                _add(bids, price, shares)
+            elif side == ASK:
+                _add(asks, price, shares)
+        elif kind == CANCEL or kind == EXECUTE or kind == EXECUTE_PRICE or kind == DELETE:
+            if refno in orders:
+                order = orders[refno]
+                if kind == DELETE:
+                    orders.pop(refno)
+                else:
+                    orders[refno] = (order[0], order[1], order[2] - shares)
+            if side == BID:
+                _remove(bids, price, shares)
+            elif side == ASK:
+                _remove(asks, price, shares)
+        elif kind == REPLACE:
+            if refno in orders:
+                order = orders[refno]  # (numba types pop as optional)
+                del orders[refno]
+                if order[0] == BID:
+                    _remove(bids, order[1], order[2])
+                elif order[0] == ASK:
+                    _remove(asks, order[1], order[2])
+            _snapshot(out, row, sec, nano, bids, asks, nlevels)
+            row += 1
+            orders[messages[i, 7]] = (side, price, shares)
+            if side == BID:
+                _add(bids, price, shares)
+            elif side == ASK:
+                _add(asks, price, shares)
+        _snapshot(out, row, sec, nano, bids, asks, nlevels)
+        row += 1
+    return out
+
+
+def reconstruct(messages, nlevels):
+    """Reconstruct order books from message data.
+
+    Parameters
+    ----------
+    messages : np.array
+        Rows of (sec, nano, type, side, price, shares, refno, newrefno), as written to the 'messages' group of an HDF5 database by `unpack`
+    nlevels : int
+        Number of levels of the order book to return
+
+    Returns
+    -------
+    books : np.array
+        One `Book.to_array` row per book update (two for a replace), i.e. the 'orderbooks' data that `unpack` writes for the same messages.
+
+    """
+    if numba is None:
+        bids, asks, orders = {}, {}, {}
+    else:
+        bids = numba.typed.Dict.empty(numba.int64, numba.int64)
+        asks = numba.typed.Dict.empty(numba.int64, numba.int64)
+        orders = numba.typed.Dict.empty(numba.int64, numba.types.UniTuple(numba.int64, 3))
+    return _reconstruct(np.asarray(messages, dtype=np.int64), nlevels, bids, asks, orders)
+
+
+@jit
+def _set(levels, price, shares):
+    """Set the depth of a price level (removing the level if `shares` is zero)."""
+    if shares == 0:
+        if price in levels:
+            levels.pop(price)
+    else:
+        levels[price] = shares
+
+
+@jit
+def _replay(deltas, skip, nlevels, bids, asks):
+    n = deltas.shape[0]
+    out = np.zeros((n - skip, 2 + 4 * nlevels), np.int64)
+    out[:, 2:2 + 2 * nlevels] = -1
+    for i in range(n):
+        side = deltas[i, 2]
+        if side == BID:
+            _set(bids, deltas[i, 3], deltas[i, 4])
+        elif side == ASK:
+            _set(asks, deltas[i, 3], deltas[i, 4])
+        if i >= skip:
+            _snapshot(out, i - skip, deltas[i, 0], deltas[i, 1], bids, asks, nlevels)
+    return out
+
+
+def replay(levels, deltas, nlevels, skip=0):
+    """Apply book deltas to a keyframe and return order book snapshots.
+
+    Parameters
+    ----------
+    levels : np.array
+        Rows of (side, price, shares) giving every level of the book before the first delta
+    deltas : np.array
+        Rows of (sec, nano, side, price, shares) (see `Book.to_delta`)
+    nlevels : int
+        Number of levels of the order book to return
+    skip : int
+        Number of deltas to apply before the first snapshot
+
+    Returns
+    -------
+    books : np.array
+        One `Book.to_array` row for each delta after the first `skip`.
+
+    """
+    if numba is None:
+        bids, asks = {}, {}
+    else:
+        bids = numba.typed.Dict.empty(numba.int64, numba.int64)
+        asks = numba.typed.Dict.empty(numba.int64, numba.int64)
+    for side, price, shares in np.asarray(levels, dtype=np.int64).reshape(-1, 3):
+        if side == BID:
+            bids[price] = shares
+        elif side == ASK:
+            asks[price] = shares
+    return _replay(np.asarray(deltas, dtype=np.int64).reshape(-1, 5), skip, nlevels, bids, asks)
+
+
+@jit
+def aggregate_trades(time, side, shares, price, eps):
+    """Aggregate executions into trades.
+
+    Consecutive executions on the same side no more than `eps` nanoseconds after the first execution of a trade are combined into a single trade at the volume-weighted average price (see `find_trades`). As in the original `find_trades`, a last execution that would start a new trade is dropped.
+
+    Parameters
+    ----------
+    time : np.array
+        Execution times in nanoseconds (int64)
+    side : np.array
+        Side codes (integers)
+    shares : np.array
+        Shares executed
+    price : np.array
+        Execution prices
+    eps : int
+        Length of the aggregation window in nanoseconds
+
+    Returns
+    -------
+    time, side, shares, vwap, hit : np.arrays
+        One element per trade, with the time of its first execution. `hit` is 1 if the trade executed at more than one price.
+
+    """
+    n = len(time)
+    trade_time = np.empty_like(time)
+    trade_side = np.empty_like(side)
+    trade_shares = np.empty_like(shares)
+    trade_vwap = np.empty(n, np.float64)
+    trade_hit = np.zeros(n, np.int64)
+    count = 0
+    i = 0
+    while i < n:
+        t = time[i]
+        s = side[i]
+        total = shares[i]
+        vwap = float(price[i])
+        hit = 0
+        i += 1
+        if i == n:
+            break
+        while time[i] <= t + eps and side[i] == s:
+            total += shares[i]
+            if price[i] != vwap:
+                hit = 1
+                vwap = price[i] * shares[i] / total + vwap * (total - shares[i]) / total
+            i += 1
+            if i == n:
+                break
+        trade_time[count] = t
+        trade_side[count] = s
+        trade_shares[count] = total
+        trade_vwap[count] = vwap
+        trade_hit[count] = hit
+        count += 1
+    return trade_time[:count], trade_side[:count], trade_shares[:count], trade_vwap[:count], trade_hit[:count]
@@ -0,0 +1,236 @@
+import numpy as np
+import h5py
+from matplotlib import pyplot as plt
+from .books import BookReader
+
+
+def _nanoseconds(data):
+    """Return the times of the rows of a DataFrame in nanoseconds."""
+    if 'ns' in data.columns:
+        return data['ns'].values.astype(np.int64)
+    if 'sec' in data.columns:
+        return data['sec'].values.astype(np.int64) * 10 ** 9 + data['nano'].values.astype(np.int64)
+    return np.round(data['time'].values * 10 ** 9).astype(np.int64)
+
+
+def _bisect(dataset, ns):
+    """Return the first row of a timestamped HDF5 dataset at or after `ns`, reading one row per step."""
+    lo, hi = 0, dataset.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        sec, nano = dataset[mid, 0:2]
+        if int(sec) * 10 ** 9 + int(nano) < ns:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _ends(times):
+    """Return the first and last of an array of times (or zeros if it is empty)."""
+    if len(times) == 0:
+        return 0, 0
+    return times[0], times[-1]
+
+
+def _window(first, last, start, stop):
+    """Return the window [start, stop) in nanoseconds, defaulting to the times of the first and last rows."""
+    start = first if start is None else int(start * 10 ** 9)
+    stop = last + 1 if stop is None else int(stop * 10 ** 9)
+    return start, max(stop, start + 1)
+
+
+def _frame_blocks(data, columns, start, stop, block_size):
+    """Yield (times, values) blocks of the rows of a DataFrame in a window."""
+    times = _nanoseconds(data)
+    lo, hi = np.searchsorted(times, [start, stop])
+    for i in range(lo, hi, block_size):
+        j = min(i + block_size, hi)
+        yield times[i:j], data.iloc[i:j][columns].to_numpy()
+
+
+def _hdf5_blocks(f, grp, name, columns, start, stop, block_size, nlevels=None):
+    """Yield (times, values) blocks of the rows of an HDF5 dataset in a window.
+
+    Only `block_size` rows are read at a time. Order books stored as keyframes and deltas are reconstructed with `BookReader`, and `columns` then refer to books of `nlevels` levels.
+
+    """
+    if grp == 'orderbooks' and 'deltas' in f and name in f['deltas']:
+        reader = BookReader(f, name, nlevels)
+        reader.row_at(0)  # read the times of the rows
+        lo, hi = np.searchsorted(reader.times, [start, stop])
+        for i in range(lo, hi, block_size):
+            j = min(i + block_size, hi)
+            data = reader.to_array(i, j)
+            yield reader.times[i:j], data[:, columns]
+        return
+    dataset = f[grp][name]
+    lo, hi = _bisect(dataset, start), _bisect(dataset, stop)
+    for i in range(lo, hi, block_size):
+        data = dataset[i:min(i + block_size, hi), :].astype(np.int64)
+        yield data[:, 0] * 10 ** 9 + data[:, 1], data[:, columns]
+
+
+def _bounds(f, grp, name):
+    """Return the times of the first and last rows of an HDF5 dataset (in nanoseconds)."""
+    if grp == 'orderbooks' and 'deltas' in f and name in f['deltas']:
+        grp = 'deltas'
+    dataset = f[grp][name]
+    if dataset.shape[0] == 0:
+        return 0, 0
+    first = dataset[0, 0:2].astype(np.int64)
+    last = dataset[-1, 0:2].astype(np.int64)
+    return first[0] * 10 ** 9 + first[1], last[0] * 10 ** 9 + last[1]
+
+
+class Decimator():
+    """Aggregate timestamped rows into equal time buckets, one block of rows at a time.
+
+    Parameters
+    ----------
+    start : int
+        Start of the first bucket (nanoseconds)
+    stop : int
+        End of the last bucket (nanoseconds)
+    bins : int
+        Number of buckets
+    ncols : int
+        Number of columns of each row
+    how : string
+        Value of each bucket: 'last' (the last row), 'max' or 'min' (the largest or smallest value of each column)
+
+    """
+
+    def __init__(self, start, stop, bins, ncols, how='last'):
+        if how not in ('last', 'max', 'min'):
+            raise ValueError("how must be 'last', 'max' or 'min'")
+        self.edges = np.linspace(start, stop, bins + 1)
+        self.how = how
+        self.values = np.full((bins, ncols), np.nan)
+
+    def update(self, times, values):
+        """Add a block of rows (in time order)."""
+        idx = np.searchsorted(times, self.edges)
+        lo, hi = idx[:-1], idx[1:]
+        rows = hi > lo
+        if not rows.any():
+            return
+        if self.how == 'last':
+            self.values[rows] = values[hi[rows] - 1]
+            return
+        ufunc = np.maximum if self.how == 'max' else np.minimum
+        part = ufunc.reduceat(values[:idx[-1]], lo[rows], axis=0)
+        merge = np.fmax if self.how == 'max' else np.fmin
+        self.values[rows] = merge(self.values[rows], part)
+
+    def result(self):
+        """Return the value of each bucket, carrying the last value forward through buckets without rows."""
+        filled = ~np.isnan(self.values).all(axis=1)
+        idx = np.maximum.accumulate(np.where(filled, np.arange(len(filled)), 0))
+        return self.values[idx]
+
+
+def decimate(times, values, bins, start=None, stop=None, how='last'):
+    """Aggregate timestamped rows into `bins` equal time buckets.
+
+    `times` are nanoseconds in increasing order and `values` has one row per time. Returns the edges of the buckets and the value of each bucket (see `Decimator`).
+
+    """
+    start, stop = _window(*_ends(times), start, stop)
+    decimator = Decimator(start, stop, bins, values.shape[1], how)
+    decimator.update(np.asarray(times), np.asarray(values))
+    return decimator.edges, decimator.result()
+
+
+def _pixels():
+    """Return the width of the current figure in pixels."""
+    fig = plt.gcf()
+    return int(fig.get_size_inches()[0] * fig.dpi)
+
+
+def imshow(data, which, levels, name=None, start=None, stop=None, bins=None, how='last', block_size=10 ** 6):
+    """
+        Display order book data as an image, where order book data is either of
+        `df_price` or `df_volume` returned by `load_hdf5` or `load_postgres`, or
+        the location of an HDF5 database (in which case `name` is the stock to
+        display, and the books are read `block_size` rows at a time).
+
+        Rows are aggregated into `bins` time buckets (by default, one per pixel
+        of the figure's width) from `start` to `stop` (in seconds) before they
+        are drawn. Each bucket shows the last book (`how='last'`), or the
+        largest or smallest value at each level (`how='max'` or `'min'`).
+    """
+
+    if which == 'prices':
+        idx = ['askprc.' + str(i) for i in range(levels, 0, -1)]
+        idx.extend(['bidprc.' + str(i) for i in range(1, levels + 1, 1)])
+    elif which == 'volumes':
+        idx = ['askvol.' + str(i) for i in range(levels, 0, -1)]
+        idx.extend(['bidvol.' + str(i) for i in range(1, levels + 1, 1)])
+    if bins is None:
+        bins = _pixels()
+    if isinstance(data, str):
+        with h5py.File(data, 'r') as f:
+            if 'deltas' in f and name in f['deltas']:
+                nlevels = levels
+            else:
+                nlevels = (f['orderbooks'][name].shape[1] - 2) // 4
+            offset = 2 if which == 'prices' else 2 + 2 * nlevels
+            columns = [offset + nlevels + i - 1 for i in range(levels, 0, -1)]
+            columns.extend([offset + i - 1 for i in range(1, levels + 1, 1)])
+            start, stop = _window(*_bounds(f, 'orderbooks', name), start, stop)
+            decimator = Decimator(start, stop, bins, len(columns), how)
+            for times, values in _hdf5_blocks(f, 'orderbooks', name, columns, start, stop, block_size, nlevels):
+                decimator.update(times, values)
+    else:
+        times = _nanoseconds(data)
+        start, stop = _window(*_ends(times), start, stop)
+        decimator = Decimator(start, stop, bins, len(idx), how)
+        for times, values in _frame_blocks(data, idx, start, stop, block_size):
+            decimator.update(times, values)
+    image = decimator.result()
+    plt.imshow(image.T, interpolation='nearest', aspect='auto',
+               extent=[start / 10 ** 9, stop / 10 ** 9, levels * 2 - 0.5, -0.5])
+    plt.yticks(range(0, levels * 2, 1), idx)
+    plt.colorbar()
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_trades(trades, name=None, start=None, stop=None, max_shares=1000, width=100, block_size=10 ** 6, bid=-1):
+    """
+        Plot histograms of the sizes of sell (left) and buy (right) trades, where
+        `trades` is a DataFrame returned by `find_trades` or `load_hdf5`, or the
+        location of an HDF5 database (in which case `name` is the stock to plot,
+        and trades are read `block_size` rows at a time). Only trades from `start`
+        to `stop` (in seconds) are counted.
+
+        Sells are trades against bids (side 'B'). If sides are integer codes,
+        `bid` is the code of 'B' in a DataFrame: -1 for the 'trades' group (the
+        default), or 1 for executions from the 'messages' group (see
+        `Message.to_array`).
+    """
+
+    edges = np.arange(0, max_shares + width, width)
+    sells = np.zeros(len(edges) - 1, dtype=np.int64)
+    buys = np.zeros(len(edges) - 1, dtype=np.int64)
+
+    def count(blocks, bid):
+        for times, values in blocks:
+            side, shares = values[:, 0], np.abs(values[:, 1].astype(np.int64))  # executions in CSV files are negative
+            sell = side == bid if side.dtype.kind in 'iu' else side == 'B'  # executions against bids
+            sells[:] += np.histogram(shares[sell], bins=edges)[0]
+            buys[:] += np.histogram(shares[~sell], bins=edges)[0]
+
+    if isinstance(trades, str):
+        with h5py.File(trades, 'r') as f:
+            start, stop = _window(*_bounds(f, 'trades', name), start, stop)
+            count(_hdf5_blocks(f, 'trades', name, [2, 4], start, stop, block_size), -1)
+    else:
+        times = _nanoseconds(trades)
+        start, stop = _window(*_ends(times), start, stop)
+        count(_frame_blocks(trades, ['side', 'shares'], start, stop, block_size), bid)
+    plt.stairs(sells[::-1], -edges[::-1], fill=True, edgecolor='white', color='C0', alpha=0.5)
+    plt.stairs(buys, edges, fill=True, edgecolor='white', color='C1', alpha=0.5)
+    plt.show()
+    plt.clf()
@@ -0,0 +1,383 @@
+"""Paced replay of a trading day to subscribers over local sockets.
+
+A `ReplayServer` reads events (messages and best bid and offer updates) from a raw ITCH file (`itch_events`) or from the HDF5 output of `unpack` (`hdf5_events`), and publishes them to every connected subscriber at the pace of the original timestamps, or a multiple of it. Events are sent as lines of JSON, in batches that are encoded once and shared by all subscribers.
+
+"""
+
+import numpy as np
+import asyncio
+import heapq
+import json
+import time
+from .core import Reader, Orderlist, Book
+
+
+# message type codes (see `Message.to_array`)
+TYPES = 'AFXDECU'
+
+
+def _bbo(name, sec, nano, book):
+    """Return a best bid and offer event for a Book (prices are -1 and sizes are 0 if a side is empty)."""
+    bid = max(book.bids) if len(book.bids) > 0 else -1
+    ask = min(book.asks) if len(book.asks) > 0 else -1
+    return {'type': 'bbo', 'name': name, 'sec': sec, 'nano': nano,
+            'bid': bid, 'bidsize': book.bids.get(bid, 0), 'ask': ask, 'asksize': book.asks.get(ask, 0)}
+
+
+def itch_events(fin, ver, date, names):
+    """Read events from an ITCH data file.
+
+    Messages are completed and order books are updated as in `unpack`. Yields (time, event) pairs, where time is in nanoseconds and event is a dictionary: one for each order, execution and trade message of `names`, and a 'bbo' event whenever the best bid or offer of a stock changes.
+
+    """
+    orderlist = Orderlist()
+    books = {name: Book(date, name, 1) for name in names}
+    quotes = {}
+    for message_type, message in Reader(fin, ver, date):
+        if message_type == 'U':
+            message, del_message, add_message = message.split()
+            orderlist.complete_message(message)
+            orderlist.complete_message(del_message)
+            orderlist.complete_message(add_message)
+            if message.name in names:
+                orderlist.update(del_message)
+                books[message.name].update(del_message)
+                orderlist.add(add_message)
+                books[message.name].update(add_message)
+        elif message_type in ('E', 'C', 'X', 'D'):
+            orderlist.complete_message(message)
+            if message.name in names:
+                orderlist.update(message)
+                books[message.name].update(message)
+        elif message_type in ('A', 'F'):
+            if message.name in names:
+                orderlist.add(message)
+                books[message.name].update(message)
+        elif message_type != 'P':
+            continue
+        if message.name not in names:
+            continue
+        ns = message.sec * 10 ** 9 + message.nano
+        yield ns, {'type': message.type, 'name': message.name, 'sec': message.sec, 'nano': message.nano,
+                   'side': message.buysell, 'price': message.price, 'shares': abs(message.shares),
+                   'refno': message.refno, 'newrefno': message.newrefno}
+        if message_type != 'P':
+            event = _bbo(message.name, message.sec, message.nano, books[message.name])
+            quote = (event['bid'], event['bidsize'], event['ask'], event['asksize'])
+            if quotes.get(message.name) != quote:
+                quotes[message.name] = quote
+                yield ns, event
+
+
+def _hdf5_events(f, name):
+    """Yield the (time, event) pairs of one stock from an open HDF5 database."""
+    messages = f['messages'][name][:, :].astype(np.int64)
+    trades = f['trades'][name][:, :].astype(np.int64)
+    if 'deltas' in f and name in f['deltas']:
+        from .books import BookReader
+        books = BookReader(f, name, nlevels=1).to_array()
+    else:
+        nlevels = (f['orderbooks'][name].shape[1] - 2) // 4
+        books = f['orderbooks'][name][:, [0, 1, 2, 2 + nlevels, 2 + 2 * nlevels, 2 + 3 * nlevels]].astype(np.int64)
+    # replace messages write two books, so keep the last book of each message
+    rows = np.cumsum(np.where(messages[:, 2] == 6, 2, 1)) - 1
+    books = books[rows] if len(rows) > 0 else books[:0]
+    changed = np.ones(len(books), dtype=bool)
+    changed[1:] = (books[1:, 2:] != books[:-1, 2:]).any(axis=1)
+
+    def order_events():
+        for row, book, new in zip(messages.tolist(), books.tolist(), changed.tolist()):
+            sec, nano, kind, side, price, shares, refno, newrefno = row
+            ns = sec * 10 ** 9 + nano
+            yield ns, {'type': TYPES[kind], 'name': name, 'sec': sec, 'nano': nano,
+                       'side': 'B' if side == 1 else 'S', 'price': price, 'shares': shares,
+                       'refno': refno, 'newrefno': newrefno}
+            if new:
+                yield ns, {'type': 'bbo', 'name': name, 'sec': sec, 'nano': nano,
+                           'bid': book[2], 'bidsize': book[4], 'ask': book[3], 'asksize': book[5]}
+
+    def trade_events():
+        for sec, nano, side, price, shares in trades.tolist():
+            yield sec * 10 ** 9 + nano, {'type': 'P', 'name': name, 'sec': sec, 'nano': nano,
+                                         'side': 'B' if side == -1 else 'S', 'price': price, 'shares': shares,
+                                         'refno': 0, 'newrefno': -1}
+
+    return heapq.merge(order_events(), trade_events(), key=lambda item: item[0])
+
+
+def hdf5_events(db, names):
+    """Read events from an HDF5 database written by `unpack`.
+
+    Yields the same (time, event) pairs as `itch_events`, merged across `names` in time order.
+
+    """
+    import h5py
+    with h5py.File(db, 'r') as f:
+        streams = [_hdf5_events(f, name) for name in names]
+        yield from heapq.merge(*streams, key=lambda item: item[0])
+
+
+class Subscriber():
+    """A connection to a `ReplayServer`.
+
+    Batches are queued for each subscriber and written by a separate task, so a slow subscriber only delays the others if the server's `policy` is 'block'.
+
+    Attributes
+    ----------
+    sent : int
+        Number of events written
+    dropped : int
+        Number of events dropped because the queue was full (if the policy is 'drop')
+    closed : bool
+        Whether the subscriber has disconnected (or the replay has ended for it)
+    bytes : int
+        Number of bytes written
+    latency : float
+        Total seconds between publishing batches and writing them to the socket
+    max_latency : float
+        Largest number of seconds between publishing a batch and writing it to the socket
+    max_depth : int
+        Largest number of batches waiting in the queue
+
+    """
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.sent = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.batches = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.max_depth = 0
+        self.closed = False
+        self.peer = writer.get_extra_info('peername')
+
+    async def run(self):
+        """Write queued batches to the socket until the end of the replay."""
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    break
+                data, count, published = item
+                self.writer.write(data)
+                await self.writer.drain()  # wait for the subscriber to read
+                latency = time.perf_counter() - published
+                self.sent += count
+                self.bytes += len(data)
+                self.batches += 1
+                self.latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            self.writer.write(b'{"type":"end"}\n')
+            await self.writer.drain()
+        except ConnectionError:
+            print('Subscriber disconnected: {}'.format(self.peer))
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop sending to the subscriber and discard its queue (so the server never waits on it)."""
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.writer.close()
+
+    def to_dict(self):
+        return {'peer': str(self.peer),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'bytes': self.bytes,
+                'mean_latency': self.latency / self.batches if self.batches > 0 else 0.0,
+                'max_latency': self.max_latency,
+                'max_depth': self.max_depth}
+
+
+class ReplayServer():
+    """Replay events to subscribers at the pace of their timestamps.
+
+    Parameters
+    ----------
+    events : iterable
+        (time, event) pairs in time order, where time is in nanoseconds and event is a JSON-serializable dictionary (see `itch_events` and `hdf5_events`)
+    speed : float
+        Replay speed as a multiple of real time (None replays as fast as possible)
+    subscribers : int
+        Number of subscribers to wait for before the replay starts
+    batch_interval : float
+        Events that are due within this many seconds (of replay time) of the first event of a batch are sent together
+    max_batch : int
+        Maximum number of events in a batch
+    queue_size : int
+        Maximum number of batches queued for each subscriber
+    policy : string
+        What to do when a subscriber's queue is full: 'block' (pause the replay until it catches up) or 'drop' (skip the batch for that subscriber)
+
+    Attributes
+    ----------
+    events : int
+        Number of events published
+    batches : int
+        Number of batches published
+    elapsed : float
+        Seconds from the first event to the end of the replay
+    lag : float
+        Total seconds that batches were published after they were due
+    max_lag : float
+        Largest number of seconds that a batch was published after it was due
+    clients : list
+        Subscribers
+
+    Examples
+    --------
+    Replay a day at ten times real time to two subscribers on a Unix socket::
+
+    >> events = pk.hdf5_events('itch.hdf5', ['AAPL', 'GOOG'])
+    >> server = pk.ReplayServer(events, speed=10, subscribers=2)
+    >> asyncio.run(server.serve(path='/tmp/itch.sock'))
+
+    and subscribe from another process::
+
+    >> async for event in pk.subscribe(path='/tmp/itch.sock'):
+    >>     ...
+
+    """
+
+    def __init__(self, events, speed=1.0, subscribers=1, batch_interval=0.001, max_batch=1000, queue_size=1000,
+                 policy='block'):
+        if policy not in ('block', 'drop'):
+            raise ValueError("policy must be 'block' or 'drop'")
+        self.source = events
+        self.speed = speed
+        self.subscribers = subscribers
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.policy = policy
+        self.clients = []
+        self.tasks = []
+        self.address = None
+        self.events = 0
+        self.batches = 0
+        self.elapsed = 0.0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def __str__(self):
+        return 'ReplayServer(events={}, batches={}, subscribers={})'.format(self.events, self.batches, len(self.clients))
+
+    def __repr__(self):
+        return str(self)
+
+    async def _connect(self, reader, writer):
+        subscriber = Subscriber(writer, self.queue_size)
+        self.clients.append(subscriber)
+        self.tasks.append(asyncio.ensure_future(subscriber.run()))
+        print('Subscriber connected: {}'.format(subscriber.peer))
+        if len(self.clients) >= self.subscribers:
+            self.ready.set()
+
+    async def _publish(self, batch):
+        data = ('\n'.join([json.dumps(event, separators=(',', ':')) for event in batch]) + '\n').encode()
+        item = (data, len(batch), time.perf_counter())
+        for subscriber in self.clients:
+            if subscriber.closed:
+                continue
+            if self.policy == 'block':
+                await subscriber.queue.put(item)
+                if subscriber.closed:  # disconnected while the server waited
+                    subscriber.close()
+                    continue
+            else:
+                try:
+                    subscriber.queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    subscriber.dropped += len(batch)
+            subscriber.max_depth = max(subscriber.max_depth, subscriber.queue.qsize())
+        self.events += len(batch)
+        self.batches += 1
+
+    async def _pace(self, ns, start_ns, start):
+        """Wait until an event is due (or record how late it is)."""
+        if self.speed is None:
+            await asyncio.sleep(0)
+            return
+        delay = start + (ns - start_ns) / 10 ** 9 / self.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            self.lag -= delay
+            self.max_lag = max(self.max_lag, -delay)
+            await asyncio.sleep(0)
+
+    async def serve(self, host='127.0.0.1', port=0, path=None):
+        """Listen for subscribers, replay the events to them, and return the server.
+
+        Subscribers connect to `path` (a Unix socket) if it is given, and otherwise to `host` and `port` (port 0 picks a free port). The address is printed and stored in `address` once the server is listening.
+
+        """
+        self.ready = asyncio.Event()
+        if path is not None:
+            server = await asyncio.start_unix_server(self._connect, path=path)
+            self.address = path
+        else:
+            server = await asyncio.start_server(self._connect, host=host, port=port)
+            self.address = server.sockets[0].getsockname()[:2]
+        print('Replay server listening on {}'.format(self.address))
+        async with server:
+            await self.ready.wait()
+            window = self.batch_interval * (self.speed or 1) * 10 ** 9
+            batch = []
+            start = None
+            for ns, event in self.source:
+                if start is None:
+                    start_ns, start = ns, time.perf_counter()
+                    batch_ns = ns
+                elif ns - batch_ns > window or len(batch) >= self.max_batch:
+                    await self._pace(batch_ns, start_ns, start)
+                    await self._publish(batch)
+                    batch = []
+                    batch_ns = ns
+                batch.append(event)
+            if len(batch) > 0:
+                await self._pace(batch_ns, start_ns, start)
+                await self._publish(batch)
+            for subscriber in self.clients:
+                if not subscriber.closed:
+                    await subscriber.queue.put(None)
+            await asyncio.gather(*self.tasks)
+            self.elapsed = time.perf_counter() - start if start is not None else 0.0
+        print('Replayed {} events in {} batches ({:.2f} seconds)'.format(self.events, self.batches, self.elapsed))
+        return self
+
+    def to_dict(self):
+        """Return replay statistics as a dictionary."""
+        return {'events': self.events,
+                'batches': self.batches,
+                'elapsed': self.elapsed,
+                'mean_lag': self.lag / self.batches if self.batches > 0 else 0.0,
+                'max_lag': self.max_lag,
+                'subscribers': [subscriber.to_dict() for subscriber in self.clients]}
+
+
+def serve_replay(events, speed=1.0, host='127.0.0.1', port=0, path=None, **kwargs):
+    """Run a `ReplayServer` until the replay is finished and return it (see `ReplayServer` for options)."""
+    server = ReplayServer(events, speed=speed, **kwargs)
+    return asyncio.run(server.serve(host=host, port=port, path=path))
+
+
+async def subscribe(host='127.0.0.1', port=None, path=None):
+    """Connect to a `ReplayServer` and yield events (dictionaries) until the end of the replay."""
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        async for line in reader:
+            event = json.loads(line)
+            if event['type'] == 'end':
+                break
+            yield event
+    finally:
+        writer.close()
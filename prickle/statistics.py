@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+from .analysis import find_trades
+
+
+TYPES = ['A', 'C', 'D', 'E', 'F', 'U', 'X']
+SHARE_BINS = np.arange(0, 2025, 25)
+TIME_BINS = np.arange(34200, 57900, 300)
+NANO_BINS = np.arange(0, 10 ** 9 + 2 * 10 ** 7, 2 * 10 ** 7)
+
+
+def histograms(codes, values, bins, ncodes):
+    """Compute a histogram of `values` for each code in one pass.
+
+    Bins are defined as in `np.histogram`: each bin is closed on the left, except the last bin, which is closed on both sides. Values outside of the bins (and negative codes) are ignored.
+
+    Returns
+    -------
+    counts : np.array
+        Row `i` is the histogram of values with code `i`.
+
+    """
+    nbins = len(bins) - 1
+    values = np.asarray(values)
+    idx = np.searchsorted(bins, values, side='right') - 1
+    idx[values == bins[-1]] = nbins - 1
+    valid = (idx >= 0) & (idx < nbins) & (codes >= 0)
+    flat = codes[valid] * nbins + idx[valid]
+    return np.bincount(flat, minlength=ncodes * nbins).reshape(ncodes, nbins)
+
+
+class Statistics():
+    """Daily summary statistics of `unpack` output.
+
+    Each table has one row per date and name (and message type, for histograms). Statistics computed separately (e.g. by different processes) are combined with `merge`.
+
+    Attributes
+    ----------
+    counts : list
+        Rows of (date, name, counts by type)
+    shares : list
+        Rows of (date, name, type, histogram of shares)
+    times : list
+        Rows of (date, name, type, histogram of seconds)
+    nanos : list
+        Rows of (date, name, type, histogram of nanoseconds)
+    trades : list
+        Trades found in execution messages (pd.DataFrames)
+    hidden : list
+        Trades found in hidden execution messages (pd.DataFrames)
+
+    """
+
+    def __init__(self):
+        self.counts = []
+        self.shares = []
+        self.times = []
+        self.nanos = []
+        self.trades = []
+        self.hidden = []
+
+    def __str__(self):
+        return 'Statistics(days={})'.format(len(self.counts))
+
+    def __repr__(self):
+        return str(self)
+
+    def add(self, date, name, messages):
+        """Add the statistics of one day of data for one stock.
+
+        Parameters
+        ----------
+        date : string
+            Date of the data
+        name : string
+            Stock ticker
+        messages : pd.DataFrame
+            Messages that changed the order book, with a 'time' column
+
+        """
+        codes = pd.Categorical(messages['type'], categories=TYPES).codes.astype(np.int64)
+        counts = np.bincount(codes[codes >= 0], minlength=len(TYPES))
+        self.counts.append([date, name] + list(counts))
+        shares = histograms(codes, np.abs(messages['shares'].values), SHARE_BINS, len(TYPES))
+        times = histograms(codes, messages['time'].values, TIME_BINS, len(TYPES))
+        nanos = histograms(codes, messages['nano'].values, NANO_BINS, len(TYPES))
+        for i, label in enumerate(TYPES):
+            self.shares.append([date, name, label] + list(shares[i]))
+            self.times.append([date, name, label] + list(times[i]))
+            self.nanos.append([date, name, label] + list(nanos[i]))
+
+    def add_trades(self, date, name, messages, hidden):
+        """Add the trades of one day of data for one stock (see `find_trades`)."""
+        trades = find_trades(messages).drop(columns='ns')
+        trades['date'] = date
+        trades['name'] = name
+        self.trades.append(trades)
+        trades = find_trades(hidden).drop(columns='ns')
+        trades['date'] = date
+        trades['name'] = name
+        self.hidden.append(trades)
+
+    def merge(self, other):
+        """Add the rows of another Statistics object."""
+        self.counts.extend(other.counts)
+        self.shares.extend(other.shares)
+        self.times.extend(other.times)
+        self.nanos.extend(other.nanos)
+        self.trades.extend(other.trades)
+        self.hidden.extend(other.hidden)
+        return self
+
+    def tables(self):
+        """Return the statistics as a dictionary of pd.DataFrames, sorted by name and date."""
+        tables = {}
+        tables['message_counts'] = pd.DataFrame(self.counts, columns=['date', 'name'] + TYPES)
+        tables['message_shares'] = pd.DataFrame(self.shares, columns=['date', 'name', 'type'] + list(SHARE_BINS[:-1]))
+        tables['message_times'] = pd.DataFrame(self.times, columns=['date', 'name', 'type'] + list(TIME_BINS[:-1]))
+        tables['message_nano'] = pd.DataFrame(self.nanos, columns=['date', 'name', 'type'] + list(NANO_BINS[:-1]))
+        for key in tables:
+            by = ['name', 'date'] if key == 'message_counts' else ['name', 'date', 'type']
+            tables[key] = tables[key].sort_values(by=by, kind='stable').reset_index(drop=True)
+        for key, frames in [('trades', self.trades), ('hidden_trades', self.hidden)]:
+            if len(frames) > 0:
+                tables[key] = pd.concat(frames).sort_values(by=['name', 'date'], kind='stable')
+            else:
+                tables[key] = pd.DataFrame(columns=['time', 'side', 'shares', 'vwap', 'hit', 'date', 'name'])
+        return tables
+
+    def write(self, path):
+        """Write each table to `<path>/<table>.txt`."""
+        os.makedirs(path, exist_ok=True)
+        for key, table in self.tables().items():
+            table.to_csv(os.path.join(path, key + '.txt'))
+
+
+def daily_statistics(root, date, name, start=34200, stop=57600, hidden_stop=57000):
+    """Compute statistics for one day of CSV data for one stock.
+
+    Reads the messages, books and trades written by `unpack` to `<root>/<date>/`, keeps messages between `start` and `stop` seconds, and drops messages whose book repeats an earlier book at the same time (as examples/statistics.py did with `nodups`, comparing its 'time' column). Trades are found in all messages between `start` and `stop`, and hidden trades between `start` and `hidden_stop`.
+
+    Replace messages write two books (after the delete and after the add), and the second is compared. Raises ValueError if the number of books doesn't match the messages.
+
+    Returns
+    -------
+    stats : Statistics
+
+    """
+    messages = pd.read_csv('{}/{}/messages/messages_{}.txt'.format(root, date, name))
+    books = pd.read_csv('{}/{}/books/books_{}.txt'.format(root, date, name))
+    hidden = pd.read_csv('{}/{}/trades/trades_{}.txt'.format(root, date, name))
+    messages['time'] = messages['sec'] + messages['nano'] / 10 ** 9
+    hidden['time'] = hidden['sec'] + hidden['nano'] / 10 ** 9
+
+    # replace messages write two books, so keep the last book of each message
+    rows = np.cumsum(np.where(messages['type'] == 'U', 2, 1)) - 1
+    if len(books) != (rows[-1] + 1 if len(rows) > 0 else 0):
+        raise ValueError('Books and messages of {} on {} do not line up ({} books for {} messages)'.format(
+            name, date, len(books), len(messages)))
+    books = books.iloc[rows].reset_index(drop=True)
+
+    keep = ((messages['time'] > start) & (messages['time'] < stop)).values
+    messages = messages[keep]
+    books = books[keep]
+    dups = books.duplicated(subset=books.columns.drop('name')).values  # the original script compared times too
+    hidden = hidden[(hidden['time'] > start) & (hidden['time'] < hidden_stop)]
+
+    stats = Statistics()
+    stats.add(date, name, messages[~dups])
+    stats.add_trades(date, name, messages, hidden)
+    return stats
+
+
+def _daily_statistics(args):
+    return daily_statistics(*args)
+
+
+def compute_statistics(root, dates, names, nworkers=None, start=34200, stop=57600, hidden_stop=57000):
+    """Compute statistics for every date and name in a directory of CSV data.
+
+    Each date and name is processed independently, so if `nworkers` is given the work is spread over that many processes, and results are merged as they arrive.
+
+    Parameters
+    ----------
+    root : string
+        Directory containing one `unpack` CSV output directory per date
+    dates : list
+        Dates (directory names) to include
+    names : list
+        Stock tickers to include
+    nworkers : int
+        Number of worker processes (default: compute in this process)
+    start : int
+        Ignore messages before this time (seconds)
+    stop : int
+        Ignore messages after this time (seconds)
+    hidden_stop : int
+        Ignore hidden trades after this time (seconds)
+
+    Returns
+    -------
+    stats : Statistics
+
+    Examples
+    --------
+    >> stats = pk.compute_statistics('/data/ITCH/csv', dates, names, nworkers=8)
+    >> stats.write('/data/ITCH/stats')
+
+    """
+    tasks = [(root, date, name, start, stop, hidden_stop) for name in names for date in dates]
+    stats = Statistics()
+    if nworkers is None:
+        for task in tasks:
+            stats.merge(_daily_statistics(task))
+            print('Processed data for {}, {}'.format(task[2], task[1]))
+    else:
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = {executor.submit(_daily_statistics, task): task for task in tasks}
+            for future in as_completed(futures):
+                stats.merge(future.result())
+                print('Processed data for {}, {}'.format(futures[future][2], futures[future][1]))
+    return stats
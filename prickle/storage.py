@@ -0,0 +1,76 @@
+import numpy as np
+import h5py
+import os
+
+
+# groups whose rows start with (sec, nano)
+TIMED_GROUPS = ('messages', 'orderbooks', 'trades', 'noii', 'bars', 'deltas', 'orders')
+
+
+def compact(db, fout=None, block_size=10 ** 6):
+    """Rewrite an HDF5 database with contiguous datasets.
+
+    `unpack` grows datasets as it writes them, which leaves them stored as many small chunks. `compact` copies every dataset into a contiguous (unchunked) dataset of its final size, so that it can be read in one pass or memory-mapped (see `mmap_hdf5`). Each dataset records its number of rows in the 'rows' attribute, and datasets of timestamped rows record the (sec, nano) of their first and last rows in the 'start' and 'stop' attributes.
+
+    Compacted datasets can't be resized, so compact a database after `unpack` has finished writing to it: a database with a checkpoint (i.e. an unfinished job that can be resumed) raises a ValueError. A later `unpack` job can still write to a compacted database, since the datasets of the names it processes are replaced by new (chunked) datasets, but those can't be memory-mapped until the database is compacted again.
+
+    Parameters
+    ----------
+    db : string
+        Location of the HDF5 file
+    fout : string
+        Location of the compacted file (defaults to replacing `db`)
+    block_size : int
+        Number of rows to copy at a time
+
+    """
+    if os.path.exists('{}.checkpoint'.format(db.rstrip('/'))):
+        raise ValueError('{} has a checkpoint: resume the job before compacting the database'.format(db))
+    if fout is None:
+        fout = db
+    tmp = fout + '.compact'
+    with h5py.File(db, 'r') as src, h5py.File(tmp, 'w') as dst:
+        dst.attrs.update(src.attrs)
+        for grp_name, grp in src.items():
+            new_grp = dst.require_group(grp_name)
+            new_grp.attrs.update(grp.attrs)
+            for name, dataset in grp.items():
+                new = new_grp.create_dataset(name, shape=dataset.shape, dtype=dataset.dtype)
+                for start in range(0, dataset.shape[0], block_size):
+                    new[start:start + block_size] = dataset[start:start + block_size]
+                new.attrs.update(dataset.attrs)
+                new.attrs['rows'] = dataset.shape[0]
+                if grp_name in TIMED_GROUPS and dataset.shape[0] > 0:
+                    new.attrs['start'] = dataset[0, 0:2].astype(np.int64)
+                    new.attrs['stop'] = dataset[-1, 0:2].astype(np.int64)
+        dst.attrs['compact'] = True
+    os.replace(tmp, fout)
+    print('Compacted database: {}'.format(fout))
+
+
+def as_array(dataset, mmap=False):
+    """Return the data of an HDF5 dataset as an np.array.
+
+    If `mmap` is True, the data is memory-mapped instead of copied. This requires a contiguous dataset (see `compact`).
+
+    """
+    if not mmap:
+        return dataset[...]
+    if dataset.chunks is not None or dataset.compression is not None:
+        raise ValueError('Dataset {} is not contiguous (see `compact`)'.format(dataset.name))
+    offset = dataset.id.get_offset()
+    if offset is None:  # no data written
+        return np.zeros(dataset.shape, dtype=dataset.dtype)
+    return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+
+
+def mmap_hdf5(db, name, grp):
+    """Memory-map a dataset of a compacted HDF5 database.
+
+    Returns a read-only np.memmap, so no data is read until it is used. `grp` is a group of the database ('messages', 'orderbooks', 'trades', 'noii', ...), or 'books' for 'orderbooks'.
+
+    """
+    if grp == 'books':
+        grp = 'orderbooks'
+    with h5py.File(db, 'r') as f:
+        return as_array(f[grp][name], mmap=True)
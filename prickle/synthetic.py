@@ -0,0 +1,266 @@
+import numpy as np
+import random
+import struct
+from .core import PROTOCOLS, Message, NOIIMessage
+
+
+DEFAULT_MIX = {'A': 0.33,
+               'F': 0.05,
+               'E': 0.12,
+               'C': 0.02,
+               'X': 0.08,
+               'D': 0.25,
+               'U': 0.08,
+               'P': 0.04,
+               'Q': 0.005,
+               'I': 0.025}
+
+ENCODERS = {}
+
+
+def compile_encoder(message_type, fmt, fields):
+    """Return a function that encodes a Message as binary message data.
+
+    This is the inverse of `compile_decoder`: the function packs the attributes named by a message layout (see `PROTOCOLS`) and prepends the message size and type. Strings are padded with spaces, and discarded fields are written as zeros.
+
+    """
+    packer = struct.Struct(fmt)
+    values = packer.unpack(bytes(packer.size))
+    header = struct.pack('>H', packer.size + 1) + message_type.encode('ascii')
+    args = []
+    for field, value in zip(fields, values):
+        if field is None and isinstance(value, bytes):
+            args.append(repr(b' ' * len(value)))
+        elif field is None:
+            args.append('0')
+        elif field == 'nano_hi':
+            args.append('(m.sec * 1000000000 + m.nano) >> 32')
+        elif field == 'nano' and 'nano_hi' in fields:
+            args.append('(m.sec * 1000000000 + m.nano) & 0xffffffff')
+        elif isinstance(value, bytes):
+            args.append("m.{}.encode('ascii').ljust({})".format(field, len(value)))
+        else:
+            args.append('m.{}'.format(field))
+    source = 'def encode(m):\n    return header + pack({})'.format(', '.join(args))
+    namespace = {'header': header, 'pack': packer.pack}
+    exec(source, namespace)
+    return namespace['encode']
+
+
+def get_encoders(version):
+    """Return the message encoders for an ITCH version, keyed by message type."""
+    if version not in ENCODERS:
+        try:
+            layouts = PROTOCOLS[version]
+        except KeyError:
+            raise ValueError('ITCH version ' + str(version) + ' is not supported')
+        ENCODERS[version] = {message_type: compile_encoder(message_type, fmt, fields)
+                             for message_type, (fmt, fields) in layouts.items()}
+    return ENCODERS[version]
+
+
+def encode_message(message, version):
+    """Return a Message as binary message data (including the size and type)."""
+    return get_encoders(version)[message.type](message)
+
+
+def _snapshot(sec, nano, bids, asks, nlevels):
+    """Return the expected `Book.to_array` row of a book."""
+    sorted_bids = sorted(bids.keys(), reverse=True)[:nlevels]
+    sorted_asks = sorted(asks.keys())[:nlevels]
+    values = [sec, nano]
+    values.extend(sorted_bids + [-1] * (nlevels - len(sorted_bids)))
+    values.extend(sorted_asks + [-1] * (nlevels - len(sorted_asks)))
+    values.extend([bids[p] for p in sorted_bids] + [0] * (nlevels - len(sorted_bids)))
+    values.extend([asks[p] for p in sorted_asks] + [0] * (nlevels - len(sorted_asks)))
+    return values
+
+
+def _apply(book, side, price, shares):
+    """Add shares (possibly negative) to a price level of a book."""
+    levels = book[side]
+    levels[price] = levels.get(price, 0) + shares
+    if levels[price] == 0:
+        levels.pop(price)
+
+
+class _Orders():
+    """Standing orders of a stock, supporting uniform random choice in O(1)."""
+
+    def __init__(self):
+        self.orders = {}  # refno -> [side, price, shares, index]
+        self.refnos = []
+
+    def __len__(self):
+        return len(self.refnos)
+
+    def add(self, refno, side, price, shares):
+        self.orders[refno] = [side, price, shares, len(self.refnos)]
+        self.refnos.append(refno)
+
+    def choice(self, rng):
+        return self.refnos[rng.randrange(len(self.refnos))]
+
+    def pop(self, refno):
+        order = self.orders.pop(refno)
+        last = self.refnos.pop()
+        if last != refno:
+            self.refnos[order[3]] = last
+            self.orders[last][3] = order[3]
+        return order
+
+
+def generate(fout, ver=4.1, ntickers=10, names=None, rate=1000, duration=60,
+             start=34200, mix=None, depth=10, seed=None, nlevels=None):
+    """Write a synthetic ITCH data file.
+
+    Messages are encoded with the same layouts that `protocol` decodes, and every order follows a consistent lifecycle: executions, cancels, deletes and replaces only reference standing orders, and never remove more shares than remain. The file starts with a start of messages system event and ends with an end of messages system event.
+
+    Parameters
+    ----------
+    fout : string
+        Location of the file to write
+    ver : float
+        ITCH version number
+    ntickers : int
+        Number of stocks (ignored if `names` is given)
+    names : list
+        Stock tickers (defaults to 'SYN000', 'SYN001', ...)
+    rate : int
+        Number of messages per second
+    duration : int
+        Number of seconds
+    start : int
+        Seconds of the first message
+    mix : dict
+        Keys are message types, values are relative frequencies (defaults to `DEFAULT_MIX`). Types that `ver` doesn't support are dropped.
+    depth : int
+        Number of price levels on each side of the book that orders are placed on
+    seed : int
+        Random seed
+    nlevels : int
+        If given, also compute the order books that `unpack` should reconstruct
+
+    Returns
+    -------
+    books : dict
+        If `nlevels` is given, keys are names and values are np.arrays with the expected `Book.to_array` rows. Otherwise None.
+
+    Examples
+    --------
+    Write one minute of data for three stocks::
+
+    >> books = pk.generate('S010113-v41.bin', ver=4.1, names=['A', 'B', 'C'], nlevels=5)
+
+    """
+
+    rng = random.Random(seed)
+    encoders = get_encoders(ver)
+    if names is None:
+        names = ['SYN{:03d}'.format(i) for i in range(ntickers)]
+    if mix is None:
+        mix = DEFAULT_MIX
+    types = [t for t in mix if t in encoders]
+    weights = [mix[t] for t in types]
+    mids = {name: rng.randint(100, 2000) * 100 for name in names}
+    orders = {name: _Orders() for name in names}
+    books = {name: {'B': {}, 'S': {}} for name in names}
+    expected = {name: [] for name in names} if nlevels is not None else None
+    refno = 1
+    matchno = 1
+    chunks = []
+
+    def record(name, sec, nano):
+        if expected is not None:
+            expected[name].append(_snapshot(sec, nano, books[name]['B'], books[name]['S'], nlevels))
+
+    with open(fout, 'wb') as data:
+        if 'T' in encoders:
+            chunks.append(encoders['T'](Message(type='T', sec=start, nano=0)))
+        chunks.append(encoders['S'](Message(type='S', sec=start, nano=0, event='O')))
+        for sec in range(start, start + duration):
+            if sec > start and 'T' in encoders:
+                chunks.append(encoders['T'](Message(type='T', sec=sec, nano=0)))
+            nanos = sorted(rng.randrange(1, 10 ** 9) for _ in range(rate))
+            for nano, message_type in zip(nanos, rng.choices(types, weights, k=rate)):
+                name = rng.choice(names)
+                live = orders[name]
+                if message_type in ('E', 'C', 'X', 'D', 'U') and len(live) == 0:
+                    message_type = 'A'
+                if message_type in ('A', 'F'):
+                    side = rng.choice('BS')
+                    if side == 'B':
+                        price = mids[name] - 100 * rng.randint(1, depth)
+                    else:
+                        price = mids[name] + 100 * rng.randint(1, depth)
+                    shares = 100 * rng.randint(1, 10)
+                    message = Message(type=message_type, sec=sec, nano=nano, name=name, buysell=side,
+                                      price=price, shares=shares, refno=refno,
+                                      mpid='SYNT' if message_type == 'F' else '.')
+                    live.add(refno, side, price, shares)
+                    refno += 1
+                    _apply(books[name], side, price, shares)
+                    record(name, sec, nano)
+                elif message_type in ('E', 'C', 'X'):
+                    ref = live.choice(rng)
+                    side, price, remaining, _ = live.orders[ref]
+                    shares = rng.randint(1, remaining)
+                    message = Message(type=message_type, sec=sec, nano=nano, price=price,
+                                      shares=shares, refno=ref)
+                    live.orders[ref][2] -= shares
+                    if live.orders[ref][2] == 0:
+                        live.pop(ref)
+                    _apply(books[name], side, price, -shares)
+                    record(name, sec, nano)
+                elif message_type == 'D':
+                    ref = live.choice(rng)
+                    side, price, remaining, _ = live.pop(ref)
+                    message = Message(type='D', sec=sec, nano=nano, refno=ref)
+                    _apply(books[name], side, price, -remaining)
+                    record(name, sec, nano)
+                elif message_type == 'U':
+                    ref = live.choice(rng)
+                    side, price, remaining, _ = live.pop(ref)
+                    new_price = min(max(price + 100 * rng.randint(-1, 1), mids[name] - 100 * depth),
+                                    mids[name] + 100 * depth)
+                    if side == 'B':
+                        new_price = min(new_price, mids[name] - 100)
+                    else:
+                        new_price = max(new_price, mids[name] + 100)
+                    shares = 100 * rng.randint(1, 10)
+                    message = Message(type='U', sec=sec, nano=nano, price=new_price, shares=shares,
+                                      refno=ref, newrefno=refno)
+                    live.add(refno, side, new_price, shares)
+                    refno += 1
+                    _apply(books[name], side, price, -remaining)
+                    record(name, sec, nano)
+                    _apply(books[name], side, new_price, shares)
+                    record(name, sec, nano)
+                elif message_type == 'P':
+                    message = Message(type='P', sec=sec, nano=nano, name=name, buysell=rng.choice('BS'),
+                                      price=mids[name], shares=100 * rng.randint(1, 5), refno=0)
+                elif message_type == 'Q':
+                    message = NOIIMessage(type='Q', sec=sec, nano=nano, name=name, price=mids[name],
+                                          shares=100 * rng.randint(1, 100), matchno=matchno,
+                                          cross=rng.choice('OC'))
+                    matchno += 1
+                elif message_type == 'I':
+                    message = NOIIMessage(type='I', sec=sec, nano=nano, name=name,
+                                          paired=100 * rng.randint(0, 100), imbalance=100 * rng.randint(0, 100),
+                                          direction=rng.choice('BSN'), far=mids[name], near=mids[name],
+                                          current=mids[name], cross=rng.choice('OC'))
+                else:
+                    continue
+                chunks.append(encoders[message_type](message))
+            if len(chunks) > 10 ** 5:
+                data.write(b''.join(chunks))
+                chunks = []
+        if 'T' in encoders:
+            chunks.append(encoders['T'](Message(type='T', sec=start + duration, nano=0)))
+        chunks.append(encoders['S'](Message(type='S', sec=start + duration, nano=0, event='C')))
+        data.write(b''.join(chunks))
+
+    if expected is None:
+        return None
+    width = 2 + 4 * nlevels
+    return {name: np.array(rows, dtype=int).reshape(-1, width) for name, rows in expected.items()}
@@ -0,0 +1,31 @@
+import pytest
+import prickle as pk
+
+NAMES = ['SYN000', 'SYN001', 'SYN002']
+DATE = '010113'
+NLEVELS = 5
+
+
+@pytest.fixture(scope='session')
+def itch(tmp_path_factory):
+    """A synthetic ITCH 4.1 file and the books `unpack` should reconstruct from it."""
+    path = str(tmp_path_factory.mktemp('itch') / 'S010113-v41.bin')
+    books = pk.generate(path, ver=4.1, names=NAMES, rate=500, duration=4, seed=1, nlevels=NLEVELS)
+    return path, books
+
+
+def read_hdf5(path):
+    """Return every dataset of an HDF5 file as {path: np.array}."""
+    import h5py
+    data = {}
+    with h5py.File(path, 'r') as f:
+        f.visititems(lambda key, item: data.__setitem__(key, item[:]) if isinstance(item, h5py.Dataset) else None)
+    return data
+
+
+def read_sqlite(path):
+    """Return the rows of every table of a SQLite database as {table: list}, by name and then in insertion order."""
+    import sqlite3
+    with sqlite3.connect(path) as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        return {table: conn.execute('SELECT * FROM {} ORDER BY name, rowid'.format(table)).fetchall() for table in tables}
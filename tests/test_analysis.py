@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS
+
+
+@pytest.fixture(scope='module')
+def csv(itch, tmp_path_factory):
+    fin, _ = itch
+    root = tmp_path_factory.mktemp('analysis')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='csv', fout=str(root), manifest=False)
+    return root
+
+
+def old_combine(messages, hidden, kind='quicksort'):
+    """`combine` before it merged on nanoseconds."""
+    messages = messages.drop(['index', 'sec', 'nano', 'name', 'refno', 'mpid'], axis=1)
+    hidden['type'] = 'H'
+    hidden = hidden.drop(['hit'], axis=1)
+    hidden = hidden.rename(columns={'vwap': 'price'})
+    combined = pd.concat([messages, hidden])
+    return combined.sort_values(by='time', axis=0, kind=kind)
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_combine_matches_old_combine(csv, name):
+    messages = pd.read_csv(str(csv / 'messages' / 'messages_{}.txt'.format(name)))
+    messages['time'] = messages['sec'] + messages['nano'] / 10 ** 9
+    messages = messages.reset_index()
+    hidden = pk.find_trades(messages, eps=0.01)
+    before = (messages.copy(), hidden.copy())
+    combined = pk.combine(messages, hidden, chunk_size=100)
+    pd.testing.assert_frame_equal(messages, before[0])
+    pd.testing.assert_frame_equal(hidden, before[1])
+
+    old = old_combine(messages, hidden.drop(columns='ns'))
+    stable = old_combine(messages, hidden.drop(columns='ns'), kind='stable')
+    assert len(combined) == len(old) > len(messages)
+    assert combined['time'].tolist() == old['time'].tolist()
+    assert combined['ns'].dtype == np.int64
+    assert (np.diff(combined['ns'].values) >= 0).all()
+    np.testing.assert_array_equal(combined['ns'].values, np.round(combined['time'].values * 10 ** 9).astype(np.int64))
+    pd.testing.assert_frame_equal(combined.drop(columns='ns'), stable)
+    assert combined.dtypes.drop('ns').to_dict() == old.dtypes.to_dict()
+    assert set(combined['type']) == set(messages['type']) | {'H'}
+
+
+def test_combine_empty(csv):
+    messages = pd.read_csv(str(csv / 'messages' / 'messages_SYN000.txt')).iloc[:0].reset_index()
+    messages['time'] = messages['sec'] + messages['nano'] / 10 ** 9
+    hidden = pk.find_trades(messages)
+    assert len(pk.combine(messages, hidden)) == 0
+
+
+def frame(ns, **columns):
+    return pd.DataFrame(dict(sec=np.asarray(ns) // 10 ** 9, nano=np.asarray(ns) % 10 ** 9, **columns))
+
+
+def test_ns_is_exact():
+    sec = np.array([0, 34200, 86399, 2 ** 31 - 1], dtype=np.int32)  # HDF5 stores int32, which overflows if multiplied
+    nano = np.array([0, 1, 999999999, 999999999], dtype=np.int32)
+    ns = pk.nanoseconds(sec, nano)
+    assert ns.dtype == np.int64
+    assert ns.tolist() == [int(s) * 10 ** 9 + int(n) for s, n in zip(sec, nano)]
+    assert int((sec[3] + nano[3] / 10 ** 9) * 10 ** 9) != ns[3]  # a 'time' column in seconds loses nanoseconds
+
+
+@pytest.fixture(scope='module')
+def hdf5(itch, tmp_path_factory):
+    fin, _ = itch
+    path = str(tmp_path_factory.mktemp('analysis') / 'db.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=path, bars=('volume', 500))
+    return path
+
+
+@pytest.mark.parametrize('grp', ['messages', 'books', 'trades', 'noii', 'bars'])
+def test_loaded_ns(hdf5, grp):
+    for name in NAMES:
+        data = pk.load_hdf5(hdf5, name, grp)
+        for df in data if isinstance(data, tuple) else (data,):
+            assert df['ns'].dtype == np.int64
+            expected = [int(s) * 10 ** 9 + int(n) for s, n in zip(df['sec'], df['nano'])]
+            assert df['ns'].tolist() == expected
+            if grp != 'noii':
+                assert len(df) > 0 and (np.diff(df['ns'].values) >= 0).all()
+
+
+@pytest.mark.parametrize('with_ns', [True, False])
+def test_unsorted_raises(with_ns):
+    df = frame([10 ** 9 + 5, 10 ** 9 + 3, 2 * 10 ** 9], x=[1, 2, 3])  # out of order within a second
+    if with_ns:
+        df['ns'] = pk.nanoseconds(df['sec'].values, df['nano'].values)
+    with pytest.raises(ValueError):
+        pk.between(df, 0, 3 * 10 ** 9)
+    with pytest.raises(ValueError):
+        pk.asof(df, 10 ** 9 + 4)
+    with pytest.raises(ValueError):
+        pk.resample(df, 10 ** 9)
+    if with_ns:
+        df['ns'] = [1, 2, 3]  # the 'ns' column is used when there is one
+        assert len(pk.between(df, 2, 3)) == 1
+
+
+def test_boundaries():
+    t = 34200 * 10 ** 9
+    df = frame([t, t + 10, t + 10, t + 20], x=[1, 2, 3, 4])
+    assert pk.between(df, t + 10, t + 20)['x'].tolist() == [2, 3]  # start inclusive (all equal times), stop exclusive
+    assert pk.between(df, t + 11, t + 20)['x'].tolist() == []
+    assert pk.between(df, t + 10)['x'].tolist() == [2, 3, 4]
+    assert pk.between(df, stop=t + 10)['x'].tolist() == [1]
+    assert pk.between(df)['x'].tolist() == [1, 2, 3, 4]
+    assert pk.asof(df, t - 1) is None
+    assert pk.asof(df, t)['x'] == 1  # a row at the time itself
+    assert pk.asof(df, t + 10)['x'] == 3  # the last of equal times
+    assert pk.asof(df, t + 19)['x'] == 3
+    assert pk.asof(df, t + 10 ** 9)['x'] == 4
+    rows = pk.asof(df, [t - 1, t + 10, t + 25])
+    assert rows.index.tolist() == [t - 1, t + 10, t + 25]
+    assert np.isnan(rows['x'].iloc[0]) and rows['x'].tolist()[1:] == [3, 4]
+    samples = pk.resample(df, 10)
+    assert samples.index.tolist() == [t, t + 10, t + 20]  # the last row's time is included
+    assert samples['x'].tolist() == [1, 3, 4]
+    samples = pk.resample(df, 10, start=t + 1, stop=t + 20)  # start is rounded up to a multiple of the interval
+    assert samples.index.tolist() == [t + 10]
+    samples = pk.resample(df, 8, start=t - 8, stop=t + 8)  # multiples of the interval since midnight
+    assert samples.index.tolist() == [t - 8, t] and np.isnan(samples['x'].iloc[0]) and samples['x'].iloc[1] == 1
+    assert len(pk.resample(df.iloc[:0], 10)) == 0
+
+
+def test_between_matches_mask(hdf5):
+    df = pk.load_hdf5(hdf5, NAMES[0], 'messages')
+    ns = df['ns'].values
+    start, stop = ns[len(ns) // 4], ns[len(ns) // 2]
+    pd.testing.assert_frame_equal(pk.between(df, start, stop), df[(ns >= start) & (ns < stop)])
+    times = np.linspace(ns[0] - 1, ns[-1] + 1, 50).astype(np.int64)
+    rows = pk.asof(df, times)
+    for time, (_, row) in zip(times, rows.iterrows()):
+        before = df[ns <= time]
+        if len(before) == 0:
+            assert row.isna().all()
+        else:
+            assert row['ns'] == before['ns'].iloc[-1] and row['refno'] == before['refno'].iloc[-1]
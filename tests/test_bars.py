@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from prickle.core import Bars
+from conftest import NAMES, DATE, NLEVELS
+
+SEC = 34200
+
+
+def book(sec, nano, bids, asks):
+    return SimpleNamespace(name='TEST', sec=sec, nano=nano, bids=bids, asks=asks)
+
+
+def rows(bars):
+    return [dict(zip(['sec', 'nano', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count', 'spread', 'biddepth',
+                      'askdepth'], bar)) for bar in bars.hist]
+
+
+def test_volume_threshold():
+    """The trade that reaches `size` shares completes the bar, and is not split between bars."""
+    bars = Bars('TEST', 'volume', 500)
+    bars.trade(SEC, 100, 10000, 400)
+    assert bars.hist == []
+    bars.trade(SEC, 200, 10100, 300)  # straddles the threshold
+    bars.trade(SEC, 300, 10200, 500)  # exactly reaches it
+    bars.trade(SEC, 400, 10300, 100)
+    bars.finish()
+    first, second, last = rows(bars)
+    assert (first['sec'], first['nano']) == (SEC, 100)
+    assert (first['volume'], first['count'], first['open'], first['close']) == (700, 2, 10000, 10100)
+    assert first['vwap'] == (10000 * 400 + 10100 * 300) / 700
+    assert (second['sec'], second['nano'], second['volume'], second['count']) == (SEC, 200, 500, 1)
+    assert (last['nano'], last['volume'], last['open']) == (300, 100, 10300)
+
+
+def test_tick_bars():
+    bars = Bars('TEST', 'tick', 2)
+    for i, price in enumerate([100, 300, 200, 400, 500]):
+        bars.trade(SEC, i, price, 100)
+    bars.finish()
+    assert [(b['open'], b['high'], b['low'], b['close'], b['count']) for b in rows(bars)] == \
+        [(100, 300, 100, 300, 2), (200, 400, 200, 400, 2), (500, 500, 500, 500, 1)]
+
+
+def test_empty_time_intervals():
+    bars = Bars('TEST', 'time', 1)
+    bars.update(book(SEC, 0, {9900: 300}, {10100: 200}))
+    bars.trade(SEC, 5 * 10 ** 8, 10100, 100)
+    bars.update(book(SEC, 5 * 10 ** 8, {9900: 300}, {10100: 100}))
+    bars.trade(SEC + 3, 5 * 10 ** 8, 10000, 200)
+    assert [b['sec'] for b in rows(bars)] == [SEC, SEC + 1, SEC + 2]
+    first, empty, also_empty = rows(bars)
+    assert (first['volume'], first['count'], first['vwap']) == (100, 1, 10100)
+    assert first['spread'] == 200
+    assert first['askdepth'] == (200 + 100) / 2
+    for bar in (empty, also_empty):
+        assert all(np.isnan(bar[key]) for key in ('open', 'high', 'low', 'close', 'vwap'))
+        assert (bar['nano'], bar['volume'], bar['count']) == (0, 0, 0)
+        assert (bar['spread'], bar['biddepth'], bar['askdepth']) == (200, 300, 100)  # the book carried forward
+
+
+def test_finish():
+    bars = Bars('TEST', 'time', 60)
+    bars.finish()
+    assert bars.hist == []
+    bars.update(book(SEC, 10, {9900: 300}, {}))
+    bars.trade(SEC + 1, 0, 9900, 100)
+    bars.finish()
+    partial, = rows(bars)
+    assert (partial['sec'], partial['nano'], partial['volume']) == (SEC, 0, 100)
+    assert np.isnan(partial['spread']) and partial['biddepth'] == 300
+    bars.finish()
+    assert len(bars.hist) == 1
+
+
+@pytest.mark.parametrize('bars', [('volume', 500), ('tick', 7), ('time', 1)])
+def test_unpack_bars(itch, tmp_path, bars):
+    """Every trade is counted in exactly one bar, including the last (partial) bar."""
+    fin, _ = itch
+    fout = str(tmp_path / 'csv')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, fout=fout, bars=bars)
+    for name in NAMES:
+        messages = pd.read_csv('{}/messages/messages_{}.txt'.format(fout, name))
+        executions = messages[messages.type.isin(['E', 'C'])]
+        trades = pd.read_csv('{}/trades/trades_{}.txt'.format(fout, name))
+        df = pd.read_csv('{}/bars/bars_{}.txt'.format(fout, name))
+        assert df.volume.sum() == trades.shares.sum() - executions.shares.sum()  # executions are negative
+        assert df['count'].sum() == len(trades) + len(executions)
+        assert (np.diff(df.sec * 10 ** 9 + df.nano) > 0).all()
+        if bars[0] == 'volume':
+            assert (df.volume.iloc[:-1] >= bars[1]).all() and df.volume.iloc[-1] > 0
+        elif bars[0] == 'tick':
+            assert (df['count'].iloc[:-1] == bars[1]).all() and 0 < df['count'].iloc[-1] <= bars[1]
+        else:
+            assert df.sec.tolist() == list(range(df.sec.iloc[0], df.sec.iloc[-1] + 1)) and (df.nano == 0).all()
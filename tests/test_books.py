@@ -0,0 +1,46 @@
+import h5py
+import numpy as np
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS
+
+KEYFRAMES = 37
+
+
+@pytest.fixture(scope='module')
+def dbs(itch, tmp_path_factory):
+    fin, _ = itch
+    root = tmp_path_factory.mktemp('books')
+    dense, deltas = str(root / 'dense.hdf5'), str(root / 'deltas.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=dense, manifest=False)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=deltas, manifest=False, keyframes=KEYFRAMES)
+    return dense, deltas
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_reader_matches_dense_books(dbs, name):
+    dense, deltas = dbs
+    with h5py.File(dense, 'r') as f:
+        books = f['orderbooks'][name][:]
+    with pk.BookReader(deltas, name) as reader:
+        assert len(reader) == len(books)
+        assert reader.nlevels == NLEVELS
+        np.testing.assert_array_equal(reader.to_array(), books)
+        np.testing.assert_array_equal(reader.to_array(nlevels=2)[:, :4], books[:, [0, 1, 2, 3]])
+
+        rng = np.random.default_rng(0)
+        boundaries = reader.keyindex[:, 0]
+        assert len(boundaries) >= 3
+        starts = np.concatenate([boundaries - 1, boundaries, boundaries + 1, rng.integers(0, len(books), 50)])
+        for start in starts:
+            stop = start + int(rng.integers(1, 3 * KEYFRAMES))
+            np.testing.assert_array_equal(reader.to_array(start, stop), books[start:stop])
+        assert reader.to_array(len(books), len(books) + 10).shape == (0, books.shape[1])
+
+        for row in rng.integers(0, len(books), 50):
+            bids, asks = reader.book(row)
+            top = sorted(bids, reverse=True)[:NLEVELS]
+            assert top == [p for p in books[row, 2:2 + NLEVELS] if p != -1]
+            assert [bids[p] for p in top] == [d for d in books[row, 2 + 2 * NLEVELS:2 + 3 * NLEVELS] if d != 0]
+            sec, nano = books[row, :2]
+            assert books[reader.row_at(sec, nano), 1] == nano
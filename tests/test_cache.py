@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import pytest
+import prickle as pk
+from prickle.cache import LoadCache
+from conftest import NAMES, DATE, NLEVELS
+
+SHM = '/dev/shm'
+pytestmark = pytest.mark.skipif(not os.path.isdir(SHM), reason='needs /dev/shm')
+
+
+@pytest.fixture(scope='module')
+def db(itch, tmp_path_factory):
+    fin, _ = itch
+    path = str(tmp_path_factory.mktemp('cache') / 'db.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=path)
+    return path
+
+
+@pytest.fixture
+def shared():
+    cache = pk.set_cache(shared=True)
+    yield cache
+    pk.set_cache()
+
+
+def segments(db):
+    """The shared memory segments of the datasets of a database that exist."""
+    names = {LoadCache._segment_name(LoadCache.key(db, 'messages', name)) for name in NAMES}
+    return names & set(os.listdir(SHM))
+
+
+def load(args):
+    db, name = args
+    cache = pk.get_cache()
+    hits, misses = cache.hits, cache.misses
+    df = pk.load_hdf5(db, name, 'messages', cache=True)
+    return cache.hits - hits, cache.misses - misses, len(df)
+
+
+def test_pool_attaches_to_parent_copies(db, shared):
+    sizes = [len(pk.load_hdf5(db, name, 'messages', cache=True)) for name in NAMES]
+    assert (shared.hits, shared.misses) == (0, len(NAMES))
+    assert len(segments(db)) == len(NAMES)
+    pool = multiprocessing.Pool(2, initializer=pk.set_cache, initargs=(2 ** 30, True))
+    results = pool.map(load, [(db, name) for name in NAMES] * 4, chunksize=1)
+    pool.close()
+    pool.join()
+    assert [n for _, _, n in results] == sizes * 4
+    assert sum(hits for hits, _, _ in results) == len(results)
+    assert sum(misses for _, misses, _ in results) == 0
+    assert len(segments(db)) == len(NAMES)  # still used by this process
+    shared.clear()
+    assert segments(db) == set()
+
+
+def test_pool_workers_remove_their_copies(db, shared):
+    pool = multiprocessing.Pool(2, initializer=pk.set_cache, initargs=(2 ** 30, True))
+    results = pool.map(load, [(db, name) for name in NAMES] * 4, chunksize=1)
+    pool.close()
+    pool.join()
+    assert sum(hits + misses for hits, misses, _ in results) == len(results)
+    assert len(NAMES) <= sum(misses for _, misses, _ in results) <= 2 * len(NAMES)  # at most once per worker
+    assert segments(db) == set()
+    df = pk.load_hdf5(db, NAMES[0], 'messages', cache=True)
+    assert (shared.hits, shared.misses) == (0, 1) and len(df) == results[0][2]
+
+
+SCRIPT = '''
+import sys
+import prickle as pk
+
+cache = pk.set_cache(shared=True)
+pk.load_hdf5(sys.argv[1], sys.argv[2], 'messages', cache=True)
+print(cache.hits, cache.misses)
+'''
+
+
+def test_other_process_leaves_copy(db, shared, tmp_path):
+    """A process that attaches to a copy and exits doesn't have its resource tracker remove the copy."""
+    pk.load_hdf5(db, NAMES[0], 'messages', cache=True)
+    script = tmp_path / 'script.py'
+    script.write_text(SCRIPT)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(pk.__file__))] + sys.path))
+    for _ in range(2):
+        result = subprocess.run([sys.executable, str(script), db, NAMES[0]], capture_output=True, text=True,
+                                env=env, timeout=120)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.split() == ['1', '0']
+        assert 'leaked' not in result.stderr, result.stderr
+        assert len(segments(db)) == 1
+    shared.clear()
+    assert segments(db) == set()
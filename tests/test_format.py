@@ -0,0 +1,63 @@
+import filecmp
+import os
+import numpy as np
+import prickle as pk
+import prickle.core as core
+from conftest import NAMES, DATE, NLEVELS
+
+
+def old_format_messages(messages):
+    return ''.join([message.to_txt() for message in messages])
+
+
+def old_format_books(name, array):
+    lines = []
+    for row in array.tolist():
+        book = pk.Book(DATE, name, NLEVELS)
+        book.sec, book.nano = row[0], row[1]
+        prices, depths = row[2:2 + 2 * NLEVELS], row[2 + 2 * NLEVELS:]
+        book.bids = {p: d for p, d in zip(prices[:NLEVELS], depths[:NLEVELS]) if p != -1}
+        book.asks = {p: d for p, d in zip(prices[NLEVELS:], depths[NLEVELS:]) if p != -1}
+        lines.append(book.to_txt())
+    return ''.join(lines)
+
+
+def test_csv_matches_row_by_row_writer(itch, tmp_path, monkeypatch):
+    fin, _ = itch
+    new, old = str(tmp_path / 'new'), str(tmp_path / 'old')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='csv', fout=new, manifest=False)
+    monkeypatch.setattr(core, 'format_messages', old_format_messages)
+    monkeypatch.setattr(core, 'format_books', old_format_books)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='csv', fout=old, manifest=False)
+    for grp in ('messages', 'books', 'trades', 'noii'):
+        files = sorted(os.listdir(os.path.join(old, grp)))
+        assert files == ['{}_{}.txt'.format(grp, name) for name in NAMES]
+        match, mismatch, errors = filecmp.cmpfiles(os.path.join(old, grp), os.path.join(new, grp), files, shallow=False)
+        assert mismatch == [] and errors == []
+    with open(os.path.join(new, 'messages', 'messages_SYN000.txt')) as f:
+        assert any(line.split(',')[3] == 'U' for line in f)
+
+
+def test_format_messages_edge_cases():
+    messages = [pk.Message(sec=34200, nano=1, name='X', type='A', refno=1, buysell='B', shares=100, price=-15000),
+                pk.Message(sec=34200, nano=2, name='X', type='U', refno=1, newrefno=2, shares=200, price=1234567),
+                pk.Message(sec=34200, nano=3, name='X', type='D', refno=2),  # price -1
+                pk.Message(sec=34200, nano=4, name='X', type='E', refno=3, shares=100, price=10 ** 9)]
+    assert core.format_messages(messages) == old_format_messages(messages)
+    trades = [pk.Message(sec=34201, nano=0, name='X', type='P', buysell='S', shares=100, price=p) for p in (-1, 0, 15000, 15000)]
+    assert core.format_messages(trades) == old_format_messages(trades)
+    noii = [pk.NOIIMessage(sec=34202, nano=0, name='X', type='Q', cross='O', shares=100, price=125000),
+            pk.NOIIMessage(sec=34202, nano=1, name='X', type='I', cross='C', paired=100, imbalance=0,
+                           direction='N', far=-1, near=125000, current=125100)]
+    assert core.format_messages(noii) == old_format_messages(noii)
+    mixed = [messages[0], trades[0], pk.Message(sec=34203, nano=0, type='S', event='C')]
+    assert core.format_messages(mixed) == old_format_messages(mixed)
+    assert core.format_messages([]) == ''
+
+
+def test_format_books_edge_cases():
+    rows = np.array([[34200, 1, 15000, -15000, -1, -1, -1, 16000, -1, -1, -1, -1, 100, 300, 0, 0, 0, 200, 0, 0, 0, 0],
+                     [34200, 2, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=np.int64)
+    assert core.format_books('X', rows) == old_format_books('X', rows)
+    assert core.format_books('X', np.zeros((0, 2 + 4 * NLEVELS), dtype=np.int64)) == ''
+    assert core.format_books('X', np.array([], dtype=np.int64)) == ''
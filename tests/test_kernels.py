@@ -0,0 +1,118 @@
+import importlib.util
+import sys
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from prickle import kernels as compiled
+from conftest import NAMES, DATE, NLEVELS
+
+
+def python_kernels(monkeypatch):
+    """Load a copy of `prickle.kernels` that runs as ordinary Python."""
+    spec = importlib.util.spec_from_file_location('prickle_kernels_python', compiled.__file__)
+    module = importlib.util.module_from_spec(spec)
+    with monkeypatch.context() as patch:
+        patch.setitem(sys.modules, 'numba', None)  # import numba raises ImportError
+        spec.loader.exec_module(module)
+    assert not module.NUMBA
+    return module
+
+
+@pytest.fixture(params=['python', 'numba'])
+def kernels(request, monkeypatch):
+    if request.param == 'numba':
+        pytest.importorskip('numba')
+        return compiled
+    return python_kernels(monkeypatch)
+
+
+@pytest.fixture(scope='module')
+def unpacked(itch, tmp_path_factory):
+    fin, _ = itch
+    root = tmp_path_factory.mktemp('kernels')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=str(root / 'db.hdf5'), manifest=False)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=str(root / 'kf.hdf5'), manifest=False, keyframes=50)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='csv', fout=str(root / 'csv'), manifest=False)
+    return root
+
+
+def old_find_trades(messages, eps):
+    """The row-by-row aggregation that `aggregate_trades` replaced."""
+    trades = []
+    i = 0
+    while i < len(messages):
+        time, side, shares, vwap = messages[i]
+        hit = 0
+        i += 1
+        if i == len(messages):
+            break
+        while messages[i][0] <= time + eps and messages[i][1] == side:
+            shares += messages[i][2]
+            if messages[i][3] != vwap:
+                hit = 1
+                vwap = messages[i][3] * messages[i][2] / shares + vwap * (shares - messages[i][2]) / shares
+            i += 1
+            if i == len(messages):
+                break
+        trades.append([time, side, shares, vwap, hit])
+    return trades
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_reconstruct_matches_unpack(kernels, unpacked, name):
+    with h5py.File(str(unpacked / 'db.hdf5'), 'r') as f:
+        messages, books = f['messages'][name][:], f['orderbooks'][name][:]
+    np.testing.assert_array_equal(kernels.reconstruct(messages, NLEVELS), books)
+    np.testing.assert_array_equal(kernels.reconstruct(messages, 2)[:, :2], books[:, :2])
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_replay_matches_unpack(kernels, unpacked, name):
+    with h5py.File(str(unpacked / 'db.hdf5'), 'r') as f:
+        books = f['orderbooks'][name][:]
+    with h5py.File(str(unpacked / 'kf.hdf5'), 'r') as f:
+        deltas = f['deltas'][name][:]
+    np.testing.assert_array_equal(kernels.replay(np.zeros((0, 3)), deltas, NLEVELS), books)
+    np.testing.assert_array_equal(kernels.replay(np.zeros((0, 3)), deltas, NLEVELS, skip=10), books[10:])
+
+
+@pytest.mark.parametrize('eps', [10 ** -6, 10 ** -2, 1.0])
+@pytest.mark.parametrize('name', NAMES)
+def test_aggregate_trades_matches_old_find_trades(kernels, unpacked, name, eps):
+    messages = pd.read_csv(str(unpacked / 'csv' / 'messages' / 'messages_{}.txt'.format(name)))
+    executions = messages[messages.type == 'E']
+    ns = executions.sec.values.astype(np.int64) * 10 ** 9 + executions.nano.values
+    sides = np.where(executions.side.values == 'B', 1, -1)
+    time, side, shares, vwap, hit = kernels.aggregate_trades(ns, sides, executions.shares.values,
+                                                             executions.price.values, int(round(eps * 10 ** 9)))
+    expected = old_find_trades(list(zip(ns.tolist(), sides.tolist(), executions.shares.tolist(), executions.price.tolist())),
+                               int(round(eps * 10 ** 9)))
+    assert len(expected) > 0
+    assert time.tolist() == [t[0] for t in expected]
+    assert side.tolist() == [t[1] for t in expected]
+    assert shares.tolist() == [t[2] for t in expected]
+    np.testing.assert_allclose(vwap, [t[3] for t in expected])
+    assert hit.tolist() == [t[4] for t in expected]
+    if eps == 1.0:
+        assert hit.sum() > 0
+
+    trades = pk.find_trades(messages, eps=eps)
+    assert trades.ns.tolist() == time.tolist()
+    assert trades.side.tolist() == ['B' if s == 1 else 'S' for s in side]
+    assert trades.shares.tolist() == shares.tolist()
+
+
+def test_numba_matches_python(unpacked, monkeypatch):
+    pytest.importorskip('numba')
+    assert compiled.NUMBA
+    python = python_kernels(monkeypatch)
+    with h5py.File(str(unpacked / 'db.hdf5'), 'r') as f:
+        messages = f['messages'][NAMES[0]][:]
+    np.testing.assert_array_equal(compiled.reconstruct(messages, NLEVELS), python.reconstruct(messages, NLEVELS))
+    executions = messages[messages[:, 2] == compiled.EXECUTE].astype(np.int64)
+    ns = executions[:, 0] * 10 ** 9 + executions[:, 1]
+    for a, b in zip(compiled.aggregate_trades(ns, executions[:, 3], executions[:, 5], executions[:, 4], 10 ** 7),
+                    python.aggregate_trades(ns, executions[:, 3], executions[:, 5], executions[:, 4], 10 ** 7)):
+        np.testing.assert_array_equal(a, b)
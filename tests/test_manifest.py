@@ -0,0 +1,71 @@
+import os
+import shutil
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS
+
+
+@pytest.fixture
+def fin(itch, tmp_path):
+    """A copy of the synthetic file that a test can modify."""
+    path = str(tmp_path / os.path.basename(itch[0]))
+    shutil.copy2(itch[0], path)
+    return path
+
+
+def run(fin, fout, names=NAMES, **kwargs):
+    kwargs.setdefault('manifest', True)
+    return pk.unpack(fin, 4.1, DATE, NLEVELS, names, method='hdf5', fout=fout, **kwargs)
+
+
+def test_rerun_is_skipped(fin, tmp_path, capsys):
+    fout = str(tmp_path / 'db.hdf5')
+    stats = run(fin, fout, NAMES[:2])
+    assert stats.reads > 0
+    entries = pk.load_manifest(fout + '.manifest.json')
+    assert sorted(entries[DATE]) == NAMES[:2]
+    assert entries[DATE][NAMES[0]]['options']['nlevels'] == NLEVELS
+    capsys.readouterr()
+
+    assert run(fin, fout, NAMES[:2]).reads == 0
+    assert 'Skipping completed names: {}'.format(', '.join(NAMES[:2])) in capsys.readouterr().out
+
+    run(fin, fout)  # only the missing name is processed
+    assert 'Skipping completed names: {}'.format(', '.join(NAMES[:2])) in capsys.readouterr().out
+    assert sorted(pk.load_manifest(fout + '.manifest.json')[DATE]) == NAMES
+    for name in NAMES:
+        assert len(pk.load_hdf5(fout, name, 'messages')) > 0
+
+
+@pytest.mark.parametrize('options', [{'nlevels': NLEVELS + 1}, {'bars': ('volume', 500)}, {'lifecycles': True}])
+def test_changed_options_are_rerun(fin, tmp_path, options):
+    fout = str(tmp_path / 'db.hdf5')
+    run(fin, fout)
+    nlevels = options.pop('nlevels', NLEVELS)
+    assert pk.unpack(fin, 4.1, DATE, nlevels, NAMES, method='hdf5', fout=fout, manifest=True, **options).reads > 0
+    assert pk.unpack(fin, 4.1, DATE, nlevels, NAMES, method='hdf5', fout=fout, manifest=True, **options).reads == 0
+    assert run(fin, fout).reads > 0
+
+
+def test_changed_input_is_rerun(fin, tmp_path):
+    fout = str(tmp_path / 'db.hdf5')
+    run(fin, fout)
+    assert run(fin, fout).reads == 0
+    with open(fin, 'ab') as f:  # a different size
+        f.write(pk.encode_message(pk.Message(type='T', sec=40000), 4.1))
+    assert run(fin, fout).reads > 0
+    assert run(fin, fout).reads == 0
+    info = os.stat(fin)
+    os.utime(fin, ns=(info.st_atime_ns, info.st_mtime_ns + 10 ** 9))  # a different modification time
+    assert run(fin, fout).reads > 0
+
+
+def test_manifest_is_opt_in(fin, tmp_path, monkeypatch):
+    fout = str(tmp_path / 'db.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=fout)
+    assert not os.path.exists(fout + '.manifest.json')
+    assert pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=fout).reads > 0
+    monkeypatch.chdir(tmp_path)
+    assert pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES).reads > 0  # fout=None
+    with pytest.raises(ValueError):
+        pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, manifest=True)
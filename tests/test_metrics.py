@@ -0,0 +1,66 @@
+import json
+import time
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS
+
+KEYS = {'elapsed', 'reads', 'counts', 'rates', 'times', 'rows', 'bytes', 'buffers', 'peak_rss'}
+STAGES = {'read', 'decode', 'update', 'snapshot', 'write', 'callback', 'profile'}
+
+
+@pytest.fixture(scope='module')
+def longer(tmp_path_factory):
+    """A file with enough messages for several lines of metrics (written at most every 4096 messages of a type)."""
+    fin = str(tmp_path_factory.mktemp('metrics') / 'S010113-v41.bin')
+    pk.generate(fin, ver=4.1, names=NAMES, rate=5000, duration=5, seed=4, nlevels=NLEVELS)
+    return fin
+
+
+def test_metrics_lines(longer, tmp_path):
+    fin = longer
+    path = str(tmp_path / 'metrics.jsonl')
+    stats = pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=str(tmp_path / 'db.hdf5'), metrics=path,
+                      metrics_interval=0)
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) > 2
+    for line in lines:
+        assert set(line) == KEYS
+        assert set(line['times']) == STAGES and all(v >= 0 for v in line['times'].values())
+        assert set(line['rates']) == set(line['counts'])
+        assert line['peak_rss'] is None or line['peak_rss'] > 0
+    for before, after in zip(lines, lines[1:]):
+        assert after['elapsed'] >= before['elapsed'] and after['reads'] >= before['reads']
+        for key in ('counts', 'rows', 'bytes'):
+            assert set(after[key]) >= set(before[key])
+            assert all(after[key][k] >= v for k, v in before[key].items()), key
+        assert all(after['times'][k] >= v - 1e-9 for k, v in before['times'].items() if k != 'read')
+    assert lines[-1] == json.loads(json.dumps(stats.to_dict()))
+    assert lines[-1]['reads'] == sum(lines[-1]['counts'].values())
+    assert lines[-1]['rows']['messages'] > 0 and lines[-1]['bytes']['books'] > 0
+
+
+def test_callback_time(itch, tmp_path):
+    fin, _ = itch
+    calls = []
+
+    def on_message(message, booklist):
+        if len(calls) < 100:
+            time.sleep(0.005)
+        calls.append(message.type)
+
+    stats = pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=str(tmp_path / 'db.hdf5'),
+                      on_message=on_message)
+    assert calls[-1] == 'S' and len(calls) == stats.reads
+    assert stats.times['callback'] >= 0.5
+    assert stats.times['read'] < 0.5  # not counted as reading
+    assert stats.times['profile'] == 0
+
+
+def test_profile_time(itch, tmp_path):
+    fin, _ = itch
+    fout = str(tmp_path / 'db.hdf5')
+    stats = pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=fout, profile=(100, 200))
+    assert stats.times['profile'] > 0 and stats.times['callback'] == 0
+    with open(fout + '.profile.txt') as f:
+        assert f.readline() == 'Messages 100 to 200\n'
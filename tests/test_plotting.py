@@ -0,0 +1,63 @@
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from prickle import plotting
+from conftest import NAMES, DATE, NLEVELS
+
+EDGES = np.arange(0, 1100, 100)
+
+
+@pytest.fixture(scope='module')
+def unpacked(itch, tmp_path_factory):
+    fin, _ = itch
+    root = tmp_path_factory.mktemp('plotting')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=str(root / 'db.hdf5'), manifest=False)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='csv', fout=str(root / 'csv'), manifest=False)
+    return root
+
+
+def histograms(monkeypatch, *args, **kwargs):
+    """Return the (sells, buys) counts that `plot_trades` draws."""
+    drawn = []
+    monkeypatch.setattr(plotting.plt, 'stairs', lambda values, edges, **kw: drawn.append(np.array(values)))
+    monkeypatch.setattr(plotting.plt, 'show', lambda: None)
+    plotting.plot_trades(*args, **kwargs)
+    sells, buys = drawn
+    return sells[::-1].tolist(), buys.tolist()
+
+
+def expected(side, shares):
+    side, shares = np.asarray(side), np.asarray(shares)
+    return np.histogram(shares[side == 'B'], EDGES)[0].tolist(), np.histogram(shares[side == 'S'], EDGES)[0].tolist()
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_trades_group(unpacked, monkeypatch, name):
+    csv = pd.read_csv(str(unpacked / 'csv' / 'trades' / 'trades_{}.txt'.format(name)))
+    sells, buys = expected(csv.side, csv.shares)
+    assert sum(sells) > 0 and sum(buys) > 0
+    db = str(unpacked / 'db.hdf5')
+    assert histograms(monkeypatch, db, name) == (sells, buys)
+    assert histograms(monkeypatch, pk.load_hdf5(db, name, 'trades')) == (sells, buys)
+    assert histograms(monkeypatch, csv) == (sells, buys)
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_messages_group(unpacked, monkeypatch, name):
+    csv = pd.read_csv(str(unpacked / 'csv' / 'messages' / 'messages_{}.txt'.format(name)))
+    messages = pk.load_hdf5(str(unpacked / 'db.hdf5'), name, 'messages')
+    trades = pk.find_trades(csv)
+    found = pk.find_trades(messages)
+    assert found.side.tolist() == trades.side.tolist()
+    assert found.shares.tolist() == (-trades.shares).tolist()  # executions in CSV files are negative
+    sells, buys = expected(found.side, found.shares)
+    assert sum(sells) > 0 and sum(buys) > 0
+    assert histograms(monkeypatch, trades) == (sells, buys)
+    assert histograms(monkeypatch, found) == (sells, buys)
+
+    executions = csv[csv.type == 'E']
+    sells, buys = expected(executions.side, -executions.shares)
+    assert histograms(monkeypatch, messages[messages.type == pk.kernels.EXECUTE], bid=1) == (sells, buys)
@@ -0,0 +1,77 @@
+import struct
+import pytest
+import prickle as pk
+from prickle.core import PROTOCOLS, get_decoders, Message, NOIIMessage
+
+CLOCK = 34200
+LAYOUTS = [(version, message_type) for version in sorted(PROTOCOLS) for message_type in sorted(PROTOCOLS[version])]
+
+
+def sample(version, message_type, sec, nano):
+    """Return a message with a distinct value in every field of a layout."""
+    fmt, fields = PROTOCOLS[version][message_type]
+    values = struct.unpack(fmt, bytes(struct.calcsize(fmt)))
+    message = NOIIMessage(type=message_type) if message_type in ('Q', 'I') else Message(type=message_type)
+    message.sec, message.nano = sec, nano
+    for i, (field, value) in enumerate(zip(fields, values)):
+        if field in (None, 'nano', 'nano_hi', 'sec'):
+            continue
+        elif isinstance(value, bytes):
+            setattr(message, field, 'ABCDEFGH'[i % 4:i % 4 + len(value)] if len(value) > 1 else 'BSYNC'[i % 5])
+        else:
+            setattr(message, field, 1000 * i + 7)
+    return message
+
+
+def decode(message, version, clock=CLOCK):
+    data = pk.encode_message(message, version)
+    assert struct.unpack('>H', data[:2])[0] == len(data) - 2
+    assert data[2:3].decode('ascii') == message.type
+    return get_decoders(version)[message.type](data[3:], clock)
+
+
+def fields(message):
+    return {slot: getattr(message, slot) for slot in type(message).__slots__ if slot != 'date'}
+
+
+@pytest.mark.parametrize('version, message_type', LAYOUTS)
+def test_round_trip(version, message_type):
+    if message_type == 'T':
+        message = Message(type='T', sec=CLOCK + 1)
+        assert decode(message, version).sec == CLOCK + 1
+        return
+    if version == 5.0:
+        sec, nano = 57599, 999999999  # the timestamp needs all 48 bits
+    else:
+        sec, nano = CLOCK, 123456789
+    message = sample(version, message_type, sec, nano)
+    decoded = decode(message, version)
+    assert type(decoded) is type(message)
+    assert fields(decoded) == fields(message)
+
+
+def test_version_50_timestamp():
+    """ITCH 5.0 timestamps are six byte integers: nanoseconds since midnight."""
+    ns = 57599 * 10 ** 9 + 999999999
+    assert ns >> 32 > 0
+    data = struct.pack('>HHHIQ', 1, 2, ns >> 32, ns & 0xffffffff, 42)
+    message = get_decoders(5.0)['D'](data, 0)
+    assert (message.sec, message.nano, message.refno) == (57599, 999999999, 42)
+    message = get_decoders(5.0)['D'](struct.pack('>HHHIQ', 0, 0, 0, 5, 42), CLOCK)
+    assert (message.sec, message.nano) == (0, 5)  # time messages (the clock) are not used
+
+
+@pytest.mark.parametrize('version', sorted(PROTOCOLS))
+def test_cross_trades(version):
+    message = NOIIMessage(type='Q', sec=CLOCK, nano=1, shares=500, name='AAPL', price=1234500, matchno=99, cross='O')
+    decoded = decode(message, version)
+    assert (decoded.matchno, decoded.cross) == (99, 'O')
+    assert (decoded.name, decoded.price, decoded.shares) == ('AAPL', 1234500, 500)
+
+
+def test_supported_types():
+    assert set(PROTOCOLS[4.0]) == {'T', 'S', 'H', 'A', 'F', 'E', 'C', 'X', 'D', 'U', 'Q'}
+    assert set(PROTOCOLS[4.1]) == {'T', 'S', 'H', 'A', 'F', 'E', 'C', 'X', 'D', 'U', 'P', 'Q', 'I'}
+    assert set(PROTOCOLS[5.0]) == {'S', 'R', 'H', 'Y', 'L', 'A', 'F', 'E', 'C', 'X', 'D', 'U', 'P', 'Q', 'I'}
+    with pytest.raises(ValueError):
+        get_decoders(3.0)
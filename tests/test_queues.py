@@ -0,0 +1,91 @@
+import pytest
+import prickle as pk
+from prickle.core import Message
+from conftest import NAMES, DATE, NLEVELS
+
+NAME = 'TEST'
+BID, BID2 = 1000000, 999900
+
+
+def messages():
+    """Order messages for one stock, and the queue at `BID` after each of them."""
+    return [(Message(type='A', refno=1, buysell='B', shares=100, price=BID, name=NAME), [(1, 100)]),
+            (Message(type='A', refno=2, buysell='B', shares=200, price=BID, name=NAME), [(1, 100), (2, 200)]),
+            (Message(type='F', refno=3, buysell='B', shares=300, price=BID, name=NAME, mpid='SYNT'),
+             [(1, 100), (2, 200), (3, 300)]),
+            (Message(type='A', refno=4, buysell='B', shares=100, price=BID2, name=NAME), [(1, 100), (2, 200), (3, 300)]),
+            (Message(type='E', refno=1, shares=40), [(1, 60), (2, 200), (3, 300)]),  # partial execution at the head
+            (Message(type='X', refno=2, shares=50), [(1, 60), (2, 150), (3, 300)]),
+            (Message(type='U', refno=1, newrefno=5, shares=100, price=BID), [(2, 150), (3, 300), (5, 100)]),
+            (Message(type='C', refno=2, shares=150, price=BID + 100), [(3, 300), (5, 100)]),
+            (Message(type='U', refno=4, newrefno=6, shares=100, price=BID), [(3, 300), (5, 100), (6, 100)]),
+            (Message(type='D', refno=3), [(5, 100), (6, 100)]),
+            (Message(type='E', refno=5, shares=100), [(6, 100)]),
+            (Message(type='D', refno=6), [])]
+
+
+@pytest.fixture
+def fin(tmp_path):
+    path = str(tmp_path / 'S010113-v41.bin')
+    chunks = [pk.encode_message(Message(type='T', sec=34200), 4.1),
+              pk.encode_message(Message(type='S', nano=0, event='O'), 4.1)]
+    for nano, (message, _) in enumerate(messages()):
+        message.nano = nano + 1
+        chunks.append(pk.encode_message(message, 4.1))
+    chunks.append(pk.encode_message(Message(type='S', nano=10 ** 8, event='C'), 4.1))
+    with open(path, 'wb') as f:
+        f.write(b''.join(chunks))
+    return path
+
+
+def test_queue_order(fin, tmp_path):
+    queues = []
+    positions = []
+
+    def on_message(message, booklist):
+        if message.type not in ('S', 'T'):
+            queues.append(booklist.queues.queue(NAME, 'B', BID))
+            positions.append({refno: booklist.queues.position(refno) for refno, _ in queues[-1]})
+            assert booklist.queues.depth(NAME, 'B', BID) == (len(queues[-1]), sum(shares for _, shares in queues[-1]))
+
+    pk.unpack(fin, 4.1, DATE, NLEVELS, [NAME], fout=str(tmp_path / 'csv'), queues=True, on_message=on_message)
+    assert queues == [queue for _, queue in messages()]
+    assert positions[2] == {1: (0, 0), 2: (1, 100), 3: (2, 300)}
+    assert positions[4] == {1: (0, 0), 2: (1, 60), 3: (2, 260)}
+    assert positions[6] == {2: (0, 0), 3: (1, 150), 5: (2, 450)}
+    assert positions[-1] == {}
+
+
+def test_replaced_order_leaves_its_level(fin, tmp_path):
+    levels = []
+
+    def on_message(message, booklist):
+        if message.type == 'U':
+            levels.append((booklist.queues.queue(NAME, 'B', BID2), booklist.queues.position(message.refno),
+                           booklist.queues.position(message.newrefno)))
+
+    pk.unpack(fin, 4.1, DATE, NLEVELS, [NAME], fout=str(tmp_path / 'csv'), queues=True, on_message=on_message)
+    assert levels[0] == ([(4, 100)], None, (2, 450))
+    assert levels[1] == ([], None, (2, 400))
+
+
+def test_queues_match_book(itch, tmp_path):
+    checked = []
+
+    def on_message(message, booklist):
+        if message.type in ('A', 'F', 'E', 'C', 'X', 'D', 'U') and message.name in NAMES:
+            book = booklist.books[message.name]['cur']
+            depth = {(side, price): shares for (name, side, price), (_, _, _, shares) in booklist.queues.levels.items()
+                     if name == message.name}
+            expected = {('B', price): shares for price, shares in book.bids.items() if shares != 0}
+            expected.update({('S', price): shares for price, shares in book.asks.items() if shares != 0})
+            assert depth == expected
+            for (side, price), shares in depth.items():
+                queue = booklist.queues.queue(message.name, side, price)
+                assert sum(s for _, s in queue) == shares and all(s > 0 for _, s in queue)
+                assert [booklist.queues.position(refno)[0] for refno, _ in queue] == list(range(len(queue)))
+            checked.append(message.type)
+
+    fin, _ = itch
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, fout=str(tmp_path / 'csv'), queues=True, on_message=on_message)
+    assert set(checked) >= {'A', 'F', 'E', 'C', 'X', 'D', 'U'}
@@ -0,0 +1,107 @@
+import struct
+import pytest
+import prickle as pk
+from prickle.core import scan, ParallelReader, Reader
+from conftest import NAMES, DATE
+
+KEEP = ('S', 'T', 'H', 'A', 'F', 'P', 'Q', 'I', 'E', 'C', 'X', 'D', 'U')
+
+
+def fields(message):
+    return tuple(getattr(message, slot) for slot in type(message).__slots__ if slot != 'date')
+
+
+def track(messages, names, orders):
+    """Yield the messages that unpack would process, recording the orders of `names` in `orders`."""
+    for message_type, message in messages:
+        if message_type in ('A', 'F') and message.name in names:
+            orders[message.refno] = None
+        if message_type == 'U' and message.refno in orders:
+            orders[message.newrefno] = None
+        yield message_type, message
+
+
+def expected(fin, names, reader=None):
+    """The messages of `Reader` that `ParallelReader` keeps."""
+    orders = {}
+    rows = []
+    for message_type, message in track(reader or Reader(fin, 4.1, DATE), names, orders):
+        if message_type not in KEEP:
+            continue
+        if message_type in ('H', 'A', 'F', 'P', 'Q', 'I') and message.name not in names:
+            continue
+        if message_type in ('E', 'C', 'X', 'D', 'U') and message.refno not in orders:
+            continue
+        rows.append((message_type, fields(message)))
+        if message_type == 'S' and message.event == 'C':
+            break
+    return rows
+
+
+def parallel(fin, names, chunk_size, offset=0, clock=0, reads=0):
+    orders = {}
+    reader = ParallelReader(fin, 4.1, DATE, names, orders, 2, chunk_size)
+    reader.offset, reader.clock, reader.reads = offset, clock, reads
+    rows = [(message_type, fields(message)) for message_type, message in track(reader, names, orders)]
+    return rows, reader
+
+
+def message_starts(fin):
+    with open(fin, 'rb') as f:
+        data = f.read()
+    starts = []
+    pos = 0
+    while pos < len(data):
+        starts.append(pos)
+        pos += struct.unpack_from('>H', data, pos)[0] + 2
+    return starts, len(data)
+
+
+@pytest.mark.parametrize('chunk_size', [1001, 2 ** 12, 2 ** 26])
+def test_scan_boundaries(itch, chunk_size):
+    fin, _ = itch
+    starts, size = message_starts(fin)
+    boundaries = scan(fin, chunk_size)
+    offsets = [offset for offset, clock in boundaries]
+    assert offsets[0] == 0 and offsets[-1] == size
+    assert set(offsets[:-1]) <= set(starts)
+    assert all(b - a >= chunk_size for a, b in zip(offsets[:-2], offsets[1:-1]))
+    if chunk_size < size:
+        assert len(boundaries) > 2
+    for offset, clock in boundaries[1:-1]:
+        reader = Reader(fin, 4.1, DATE)
+        times = [m.sec for t, m in reader if t == 'T' and reader.offset <= offset]
+        assert clock == times[-1]
+    middle = boundaries[len(boundaries) // 2]
+    assert scan(fin, chunk_size, *middle)[0] == middle
+    assert scan(fin, chunk_size, *middle)[-1] == boundaries[-1]
+
+
+@pytest.mark.parametrize('names', [NAMES, NAMES[1:2]])
+@pytest.mark.parametrize('chunk_size', [1001, 2 ** 26])
+def test_parallel_reader_matches_reader(itch, names, chunk_size):
+    fin, _ = itch
+    rows, reader = parallel(fin, names, chunk_size)
+    assert rows == expected(fin, names)
+    serial = Reader(fin, 4.1, DATE)
+    list(serial)
+    assert (reader.reads, reader.offset, reader.clock) == (serial.reads, serial.offset, serial.clock)
+    assert {message_type for message_type, _ in rows} >= {'S', 'T', 'A', 'E', 'U', 'P', 'Q', 'I'}
+    assert {fields[0] for message_type, fields in rows if message_type in ('A', 'F')} == set(names)
+
+
+def test_parallel_reader_resumes_at_offset(itch, monkeypatch):
+    fin, _ = itch
+    serial = Reader(fin, 4.1, DATE)
+    for n, (message_type, message) in enumerate(serial):
+        if n == 1234:
+            break
+    offset, clock, reads = serial.offset, serial.clock, serial.reads
+    scanned = []
+    monkeypatch.setattr(pk.core, 'scan', lambda *args: scanned.append(args) or scan(*args))
+    rows, reader = parallel(fin, NAMES, 1001, offset, clock, reads)
+    assert scanned[0][2:] == (offset, clock)
+    rest = Reader(fin, 4.1, DATE)
+    rest.offset, rest.clock, rest.reads = offset, clock, reads
+    assert rows == expected(fin, NAMES, rest)
+    assert reader.reads == rest.reads
@@ -0,0 +1,130 @@
+import filecmp
+import os
+import pytest
+import prickle as pk
+import numpy as np
+from conftest import NAMES, DATE, NLEVELS, read_hdf5, read_sqlite
+
+
+class Interrupt(Exception):
+    pass
+
+
+def interrupt_after(n):
+    """Return an `on_message` callback that stops a job after `n` messages."""
+    count = [0]
+
+    def on_message(message, booklist):
+        count[0] += 1
+        if count[0] == n:
+            raise Interrupt()
+
+    return on_message
+
+
+def resume(fin, fout, n, checkpoint, **kwargs):
+    """Interrupt a job after `n` messages, then resume it from its last checkpoint."""
+    with pytest.raises(Interrupt):
+        pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, fout=fout, checkpoint=checkpoint, manifest=False,
+                  on_message=interrupt_after(n), **kwargs)
+    assert os.path.exists('{}.checkpoint'.format(fout.rstrip('/')))
+    stats = pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, fout=fout, checkpoint=checkpoint, resume=True,
+                      manifest=False, **kwargs)
+    assert not os.path.exists('{}.checkpoint'.format(fout.rstrip('/')))
+    return stats
+
+
+def same_csv(a, b):
+    for grp in sorted(os.listdir(a)):
+        if os.path.isdir(os.path.join(a, grp)):
+            files = sorted(os.listdir(os.path.join(a, grp)))
+            match, mismatch, errors = filecmp.cmpfiles(os.path.join(a, grp), os.path.join(b, grp), files, shallow=False)
+            assert mismatch == [] and errors == [], grp
+    assert filecmp.cmp(os.path.join(a, 'system.log'), os.path.join(b, 'system.log'), shallow=False)
+
+
+@pytest.fixture(scope='module')
+def unterminated(itch, tmp_path_factory):
+    """The synthetic file without its end of messages event, so that a job stops at the end of the file."""
+    fin, _ = itch
+    end = pk.encode_message(pk.Message(type='S', sec=0, nano=0, event='C'), 4.1)
+    with open(fin, 'rb') as f:
+        data = f.read()
+    assert data[-len(end):][:3] == end[:3] and data.endswith(b'C')
+    path = str(tmp_path_factory.mktemp('unterminated') / 'S010113-v41.bin')
+    with open(path, 'wb') as f:
+        f.write(data[:-len(end)])
+    return path
+
+
+def test_lifecycles_resume(unterminated, tmp_path):
+    fin = unterminated
+    full, resumed, eof = str(tmp_path / 'full'), str(tmp_path / 'resumed'), str(tmp_path / 'eof')
+    stats = pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, fout=full, manifest=False, lifecycles=True)
+    resume(fin, resumed, 777, 100, lifecycles=True)
+    same_csv(full, resumed)
+    resume(fin, eof, stats.reads, 1, lifecycles=True)  # the last checkpoint is at the end of the file
+    same_csv(full, eof)
+    with open(os.path.join(full, 'orders', 'orders_SYN000.txt')) as f:
+        assert len(f.readlines()) > 1
+
+
+OUTPUTS = {'csv': 'csv', 'hdf5': 'db.hdf5', 'sqlite': 'db.sqlite'}
+
+
+def same_output(method, a, b):
+    if method == 'csv':
+        same_csv(a, b)
+    elif method == 'hdf5':
+        x, y = read_hdf5(a), read_hdf5(b)
+        assert sorted(x) == sorted(y)
+        for key in x:
+            np.testing.assert_array_equal(x[key], y[key], err_msg=key)
+    elif method == 'sqlite':
+        assert read_sqlite(a) == read_sqlite(b)
+
+
+@pytest.mark.parametrize('options', [{}, {'bars': ('volume', 500), 'lifecycles': True, 'queues': True},
+                                     {'bars': ('time', 1), 'nworkers': 2, 'chunk_size': 4096}])
+@pytest.mark.parametrize('method', ['csv', 'hdf5', 'sqlite'])
+def test_resume_matches_uninterrupted_run(itch, tmp_path, method, options):
+    fin, _ = itch
+    full = str(tmp_path / 'full')
+    os.makedirs(full)
+    full = os.path.join(full, OUTPUTS[method])
+    stats = pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method=method, fout=full, manifest=False, **options)
+    for n, checkpoint in ((1, 1), (777, 100), (stats.reads - 5, 500)):
+        resumed = str(tmp_path / 'resumed{}'.format(n))
+        os.makedirs(resumed)
+        resumed = os.path.join(resumed, OUTPUTS[method])
+        again = resume(fin, resumed, n, checkpoint, method=method, **options)
+        same_output(method, full, resumed)
+        assert again.reads == stats.reads
+        assert again.counts == stats.counts
+
+
+@pytest.mark.parametrize('n', [60, 777, 1999])
+def test_resume_keyframes(itch, tmp_path, n):
+    fin, _ = itch
+    full, resumed = str(tmp_path / 'full.hdf5'), str(tmp_path / 'resumed.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=full, manifest=False, keyframes=20)
+    resume(fin, resumed, n, 50, method='hdf5', keyframes=20)
+    same_output('hdf5', full, resumed)
+
+
+@pytest.mark.parametrize('method', ['hdf5', 'sqlite'])
+def test_interrupt_releases_output(itch, tmp_path, method):
+    fin, _ = itch
+    fout = str(tmp_path / OUTPUTS[method])
+    with pytest.raises(Interrupt) as info:
+        pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method=method, fout=fout, checkpoint=100, manifest=False,
+                  nworkers=2, chunk_size=4096, on_message=interrupt_after(500))
+    if method == 'hdf5':
+        import h5py
+        with h5py.File(fout, 'r+'):  # while the traceback (and the job's frame) is still alive
+            pass
+    else:
+        import sqlite3
+        with sqlite3.connect(fout) as conn:
+            conn.execute('BEGIN EXCLUSIVE')
+    assert info.value is not None
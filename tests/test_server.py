@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+import pytest
+import prickle as pk
+from prickle.server import ReplayServer, subscribe, itch_events, hdf5_events
+from conftest import NAMES, DATE, NLEVELS
+
+
+def events(n):
+    """Return `n` (time, event) pairs one microsecond apart."""
+    return [(34200 * 10 ** 9 + i * 1000, {'type': 'A', 'name': 'TEST', 'refno': i, 'pad': 'x' * 200}) for i in range(n)]
+
+
+def replay(server, *clients):
+    """Run `server` with subscribers `clients` (coroutine functions of the server address) and return their results."""
+
+    async def main():
+        task = asyncio.ensure_future(server.serve())
+        while server.address is None:
+            await asyncio.sleep(0.01)
+        results = await asyncio.gather(*[client(server.address) for client in clients])
+        await asyncio.wait_for(task, timeout=60)
+        return results
+
+    return asyncio.run(main())
+
+
+async def receive(address):
+    return [event async for event in subscribe(*address)]
+
+
+@pytest.fixture(scope='module')
+def db(itch, tmp_path_factory):
+    fin, _ = itch
+    path = str(tmp_path_factory.mktemp('server') / 'db.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=path)
+    return path
+
+
+@pytest.mark.parametrize('source', ['itch', 'hdf5'])
+def test_full_replay(itch, db, source):
+    fin, _ = itch
+    expected = list(itch_events(fin, 4.1, DATE, NAMES) if source == 'itch' else hdf5_events(db, NAMES))
+    assert len(expected) > 1000 and {event['type'] for _, event in expected} >= {'A', 'E', 'D', 'U', 'P', 'bbo'}
+    assert [ns for ns, _ in expected] == sorted(ns for ns, _ in expected)
+    server = ReplayServer(iter(expected), speed=None, subscribers=2, max_batch=100)
+    first, second = replay(server, receive, receive)
+    assert first == second == [event for _, event in expected]
+    assert server.events == len(expected)
+    assert all(subscriber.sent == len(expected) and subscriber.dropped == 0 for subscriber in server.clients)
+
+
+def test_sources_agree(itch, db):
+    fin, _ = itch
+    itch_list = sorted(itch_events(fin, 4.1, DATE, NAMES), key=lambda item: (item[0], item[1]['name']))
+    hdf5_list = sorted(hdf5_events(db, NAMES), key=lambda item: (item[0], item[1]['name']))
+    assert [ns for ns, _ in itch_list] == [ns for ns, _ in hdf5_list]
+    assert [event['type'] for _, event in itch_list] == [event['type'] for _, event in hdf5_list]
+
+
+def test_drop_counts_events():
+    n = 5000
+
+    async def slow(address):
+        reader, writer = await asyncio.open_connection(*address)
+        await asyncio.sleep(0.5)  # let the queue fill up
+        received = []
+        async for line in reader:
+            event = json.loads(line)
+            if event['type'] == 'end':
+                break
+            received.append(event['refno'])
+        writer.close()
+        return received
+
+    source = [(ns, dict(event, pad='x' * 5000)) for ns, event in events(n)]  # more than the socket buffers hold
+    server = ReplayServer(source, speed=None, subscribers=2, max_batch=10, queue_size=2, policy='drop')
+    fast, received = replay(server, receive, slow)
+    fast_client, slow_client = sorted(server.clients, key=lambda subscriber: subscriber.dropped)
+    assert server.events == n and server.batches == n // 10
+    assert slow_client.dropped > 0 and slow_client.dropped % 10 == 0  # whole batches
+    assert slow_client.sent + slow_client.dropped == n
+    assert len(received) == slow_client.sent
+    assert received == sorted(received)  # what arrives is in order
+    assert fast_client.sent + fast_client.dropped == n and len(fast) == fast_client.sent
+
+
+@pytest.mark.parametrize('speed', [1.0, 4.0])
+def test_pacing(speed):
+    span = 0.4  # seconds of event time
+    start = 34200 * 10 ** 9
+    source = [(start + int(i * span * 10 ** 9 / 20), {'type': 'A', 'name': 'TEST', 'refno': i}) for i in range(21)]
+    arrivals = []
+
+    async def timed(address):
+        async for event in subscribe(*address):
+            arrivals.append((time.perf_counter(), event['refno']))
+
+    server = ReplayServer(source, speed=speed, subscribers=1, batch_interval=0.001)
+    replay(server, timed)
+    assert [refno for _, refno in arrivals] == list(range(21))
+    assert server.batches == 21
+    assert span / speed <= server.elapsed < span / speed + 0.5
+    first = arrivals[0][0]
+    for (arrival, refno), (ns, _) in zip(arrivals, source):
+        assert arrival - first >= (ns - start) / 10 ** 9 / speed - 0.02  # not before it is due
+
+
+@pytest.mark.parametrize('speed, batch_interval, max_batch, batches', [(None, 10 ** -5, 1000, 10),  # 11 events a batch
+                                                                      (None, 10 ** -5, 5, 20),
+                                                                      (None, 0, 1000, 100),
+                                                                      (1000.0, 10 ** -8, 1000, 10)])  # 10 us of events
+def test_batching(speed, batch_interval, max_batch, batches):
+    n = 100
+    server = ReplayServer(events(n), speed=speed, subscribers=1, batch_interval=batch_interval, max_batch=max_batch)
+    received, = replay(server, receive)
+    assert [event['refno'] for event in received] == list(range(n))
+    assert server.batches == server.clients[0].batches == batches
+
+
+@pytest.mark.parametrize('policy', ['block', 'drop'])
+def test_subscriber_disconnects_mid_replay(policy):
+    n = 20000
+
+    async def main():
+        server = ReplayServer(events(n), speed=None, subscribers=2, max_batch=10, queue_size=4, policy=policy)
+        task = asyncio.ensure_future(server.serve())
+        while server.address is None:
+            await asyncio.sleep(0.01)
+
+        async def reader():
+            return [event async for event in subscribe(*server.address)]
+
+        async def quitter():
+            reader, writer = await asyncio.open_connection(*server.address)
+            for _ in range(5):
+                json.loads(await reader.readline())
+            writer.close()
+
+        received, _ = await asyncio.gather(reader(), quitter())
+        await asyncio.wait_for(task, timeout=30)
+        return server, received
+
+    server, received = asyncio.run(main())
+    assert server.events == n
+    assert all(subscriber.closed for subscriber in server.clients)
+    if policy == 'block':
+        assert [event['refno'] for event in received] == list(range(n))
@@ -0,0 +1,73 @@
+import sqlite3
+import numpy as np
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS, read_sqlite
+from test_resume import Interrupt, interrupt_after
+
+GROUPS = ['messages', 'books', 'trades', 'noii', 'bars', 'orders']
+OPTIONS = {'bars': ('volume', 500), 'lifecycles': True}
+
+
+@pytest.fixture(scope='module')
+def dbs(itch, tmp_path_factory):
+    fin, _ = itch
+    root = tmp_path_factory.mktemp('sqlite')
+    hdf5, sqlite = str(root / 'db.hdf5'), str(root / 'db.sqlite')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=hdf5, **OPTIONS)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='sqlite', fout=sqlite, **OPTIONS)
+    return hdf5, sqlite
+
+
+def frames(data):
+    return data if isinstance(data, tuple) else (data,)
+
+
+@pytest.mark.parametrize('grp', GROUPS)
+@pytest.mark.parametrize('name', NAMES)
+def test_matches_hdf5(dbs, name, grp):
+    hdf5, sqlite = dbs
+    for x, y in zip(frames(pk.load_hdf5(hdf5, name, grp)), frames(pk.load_sqlite(sqlite, name, grp, DATE))):
+        assert len(x) == len(y)
+        assert list(x.columns) == list(y.columns)
+        np.testing.assert_array_equal(x.values.astype(float), y.values.astype(float))
+    with sqlite3.connect(sqlite) as conn:
+        count, = conn.execute('SELECT COUNT(*) FROM {} WHERE name = ? AND date = ?'.format(grp), (name, DATE)).fetchone()
+    assert count == len(x) and (count > 0 or grp == 'trades')
+
+
+def test_time_indexes(dbs):
+    _, sqlite = dbs
+    with sqlite3.connect(sqlite) as conn:
+        for grp in GROUPS:
+            indexes = [row[1] for row in conn.execute('PRAGMA index_list({})'.format(grp))]
+            assert '{}_name_date_time'.format(grp) in indexes
+            columns = [row[2] for row in conn.execute('PRAGMA index_info({}_name_date_time)'.format(grp))]
+            assert columns == ['name', 'date', 'time']
+            plan = conn.execute('EXPLAIN QUERY PLAN SELECT * FROM {} WHERE name = ? AND date = ? AND time >= ?'.format(grp),
+                                (NAMES[0], DATE, 0)).fetchall()
+            assert any('{}_name_date_time'.format(grp) in row[-1] for row in plan)
+
+
+def test_resume_truncates_one_date(itch, tmp_path):
+    """Resuming a job removes the rows it wrote after its last checkpoint, and no rows of other dates."""
+    fin, _ = itch
+    full, resumed = str(tmp_path / 'full.sqlite'), str(tmp_path / 'resumed.sqlite')
+    for fout in (full, resumed):
+        pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='sqlite', fout=fout, **OPTIONS)
+    before = read_sqlite(resumed)
+    pk.unpack(fin, 4.1, '020113', NLEVELS, NAMES, method='sqlite', fout=full, **OPTIONS)
+    with pytest.raises(Interrupt):
+        pk.unpack(fin, 4.1, '020113', NLEVELS, NAMES, method='sqlite', fout=resumed, checkpoint=300,
+                  on_message=interrupt_after(1000), **OPTIONS)
+    with sqlite3.connect(resumed) as conn:
+        written, = conn.execute("SELECT COUNT(*) FROM messages WHERE date = '020113'").fetchone()
+        for grp in GROUPS:  # rows written after the last checkpoint
+            conn.execute("INSERT INTO {0} SELECT * FROM {0} WHERE date = '020113'".format(grp))
+    assert written > 0
+    pk.unpack(fin, 4.1, '020113', NLEVELS, NAMES, method='sqlite', fout=resumed, checkpoint=300, resume=True, **OPTIONS)
+    assert read_sqlite(resumed) == read_sqlite(full)
+    for grp in GROUPS:
+        with sqlite3.connect(resumed) as conn:
+            rows = conn.execute('SELECT * FROM {} WHERE date = ? ORDER BY name, rowid'.format(grp), (DATE,)).fetchall()
+        assert rows == before[grp]
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from prickle.analysis import nodups
+from prickle.synthetic import DEFAULT_MIX
+from conftest import NAMES, NLEVELS
+
+DATES = ['010113', '010213']
+LABELS = ['A', 'C', 'D', 'E', 'F', 'U', 'X']
+
+
+@pytest.fixture(scope='module')
+def root(itch, tmp_path_factory):
+    """CSV output for two dates: the synthetic file, and a file without replace messages."""
+    root = tmp_path_factory.mktemp('statistics')
+    fin, _ = itch
+    pk.unpack(fin, 4.1, DATES[0], NLEVELS, NAMES, fout=str(root / DATES[0]))
+    fin = str(root / 'S010213-v41.bin')
+    mix = {key: value for key, value in DEFAULT_MIX.items() if key != 'U'}
+    pk.generate(fin, ver=4.1, names=NAMES, rate=500, duration=4, seed=3, mix=mix)
+    pk.unpack(fin, 4.1, DATES[1], NLEVELS, NAMES, fout=str(root / DATES[1]))
+    return root
+
+
+def aligned(messages, books):
+    """The book after each message, walking both files (replace messages write a book for the delete and the add)."""
+    rows = []
+    row = -1
+    for message_type in messages['type']:
+        row += 2 if message_type == 'U' else 1
+        rows.append(row)
+    assert row == len(books) - 1
+    return books.iloc[rows].reset_index(drop=True)
+
+
+def old_statistics(root, date, name):
+    """The tables of examples/statistics.py (before `daily_statistics`) for one date and name."""
+    messages = pd.read_csv('{}/{}/messages/messages_{}.txt'.format(root, date, name))
+    books = pd.read_csv('{}/{}/books/books_{}.txt'.format(root, date, name))
+    if (messages['type'] == 'U').any():
+        books = aligned(messages, books)  # the script failed in nodups otherwise
+    messages['time'] = messages['sec'] + messages['nano'] / 10 ** 9
+    messages = messages[(messages['time'] > 34200) & (messages['time'] < 57600)]
+    books['time'] = books['sec'] + books['nano'] / 10 ** 9
+    books = books[(books['time'] > 34200) & (books['time'] < 57600)]
+    books, messages = nodups(books, messages)
+    tables = {}
+    counts = messages['type'].value_counts().reindex(LABELS, fill_value=0)  # the script failed if a type was missing
+    tables['message_counts'] = pd.DataFrame([[date, name] + list(counts)], columns=['date', 'name'] + LABELS)
+    for key, column, bins in [('message_shares', 'shares', np.arange(0, 2025, 25)),
+                              ('message_times', 'time', np.arange(34200, 57900, 300)),
+                              ('message_nano', 'nano', np.arange(0, 10 ** 9 + 2 * 10 ** 7, 2 * 10 ** 7))]:
+        output = []
+        for label in LABELS:
+            values = messages[messages['type'] == label][column]
+            cnts, _ = np.histogram(np.abs(values) if column == 'shares' else values, bins)
+            output.append([date, name, label] + list(cnts))
+        tables[key] = pd.DataFrame(output, columns=['date', 'name', 'type'] + list(bins[:-1]))
+
+    messages = pd.read_csv('{}/{}/messages/messages_{}.txt'.format(root, date, name))
+    messages['time'] = messages['sec'] + messages['nano'] / 10 ** 9
+    messages = messages[(messages['time'] > 34200) & (messages['time'] < 57600)]
+    trades = pk.find_trades(messages).drop(columns='ns')
+    trades['date'] = date
+    trades['name'] = name
+    tables['trades'] = trades
+    hidden = pd.read_csv('{}/{}/trades/trades_{}.txt'.format(root, date, name))
+    hidden['time'] = hidden['sec'] + hidden['nano'] / 10 ** 9
+    hidden = hidden[(hidden['time'] > 34200) & (hidden['time'] < 57000)]
+    trades = pk.find_trades(hidden).drop(columns='ns')
+    trades['date'] = date
+    trades['name'] = name
+    tables['hidden_trades'] = trades
+    return tables
+
+
+@pytest.mark.parametrize('date', DATES)
+@pytest.mark.parametrize('name', NAMES)
+def test_matches_old_script(root, date, name):
+    messages = pd.read_csv('{}/{}/messages/messages_{}.txt'.format(root, date, name))
+    assert (messages['type'] == 'U').any() == (date == DATES[0])
+    expected = old_statistics(root, date, name)
+    tables = pk.daily_statistics(str(root), date, name).tables()
+    assert sorted(tables) == sorted(expected)
+    for key in tables:
+        pd.testing.assert_frame_equal(tables[key].reset_index(drop=True), expected[key].reset_index(drop=True),
+                                      check_dtype=False, obj=key)
+    assert tables['message_counts'][LABELS].values.sum() > 0 and len(tables['trades']) > 0
+
+
+def test_compute_statistics(root):
+    serial = pk.compute_statistics(str(root), DATES, NAMES).tables()
+    parallel = pk.compute_statistics(str(root), DATES, NAMES, nworkers=2).tables()
+    for key in serial:
+        pd.testing.assert_frame_equal(serial[key], parallel[key], obj=key)
+    assert len(serial['message_counts']) == len(DATES) * len(NAMES)
+
+
+def test_misaligned_books(root, tmp_path):
+    date, name = DATES[0], NAMES[0]
+    for grp in ('messages', 'books', 'trades'):
+        (tmp_path / date / grp).mkdir(parents=True)
+        lines = open('{}/{}/{}/{}_{}.txt'.format(root, date, grp, grp, name)).readlines()
+        if grp == 'books':
+            lines = lines[:-1]
+        with open(str(tmp_path / date / grp / '{}_{}.txt'.format(grp, name)), 'w') as f:
+            f.writelines(lines)
+    with pytest.raises(ValueError):
+        pk.daily_statistics(str(tmp_path), date, name)
@@ -0,0 +1,89 @@
+import os
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS, read_hdf5
+from test_resume import Interrupt, interrupt_after
+
+GROUPS = ['messages', 'books', 'trades', 'noii', 'bars', 'orders']
+OPTIONS = {'bars': ('volume', 500), 'lifecycles': True}
+
+
+def frames(data):
+    return data if isinstance(data, tuple) else (data,)
+
+
+@pytest.fixture(scope='module')
+def dbs(itch, tmp_path_factory):
+    fin, _ = itch
+    root = tmp_path_factory.mktemp('storage')
+    db, compacted = str(root / 'db.hdf5'), str(root / 'compact.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=db, **OPTIONS)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=compacted, compact=True, **OPTIONS)
+    return db, compacted
+
+
+def test_compact_keeps_data(dbs):
+    db, compacted = dbs
+    x, y = read_hdf5(db), read_hdf5(compacted)
+    assert sorted(x) == sorted(y)
+    for key in x:
+        np.testing.assert_array_equal(x[key], y[key], err_msg=key)
+    with h5py.File(compacted, 'r') as f:
+        assert f.attrs['compact']
+        dataset = f['messages'][NAMES[0]]
+        assert dataset.chunks is None and dataset.attrs['rows'] == len(dataset)
+        assert list(dataset.attrs['start']) == list(dataset[0, :2]) and list(dataset.attrs['stop']) == list(dataset[-1, :2])
+
+
+@pytest.mark.parametrize('grp', GROUPS)
+@pytest.mark.parametrize('name', NAMES)
+def test_mmap_matches_load(dbs, name, grp):
+    db, compacted = dbs
+    for x, y, z in zip(frames(pk.load_hdf5(db, name, grp)), frames(pk.load_hdf5(compacted, name, grp)),
+                       frames(pk.load_hdf5(compacted, name, grp, mmap=True))):
+        pd.testing.assert_frame_equal(x, y)
+        pd.testing.assert_frame_equal(y, z)
+    with h5py.File(compacted, 'r') as f:
+        data = f['orderbooks' if grp == 'books' else grp][name][...]
+    mapped = pk.mmap_hdf5(compacted, name, grp)
+    assert isinstance(mapped, np.memmap)
+    np.testing.assert_array_equal(mapped, data)
+    with pytest.raises(ValueError):
+        pk.mmap_hdf5(db, name, grp)  # chunked
+
+
+def test_compact_refuses_unfinished_job(itch, tmp_path):
+    fin, _ = itch
+    full, db = str(tmp_path / 'full.hdf5'), str(tmp_path / 'db.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=full)
+    with pytest.raises(Interrupt):
+        pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=db, checkpoint=100,
+                  on_message=interrupt_after(500))
+    with pytest.raises(ValueError):
+        pk.compact(db)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=db, checkpoint=100, resume=True, compact=True)
+    assert not os.path.exists(db + '.checkpoint')
+    x, y = read_hdf5(full), read_hdf5(db)
+    for key in x:
+        np.testing.assert_array_equal(x[key], y[key], err_msg=key)
+
+
+def test_rerun_into_compacted_database(itch, tmp_path):
+    fin, _ = itch
+    full, db = str(tmp_path / 'full.hdf5'), str(tmp_path / 'db.hdf5')
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES, method='hdf5', fout=full)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES[:2], method='hdf5', fout=db, compact=True)
+    pk.unpack(fin, 4.1, DATE, NLEVELS, NAMES[1:], method='hdf5', fout=db)  # replaces a compacted name, adds one
+    with h5py.File(db, 'r') as f:
+        assert 'compact' not in f.attrs
+        assert f['messages'][NAMES[0]].chunks is None and f['messages'][NAMES[1]].chunks is not None
+    x, y = read_hdf5(full), read_hdf5(db)
+    assert sorted(x) == sorted(y)
+    for key in x:
+        np.testing.assert_array_equal(x[key], y[key], err_msg=key)
+    pk.compact(db)
+    for name in NAMES:
+        pd.testing.assert_frame_equal(pk.load_hdf5(db, name, 'messages', mmap=True), pk.load_hdf5(full, name, 'messages'))
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+import prickle as pk
+from conftest import NAMES, DATE, NLEVELS, read_hdf5
+
+VERSIONS = {4.0: 'S010113-v40.bin', 4.1: 'S010113-v41.bin', 5.0: 'S010113-v50.bin'}
+
+
+@pytest.fixture(scope='module', params=sorted(VERSIONS))
+def generated(request, tmp_path_factory):
+    ver = request.param
+    path = str(tmp_path_factory.mktemp('unpack') / VERSIONS[ver])
+    books = pk.generate(path, ver=ver, names=NAMES, rate=400, duration=3, seed=2, nlevels=NLEVELS)
+    return ver, path, books
+
+
+@pytest.mark.parametrize('options', [{}, {'nworkers': 2, 'chunk_size': 4096}])
+def test_hdf5_books_match_generate(generated, tmp_path, options):
+    ver, fin, books = generated
+    fout = str(tmp_path / 'db.hdf5')
+    pk.unpack(fin, ver, DATE, NLEVELS, NAMES, method='hdf5', fout=fout, manifest=False, **options)
+    data = read_hdf5(fout)
+    for name in NAMES:
+        assert len(books[name]) > 100
+        np.testing.assert_array_equal(data['orderbooks/{}'.format(name)], books[name], err_msg=name)
+
+
+def test_csv_books_match_generate(generated, tmp_path):
+    ver, fin, books = generated
+    fout = str(tmp_path / 'csv')
+    pk.unpack(fin, ver, DATE, NLEVELS, NAMES, method='csv', fout=fout, manifest=False)
+    for name in NAMES:
+        df = pd.read_csv('{}/books/books_{}.txt'.format(fout, name))
+        assert (df.pop('name') == name).all()
+        expected = books[name].astype(float)
+        prices = expected[:, 2:2 + 2 * NLEVELS]
+        prices[prices != -1] /= 10 ** 4
+        np.testing.assert_allclose(df.values, expected, err_msg=name)